@@ -0,0 +1,186 @@
+## -*- python -*-
+
+## compressed SND recordings (kiwirecorder.py --adpcm): the IMA-ADPCM frames are stored as received,
+## a quarter of the size of the decoded int16 samples
+##
+## file layout (little-endian):
+##  * header:  'KIWIADPC', u16 version, u16 reserved, f64 sample rate, u32 length, metadata (JSON)
+##  * frames:  u16 payload length, u8 flags, u32 seq, u16 S-meter, u8 step index, i16 previous sample, payload
+##             the decoder state before every frame is stored, so any frame can be decoded on its own
+##             with exactly the state the receiving decoder had
+##  * index:   'KIDX', u32 count, count * (u64 file offset, u64 first sample, u32 frame number),
+##             one entry every index_interval frames
+##  * trailer: u64 offset of the index, 'KIWIEND1'
+## a file without index (e.g. after a crash) is indexed by scanning its frames
+
+import json
+import os
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .client import AdpcmFrame, ImaAdpcmDecoderNumpy
+
+MAGIC         = b'KIWIADPC'
+VERSION       = 1
+_file_header  = struct.Struct('<8sHHdI')
+_frame_header = struct.Struct('<HBIHBh')
+_index_header = struct.Struct('<4sI')
+_index_entry  = struct.Struct('<QQI')
+_trailer      = struct.Struct('<Q8s')
+TRAILER_MAGIC = b'KIWIEND1'
+
+class KiwiAdpcmFileError(Exception):
+    pass
+
+IndexEntry = namedtuple('IndexEntry', 'offset sample frame')
+
+class AdpcmWriter(object):
+    """ Writes one compressed recording; the interface matches WavWriter (kiwi/wavwriter.py)
+        except that write_frame() takes an AdpcmFrame instead of samples.
+        The frames are flushed to the file at least every header_interval seconds """
+    def __init__(self, filename, samplerate, metadata=None, header_interval=1, index_interval=64, buffer_size=1<<16):
+        self.filename = filename
+        self._header_interval = header_interval
+        self._t_header = time.time()
+        self._index_interval = index_interval
+        self._fp = open(filename, 'wb', buffer_size)
+        info = json.dumps(metadata or {}).encode()
+        self._fp.write(_file_header.pack(MAGIC, VERSION, 0, samplerate, len(info)))
+        self._fp.write(info)
+        self._offset = _file_header.size + len(info)
+        self._index = []
+        self._num_frames = 0
+        self._num_samples = 0
+        self._closed = False
+
+    def write_frame(self, frame):
+        if self._num_frames % self._index_interval == 0:
+            self._index.append(IndexEntry(self._offset, self._num_samples, self._num_frames))
+        self._fp.write(_frame_header.pack(len(frame.data), frame.flags, frame.seq, frame.smeter,
+                                          frame.index, frame.prev))
+        self._fp.write(frame.data)
+        self._offset += _frame_header.size + len(frame.data)
+        self._num_frames += 1
+        self._num_samples += 2*len(frame.data)
+        if time.time() - self._t_header >= self._header_interval:
+            self.update_header()
+
+    def update_header(self):
+        """ there are no sizes to update: the frames are flushed """
+        self._t_header = time.time()
+        self._fp.flush()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._fp.write(_index_header.pack(b'KIDX', len(self._index)))
+            for e in self._index:
+                self._fp.write(_index_entry.pack(*e))
+            self._fp.write(_trailer.pack(self._offset, TRAILER_MAGIC))
+        finally:
+            self._fp.close()
+
+class AdpcmReader(object):
+    """ Reads files written by AdpcmWriter """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            header = fp.read(_file_header.size)
+            if len(header) != _file_header.size:
+                raise KiwiAdpcmFileError('%s: file too short' % filename)
+            magic,version,_,self.samplerate,n = _file_header.unpack(header)
+            if magic != MAGIC:
+                raise KiwiAdpcmFileError('%s: not a compressed Kiwi recording' % filename)
+            if version != VERSION:
+                raise KiwiAdpcmFileError('%s: unsupported version %d' % (filename, version))
+            self.metadata = json.loads(fp.read(n).decode())
+            self._data_start = _file_header.size + n
+            self._read_index(fp)
+
+    def _read_index(self, fp):
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        if size >= self._data_start + _trailer.size:
+            fp.seek(size - _trailer.size)
+            offset,magic = _trailer.unpack(fp.read(_trailer.size))
+            if magic == TRAILER_MAGIC:
+                fp.seek(offset)
+                tag,count = _index_header.unpack(fp.read(_index_header.size))
+                if tag != b'KIDX':
+                    raise KiwiAdpcmFileError('%s: corrupt index' % self.filename)
+                data = fp.read(count * _index_entry.size)
+                self.index = [IndexEntry(*_index_entry.unpack_from(data, i*_index_entry.size)) for i in range(count)]
+                self.data_end = offset
+                self.num_samples = self._count_samples(fp, self.index[-1], offset) if self.index else 0
+                return
+        ## no index: scan the frames, ignoring an incomplete last frame
+        self.index = []
+        self.data_end = self._data_start
+        fp.seek(self._data_start)
+        num_samples = 0
+        num_frames = 0
+        while True:
+            header = fp.read(_frame_header.size)
+            if len(header) < _frame_header.size:
+                break
+            n = _frame_header.unpack(header)[0]
+            if self.data_end + _frame_header.size + n > size:
+                break
+            if num_frames % 64 == 0:
+                self.index.append(IndexEntry(self.data_end, num_samples, num_frames))
+            fp.seek(n, os.SEEK_CUR)
+            self.data_end += _frame_header.size + n
+            num_samples += 2*n
+            num_frames += 1
+        self.num_samples = num_samples
+
+    def _count_samples(self, fp, entry, end):
+        num_samples = entry.sample
+        for frame in self._frames(fp, entry.offset, end):
+            num_samples += 2*len(frame.data)
+        return num_samples
+
+    def _frames(self, fp, offset, end):
+        fp.seek(offset)
+        while offset < end:
+            n,flags,seq,smeter,index,prev = _frame_header.unpack(fp.read(_frame_header.size))
+            data = fp.read(n)
+            if len(data) != n:
+                raise KiwiAdpcmFileError('%s: incomplete frame' % self.filename)
+            offset += _frame_header.size + n
+            yield AdpcmFrame(seq, flags, smeter, index, prev, data)
+
+    def frames(self, start=None, end=None):
+        """ AdpcmFrames between the file offsets start and end (default: all) """
+        with open(self.filename, 'rb') as fp:
+            for frame in self._frames(fp, self._data_start if start is None else start,
+                                      self.data_end if end is None else end):
+                yield frame
+
+    def decode(self, start=None, end=None):
+        """ decodes the frames between two file offsets. Returns the int16 samples, the decoder state
+            stored with the first frame and the state after the last one, and the number of frames whose
+            stored state does not continue the frame before them (lost frames) """
+        decoder = ImaAdpcmDecoderNumpy()
+        samples = []
+        first = state = None
+        num_discontinuities = 0
+        for frame in self.frames(start, end):
+            if state is None:
+                first = (frame.index, frame.prev)
+            elif state != (frame.index, frame.prev):
+                num_discontinuities += 1
+            decoder.index, decoder.prev = frame.index, frame.prev
+            samples.append(decoder.decode(frame.data))
+            state = (decoder.index, decoder.prev)
+        samples = np.concatenate(samples) if samples else np.zeros(0, dtype=np.int16)
+        return samples, first, state, num_discontinuities
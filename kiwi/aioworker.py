@@ -0,0 +1,193 @@
+## -*- python -*-
+
+## asyncio engine driving many KiwiSDRStream connections from a single thread
+##  * python3 only, so this module is not imported by kiwi/__init__.py
+##  * KiwiAsyncWorker is a drop-in replacement for KiwiWorker sharing its reconnect/busy/redirect policy
+##  * the websocket handshake (blocking) runs in the default executor, everything else in the loop thread
+##  * frames are read through mod_pywebsocket's BufferedStream: one recv_into() per readable event
+
+import asyncio
+import logging
+import threading
+import time
+
+from mod_pywebsocket._stream_base import ConnectionTerminatedException
+from .client import KiwiServerTerminatedConnection
+from .rigctld import Rigctld
+from .worker import KiwiWorkerPolicy
+
+class KiwiAsyncWorker(KiwiWorkerPolicy):
+    """ Coroutine counterpart of KiwiWorker; start() schedules it on a KiwiAsyncEngine """
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None, engine=None):
+        self._recorder, self._options, self._run_event = args
+        self._recorder._reader = True
+        self._recorder._buffered_ws = True
+        self._engine = engine
+        self._event = threading.Event()
+        self._rigctld = None
+        if self._options.rigctl_enabled:
+            self._rigctld = Rigctld(self._recorder, self._options.rigctl_port, self._options.rigctl_address)
+        self._readable = None
+        self._name = '%s:%s %s' % (self._options.server_host, self._options.server_port, self._recorder._type)
+        self._lag_sum = self._lag_max = 0
+        self._num_lags = self._num_wakeups = self._num_bytes = 0
+        self._t_first = self._t_report = None
+
+    def _do_run(self):
+        return self._run_event.is_set()
+
+    def start(self):
+        self._engine.add(self)
+
+    async def _wait(self, timeout):
+        """ like threading.Event.wait(timeout) but without blocking the loop """
+        t_end = time.time() + timeout
+        while self._do_run() and not self._event.is_set() and time.time() < t_end:
+            await asyncio.sleep(min(0.1, t_end - time.time()))
+
+    async def run(self):
+        self._init_policy()
+        loop = self._engine._loop
+
+        while self._do_run():
+            try:
+                await loop.run_in_executor(None, self._recorder.connect, self._options.server_host, self._options.server_port)
+            except Exception as e:
+                timeout = self._on_connect_error(e)
+                if timeout is None:
+                    break
+                if timeout > 0:
+                    await self._wait(timeout)
+                continue
+
+            try:
+                self._recorder.open()
+                await self._receive_loop(loop)
+            except Exception as e:
+                timeout = self._on_run_error(e)
+                if timeout is None:
+                    break
+                if timeout > 0:
+                    await self._wait(timeout)
+                continue
+
+        self._finish()
+        self._report_lag(True)
+
+    async def _receive_loop(self, loop):
+        sock = self._recorder._socket
+        stream = self._recorder._stream
+        self._readable = asyncio.Event()
+        timeout = self._options.socket_timeout
+        t_last = time.time()
+        fd = sock.fileno()
+        loop.add_reader(fd, self._readable.set)
+        try:
+            while self._do_run():
+                try:
+                    await asyncio.wait_for(self._readable.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    if timeout and time.time() - t_last > timeout:
+                        logging.debug('ConnectionTerminatedException')
+                        raise KiwiServerTerminatedConnection('server closed the connection unexpectedly')
+                    continue
+                self._readable.clear()
+                try:
+                    n = stream.fill()
+                except ConnectionTerminatedException:
+                    logging.debug('ConnectionTerminatedException')
+                    raise KiwiServerTerminatedConnection('server closed the connection unexpectedly')
+                t_last = time.time()
+                self._update_lag(t_last, n)
+                while stream.has_message():
+                    self._recorder._process_ws_message(self._recorder._receive_ws_message())
+                    self._recorder._check_time_limit()
+                # do things like freq changes while not receiving sound
+                if self._rigctld:
+                    self._rigctld.run()
+        finally:
+            loop.remove_reader(fd)
+
+    def _update_lag(self, now, num_bytes):
+        """ lag estimate: how many seconds of stream data had queued up before the loop got to this connection """
+        if self._t_first is None:
+            self._t_first = self._t_report = now
+        self._num_bytes += num_bytes
+        self._num_wakeups += 1
+        if now - self._t_first < 1:
+            return
+        lag = num_bytes * (now - self._t_first) / self._num_bytes
+        self._num_lags += 1
+        self._lag_sum += lag
+        self._lag_max = max(self._lag_max, lag)
+        if lag > self._engine.lag_warn:
+            logging.warn('%s: event loop lagging by %.2f sec' % (self._name, lag))
+        if now - self._t_report > self._engine.report_interval:
+            self._t_report = now
+            self._report_lag(False)
+
+    def get_lag(self):
+        """ (mean,max) lag in seconds """
+        n = max(self._num_lags, 1)
+        return self._lag_sum/n, self._lag_max
+
+    def _report_lag(self, final):
+        if self._num_wakeups == 0:
+            return
+        mean,max = self.get_lag()
+        logging.log(logging.INFO if final else logging.DEBUG,
+                    '%s: lag mean %.1f ms max %.1f ms (%d wakeups)' % (self._name, 1e3*mean, 1e3*max, self._num_wakeups))
+
+class KiwiAsyncEngine(threading.Thread):
+    """ Runs the event loop for all KiwiAsyncWorkers in one thread.
+        The thread is started by the first add() and exits once run_event is cleared
+        and all workers have finished. A KeepaliveWheel, if given, is ticked by the loop heartbeat """
+    def __init__(self, run_event, lag_warn=1.0, report_interval=10, keepalive_wheel=None):
+        super(KiwiAsyncEngine, self).__init__(name='KiwiAsyncEngine')
+        self._run_event = run_event
+        self._loop = asyncio.new_event_loop()
+        self._tasks = set()
+        self._loop_lag_max = 0
+        self._started = threading.Event()
+        self._start_lock = threading.Lock()   ## add() is called from the per-host launcher threads
+        self._event = threading.Event()
+        self._keepalive_wheel = keepalive_wheel
+        self.lag_warn = lag_warn
+        self.report_interval = report_interval
+
+    def add(self, worker):
+        with self._start_lock:
+            if not self._started.is_set():
+                self.start()
+                self._started.wait()
+        self._loop.call_soon_threadsafe(self._add_task, worker)
+
+    def _add_task(self, worker):
+        task = self._loop.create_task(worker.run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._started.set()
+        interval = 0.1
+        t_next = self._loop.time() + interval
+        while self._run_event.is_set() or self._tasks:
+            await asyncio.sleep(interval)
+            ## loop lag: how late this timer fired
+            now = self._loop.time()
+            lag = now - t_next
+            t_next = now + interval
+            if self._keepalive_wheel is not None:
+                self._keepalive_wheel.tick()
+            if lag > self._loop_lag_max:
+                self._loop_lag_max = lag
+                if lag > self.lag_warn:
+                    logging.warn('event loop lag %.2f sec with %d connections' % (lag, len(self._tasks)))
+        logging.info('event loop: max lag %.1f ms' % (1e3*self._loop_lag_max))
@@ -0,0 +1,168 @@
+## -*- python -*-
+
+## catalog of recorded files in an SQLite database (kiwirecorder.py --catalog, kiwi_catalog.py)
+##  * one row per file: path, start/end time, frequency, mode, host, station, sample rate,
+##    GNSS status and size; indexed by start time and frequency
+##  * connection threads queue rows and return immediately; a background thread owning the
+##    database connection inserts everything queued in one transaction every batch_interval seconds
+##  * the database is in WAL mode so that queries do not block the recorder and vice versa
+
+import calendar
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from urllib import pathname2url  ## python2
+except ImportError:
+    from urllib.request import pathname2url  ## python3
+
+COLUMNS = ('path', 'start', 'end', 'frequency', 'mode', 'host', 'port', 'station',
+           'sample_rate', 'channels', 'gnss', 'bytes')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS recordings (
+    path        TEXT PRIMARY KEY,
+    start       REAL NOT NULL,  -- unix time
+    end         REAL NOT NULL,
+    frequency   REAL,           -- kHz
+    mode        TEXT,
+    host        TEXT,
+    port        INTEGER,
+    station     TEXT,
+    sample_rate REAL,
+    channels    INTEGER,
+    gnss        INTEGER,        -- last_gps_solution of the last block (IQ with --kiwi-wav), else NULL
+    bytes       INTEGER
+);
+CREATE INDEX IF NOT EXISTS recordings_start     ON recordings(start);
+CREATE INDEX IF NOT EXISTS recordings_end       ON recordings(end);
+CREATE INDEX IF NOT EXISTS recordings_frequency ON recordings(frequency, start);
+'''
+
+def connect(path, timeout=30):
+    db = sqlite3.connect(path, timeout=timeout)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(_SCHEMA)
+    return db
+
+def connect_readonly(path, timeout=30):
+    """ for queries: the database must exist, it is neither created nor modified """
+    return sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(path)), timeout=timeout, uri=True)
+
+class Catalog(object):
+    def __init__(self, path, batch_interval=1.0):
+        self.path = path
+        self._batch_interval = batch_interval
+        self._cond = threading.Condition()
+        self._rows = []
+        self._stopping = False
+        self._thread = None
+        self.num_rows = 0
+        self.num_batches = 0
+
+    def start(self):
+        ## created here so that errors (e.g. an unwritable path) are reported at startup
+        connect(self.path).close()
+        self._thread = threading.Thread(target=self._run, name='Catalog')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def add(self, **row):
+        """ queues a row; bytes=None is filled in from the size of the file when it is inserted,
+            so it must be given for files which are still being written (--compress) """
+        with self._cond:
+            self._rows.append(row)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+        logging.info('catalog %s: %d files in %d transactions' % (self.path, self.num_rows, self.num_batches))
+
+    def _run(self):
+        db = connect(self.path)
+        try:
+            while True:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(self._batch_interval)
+                    rows,self._rows = self._rows,[]
+                    stopping = self._stopping
+                if rows:
+                    try:
+                        self._insert(db, rows)
+                    except sqlite3.Error as e:
+                        logging.error('catalog %s: %s (%d files not recorded)' % (self.path, e, len(rows)))
+                if stopping:
+                    break
+        finally:
+            db.close()
+
+    def _insert(self, db, rows):
+        for row in rows:
+            if row.get('bytes') is None:
+                try:
+                    row['bytes'] = os.path.getsize(row['path'])
+                except OSError:
+                    row['bytes'] = None
+        with db:
+            db.executemany('INSERT OR REPLACE INTO recordings (%s) VALUES (%s)'
+                           % (','.join(COLUMNS), ','.join('?'*len(COLUMNS))),
+                           [tuple(row.get(c) for c in COLUMNS) for row in rows])
+        self.num_rows += len(rows)
+        self.num_batches += 1
+
+def query(db, t_from=None, t_to=None, f_min=None, f_max=None, mode=None, station=None, host=None,
+          gnss=False, limit=None):
+    """ rows (as dicts) of recordings overlapping [t_from,t_to] within [f_min,f_max] kHz, ordered by start time """
+    where,args = [],[]
+    if t_from is not None:
+        where.append('end >= ?')
+        args.append(t_from)
+    if t_to is not None:
+        where.append('start <= ?')
+        args.append(t_to)
+    if f_min is not None:
+        where.append('frequency >= ?')
+        args.append(f_min)
+    if f_max is not None:
+        where.append('frequency <= ?')
+        args.append(f_max)
+    for column,value in (('mode', mode), ('station', station), ('host', host)):
+        if value is not None:
+            where.append('%s = ?' % column)
+            args.append(value)
+    if gnss:
+        where.append('gnss IS NOT NULL AND gnss NOT IN (254, 255)')
+    sql = 'SELECT %s FROM recordings' % ','.join(COLUMNS)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY start'
+    if limit is not None:
+        sql += ' LIMIT %d' % limit
+    return [dict(zip(COLUMNS, r)) for r in db.execute(sql, args)]
+
+def parse_time(s):
+    """ unix time from YYYY-MM-DD[THH:MM[:SS]][Z] (UTC) or a number """
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    s = s.rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError('cannot parse time "%s"' % s)
+
+def format_time(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
@@ -4,8 +4,10 @@ import array, os
 import logging
 import socket
 import struct
+import threading
 import time
 import numpy as np
+from collections import namedtuple
 
 try:
     import urllib.parse as urllib
@@ -16,7 +18,7 @@ import sys
 if sys.version_info > (3,):
     buffer = memoryview
     def bytearray2str(b):
-        return b.decode('ascii')
+        return str(b, 'ascii')
 else:
     def bytearray2str(b):
         return str(b)
@@ -24,7 +26,7 @@ else:
 import json
 import mod_pywebsocket.common
 from mod_pywebsocket._stream_base import ConnectionTerminatedException
-from mod_pywebsocket.stream import Stream, StreamOptions
+from mod_pywebsocket.stream import BufferedStream, Stream, StreamOptions
 from .wsclient import ClientHandshakeProcessor, ClientRequest
 
 #
@@ -87,6 +89,74 @@ class ImaAdpcmDecoder(object):
             samples.append(sample1)
         return samples
 
+## (step index x nibble) state tables used by the NumPy decoder
+_adpcmIndexAdjust = np.array(indexAdjustTable, dtype=np.int64)
+_adpcmDiffTable   = np.zeros((len(stepSizeTable), 16), dtype=np.int64)
+for _i,_step in enumerate(stepSizeTable):
+    for _code in range(16):
+        _diff = _step >> 3
+        if _code & 1:
+            _diff += _step >> 2
+        if _code & 2:
+            _diff += _step >> 1
+        if _code & 4:
+            _diff += _step
+        _adpcmDiffTable[_i, _code] = -_diff if _code & 8 else _diff
+
+def _clamped_scan(x0, deltas, xmin, xmax):
+    """ x[n] = clamp(x[n-1] + deltas[n], xmin, xmax) for all n as a parallel prefix scan.
+        A clamped shift clamp(x+a, l, h) composed with another one is again a clamped shift,
+        so log2(n) vectorized doubling steps compute all prefixes exactly """
+    n = len(deltas)
+    a = np.array(deltas, dtype=np.int64)
+    l = np.full(n, xmin, dtype=np.int64)
+    h = np.full(n, xmax, dtype=np.int64)
+    s = 1
+    while s < n:
+        ## compose f=[i-s] (applied first) with g=[i]
+        new_l = np.minimum(np.maximum(l[:-s] + a[s:], l[s:]), h[s:])
+        new_h = np.minimum(np.maximum(h[:-s] + a[s:], l[s:]), h[s:])
+        new_a = a[:-s] + a[s:]
+        a[s:], l[s:], h[s:] = new_a, new_l, new_h
+        s *= 2
+    return np.minimum(np.maximum(x0 + a, l), h)
+
+def _clamped_cumsum(x0, deltas, xmin, xmax):
+    """ x[n] = clamp(x[n-1] + deltas[n], xmin, xmax) for all n, starting at x0 """
+    x = x0 + np.cumsum(deltas, dtype=np.int64)
+    ## exact when only the lower bound is hit (reflection at xmin), which is the common case
+    x += np.maximum(np.maximum.accumulate(xmin - x), 0)
+    if x.max() <= xmax:
+        return x
+    return _clamped_scan(x0, deltas, xmin, xmax)
+
+class ImaAdpcmDecoderNumpy(ImaAdpcmDecoder):
+    """ Table-driven IMA-ADPCM decoder working on a whole frame at once.
+        Bit-exact with ImaAdpcmDecoder including the decoder state carried between calls,
+        but returns an int16 numpy array instead of array('h') """
+    def decode(self, data):
+        b = np.frombuffer(data, dtype=np.uint8)
+        if len(b) == 0:
+            return np.zeros(0, dtype=np.int16)
+        codes = np.empty(2*len(b), dtype=np.uint8)
+        codes[0::2] = b & 0x0F
+        codes[1::2] = b >> 4
+        index = _clamped_cumsum(self.index, _adpcmIndexAdjust[codes], 0, len(stepSizeTable) - 1)
+        ## the step size of a sample is given by the index before its own adjustment
+        index_before = np.empty_like(index)
+        index_before[0] = self.index
+        index_before[1:] = index[:-1]
+        samples = _clamped_cumsum(self.prev, _adpcmDiffTable[index_before, codes], -32768, 32767)
+        self.index = int(index[-1])
+        self.prev = int(samples[-1])
+        return samples.astype(np.int16)
+
+## set the environment variable USE_NUMPY_ADPCM to 'False' to force the pure-Python decoder
+USE_NUMPY_ADPCM = os.environ.get('USE_NUMPY_ADPCM', 'True') != 'False'
+
+def new_adpcm_decoder():
+    return ImaAdpcmDecoderNumpy() if USE_NUMPY_ADPCM else ImaAdpcmDecoder()
+
 #
 # KiwiSDR WebSocket client
 #
@@ -110,9 +180,49 @@ class KiwiServerTerminatedConnection(KiwiError):
 class KiwiUnknownModulation(KiwiError):
     pass
 
+#
+# frame headers
+#
+
+_snd_header  = struct.Struct('<BI')     ## flags, seq
+_snd_smeter  = struct.Struct('>H')
+_gnss_header = struct.Struct('<BBII')
+_wf_header   = struct.Struct('<III')    ## x_bin_server, flags_x_zoom_server, seq
+
+class GNSSHeader(namedtuple('GNSSHeader', 'last_gps_solution dummy gpssec gpsnsec')):
+    """ GNSS timestamp of an IQ frame. Fields can also be read by name like the dict used before,
+        e.g. gps['gpssec'] """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    @classmethod
+    def unpack_from(cls, data, offset=0):
+        return tuple.__new__(cls, _gnss_header.unpack_from(data, offset))
+
+class AdpcmFrame(namedtuple('AdpcmFrame', 'seq flags smeter index prev data')):
+    """ compressed SND frame as received, with the ADPCM decoder state (step index, previous sample) before it """
+    __slots__ = ()
+
 class KiwiSDRStreamBase(object):
     """KiwiSDR WebSocket stream base client."""
 
+    ## when set, frames are read through a BufferedStream: binary message bodies are then
+    ## memoryviews into its receive buffer, valid only until the next message is received
+    _buffered_ws = False
+
+    ## keepalives: 0 sends one after every SND/W/F frame, otherwise at most one per interval (sec).
+    ## With a KeepaliveWheel (kiwi/keepalive.py) the interval is timed by the wheel shared by
+    ## all connections instead of per-frame clock reads
+    _keepalive_interval = 0
+    _keepalive_wheel = None
+
+    ## a WsCapture (kiwi/replay.py) to which every received message is written
+    _ws_capture = None
+
     def __init__(self):
         self._socket = None
         self._decoder = None
@@ -127,6 +237,11 @@ class KiwiSDRStreamBase(object):
         self._highcut = 0
         self._freq = 0
         self._stream = None
+        self._keepalive_due = True
+        self._last_keepalive = 0
+        self._sent_frames = self._sent_bytes = 0  ## of closed streams
+        ## set once the server has sent sample_rate, wf_setup or ext_client_init (and stays set over reconnects)
+        self.stream_up = threading.Event()
 
     def get_mod(self):
         return self._modulation
@@ -150,6 +265,11 @@ class KiwiSDRStreamBase(object):
 
     def _prepare_stream(self, host, port, which):
         self._stream_name = which
+        if self._stream is not None:
+            self._sent_frames += self._stream.sent_frame_count
+            self._sent_bytes  += self._stream.sent_byte_count
+        self._keepalive_due = True
+        self._last_keepalive = 0
         self._socket = socket.create_connection(address=(host, port), timeout=self._options.socket_timeout)
         uri = '%s/%d/%s' % ('/wb' if self._options.wideband else '', self._options.ws_timestamp, which)
         handshake = ClientHandshakeProcessor(self._socket, host, port)
@@ -162,7 +282,10 @@ class KiwiSDRStreamBase(object):
         stream_option.mask_send = True
         stream_option.unmask_receive = False
 
-        self._stream = Stream(request, stream_option)
+        if self._buffered_ws:
+            self._stream = BufferedStream(request, stream_option, self._socket)
+        else:
+            self._stream = Stream(request, stream_option)
 
     def _send_message(self, msg):
         if msg != 'SET keepalive':
@@ -186,7 +309,32 @@ class KiwiSDRStreamBase(object):
         self._send_message('SET geo=%s' % (geo))
 
     def _set_keepalive(self):
-        self._send_message('SET keepalive')
+        ## constant message: sent as one of a few pre-masked frames
+        self._stream.send_constant_message('SET keepalive')
+
+    def _keepalive(self):
+        """ keepalive after a received SND/W/F frame, rate limited by _keepalive_interval """
+        if self._keepalive_interval <= 0:
+            self._set_keepalive()
+            return
+        if self._keepalive_wheel is not None:
+            if not self._keepalive_due:
+                return
+            self._keepalive_due = False
+            self._keepalive_wheel.schedule(self, self._keepalive_interval)
+        else:
+            now = time.time()
+            if now - self._last_keepalive < self._keepalive_interval:
+                return
+            self._last_keepalive = now
+        self._set_keepalive()
+
+    def get_sent_stats(self):
+        """ (frames,bytes) sent over all connections made by this stream """
+        if self._stream is None:
+            return self._sent_frames, self._sent_bytes
+        return (self._sent_frames + self._stream.sent_frame_count,
+                self._sent_bytes  + self._stream.sent_byte_count)
 
     def _process_ws_message(self, message):
         tag = bytearray2str(message[0:3])
@@ -197,9 +345,20 @@ class KiwiSDRStreamBase(object):
 class KiwiSDRStream(KiwiSDRStreamBase):
     """KiwiSDR WebSocket stream client."""
 
+    ## IQ frames are passed to _process_iq_samples_int16() instead of being converted to complex
+    _iq_as_int16 = False
+    ## the complex IQ samples are a view of a buffer reused for every frame: set this only
+    ## if _process_iq_samples() does not keep a reference to them
+    _reuse_iq_buffer = False
+    ## compressed SND frames are also kept as received in _adpcm_frame (an AdpcmFrame)
+    ## while _process_audio_samples() is called with the decoded samples
+    _keep_adpcm = False
+
     def __init__(self, *args, **kwargs):
         super(KiwiSDRStream, self).__init__()
-        self._decoder = ImaAdpcmDecoder()
+        self._decoder = new_adpcm_decoder()
+        self._adpcm_frame = None
+        self._iq_buffer = None
         self._sample_rate = None
         self._version_major = None
         self._version_minor = None
@@ -218,6 +377,9 @@ class KiwiSDRStream(KiwiSDRStreamBase):
         self._stop = False
         self._need_nl = False
         self._kiwi_foff = 0
+        ## the dispatch tables hold bound methods, so that subclasses can override handlers
+        self._msg_param_dispatch = dict((name, getattr(self, method)) for name,method in self._msg_param_handlers.items())
+        self._tag_dispatch = dict((tag, getattr(self, method)) for tag,method in self._tag_handlers.items())
 
         self._default_passbands = {
             "am":  [ -4900, 4900 ],
@@ -379,103 +541,157 @@ class KiwiSDRStream(KiwiSDRStreamBase):
         self._kiwi_version = float(self._version_major) + float(self._version_minor) / 1000.
         logging.info("Kiwi server version: %d.%d" % (self._version_major, self._version_minor))
 
+    ## MSG parameters: handlers called as handler(value); the tables below name the methods
+
+    def _msg_load_cfg(self, value):
+        d = json.loads(urllib.unquote(value))
+        self._gps_pos = [float(x) for x in urllib.unquote(d['rx_gps'])[1:-1].split(",")[0:2]]
+        if self._options.idx == 0:
+            logging.info("GNSS position: lat,lon=[%+6.2f, %+7.2f]" % (self._gps_pos[0], self._gps_pos[1]))
+        self._on_gnss_position(self._gps_pos)
+
+    def _msg_too_busy(self, value):
+        raise KiwiTooBusyError('%s: all %s client slots taken' % (self._options.server_host, value))
+
+    def _msg_redirect(self, value):
+        raise KiwiRedirectError(urllib.unquote(value))
+
+    def _msg_badp(self, value):
+        if value == '1':
+            raise KiwiBadPasswordError('%s: bad password' % self._options.server_host)
+        if value == '5':
+            raise KiwiNoMultipleConnectionsError('%s: no multiple connections from the same IP address' % self._options.server_host)
+
+    def _msg_down(self, value):
+        raise KiwiDownError('%s: server is down atm' % self._options.server_host)
+
+    def _msg_audio_rate(self, value):
+        self._set_ar_ok(int(value), 44100)
+
+    def _msg_sample_rate(self, value):
+        self._sample_rate = float(value)
+        self._on_sample_rate_change()
+        # Optional, but is it?..
+        self.set_squelch(0, 0)
+        self._set_gen(0, 0)
+        # Required to get rolling
+        self._setup_rx_params()
+        # Also send a keepalive
+        self._set_keepalive()
+        self.stream_up.set()
+
+    def _msg_bandwidth(self, value):
+        self.MAX_FREQ = float(value)/1000       # allows e.g. 32 MHz Kiwis
+
+    def _msg_wf_setup(self, value):
+        # Required to get rolling
+        self._setup_rx_params()
+        # Also send a keepalive
+        self._set_keepalive()
+        self.stream_up.set()
+
+    def _msg_wf_cal(self, value):
+        if self._options.wf_cal is None:
+            self._options.wf_cal = int(value)
+
+    def _msg_version_maj(self, value):
+        self._version_major = int(value)
+        self._set_kiwi_version()
+
+    def _msg_version_min(self, value):
+        self._version_minor = int(value)
+        self._set_kiwi_version()
+
+    def _msg_ext_client_init(self, value):
+        logging.info("ext_client_init(is_locked)=%s" % value)
+        if value == "1":
+            raise Exception("Only one DRM instance can be run at a time on this Kiwi")
+        self._send_message('SET ext_no_keepalive')      # let server know not to expect async keepalive from us
+        self._setup_rx_params()
+        self.stream_up.set()
+
+    def _msg_freq_offset(self, value):
+        self._kiwi_foff = float(value)
+
+    _msg_param_handlers = {
+        'load_cfg':        '_msg_load_cfg',
+        'too_busy':        '_msg_too_busy',
+        'redirect':        '_msg_redirect',
+        'badp':            '_msg_badp',
+        'down':            '_msg_down',
+        'audio_rate':      '_msg_audio_rate',
+        'sample_rate':     '_msg_sample_rate',
+        'bandwidth':       '_msg_bandwidth',
+        'wf_setup':        '_msg_wf_setup',
+        'wf_cal':          '_msg_wf_cal',
+        'version_maj':     '_msg_version_maj',
+        'version_min':     '_msg_version_min',
+        'ext_client_init': '_msg_ext_client_init',
+        'freq_offset':     '_msg_freq_offset',
+    }
+
+    ## large config blobs: not logged
+    _msg_params_not_logged = frozenset(['load_cfg', 'load_dxcfg', 'load_dxcomm_cfg'])
+
     def _process_msg_param(self, name, value):
-        if name == 'extint_list_json':
-            value = urllib.unquote(value)
-
-        if name == 'load_cfg':
-            logging.debug("load_cfg: (cfg info not printed)")
-            d = json.loads(urllib.unquote(value))
-            self._gps_pos = [float(x) for x in urllib.unquote(d['rx_gps'])[1:-1].split(",")[0:2]]
-            if self._options.idx == 0:
-                logging.info("GNSS position: lat,lon=[%+6.2f, %+7.2f]" % (self._gps_pos[0], self._gps_pos[1]))
-            self._on_gnss_position(self._gps_pos)
-            return
-        elif name == 'load_dxcfg':
-            logging.debug("load_dxcfg: (cfg info not printed)")
-            return
-        elif name == 'load_dxcomm_cfg':
-            logging.debug("load_dxcomm_cfg: (cfg info not printed)")
-            return
+        if name in self._msg_params_not_logged:
+            logging.debug("%s: (cfg info not printed)" % name)
         else:
+            if name == 'extint_list_json':
+                value = urllib.unquote(value)
             logging.debug("recv MSG (%s) %s: %s", self._stream_name, name, value)
+        handler = self._msg_param_dispatch.get(name)
+        if handler is not None:
+            handler(value)
 
-        # Handle error conditions
-        if name == 'too_busy':
-            raise KiwiTooBusyError('%s: all %s client slots taken' % (self._options.server_host, value))
-        if name == 'redirect':
-            raise KiwiRedirectError(urllib.unquote(value))
-        if name == 'badp' and value == '1':
-            raise KiwiBadPasswordError('%s: bad password' % self._options.server_host)
-        if name == 'badp' and value == '5':
-            raise KiwiNoMultipleConnectionsError('%s: no multiple connections from the same IP address' % self._options.server_host)
-        if name == 'down':
-            raise KiwiDownError('%s: server is down atm' % self._options.server_host)
-
-        # Handle data items
-        if name == 'audio_rate':
-            self._set_ar_ok(int(value), 44100)
-        elif name == 'sample_rate':
-            self._sample_rate = float(value)
-            self._on_sample_rate_change()
-            # Optional, but is it?..
-            self.set_squelch(0, 0)
-            self._set_gen(0, 0)
-            # Required to get rolling
-            self._setup_rx_params()
-            # Also send a keepalive
-            self._set_keepalive()
-        elif name == 'bandwidth':
-            self.MAX_FREQ = float(value)/1000       # allows e.g. 32 MHz Kiwis
-        elif name == 'wf_setup':
-            # Required to get rolling
-            self._setup_rx_params()
-            # Also send a keepalive
-            self._set_keepalive()
-        elif name == 'wf_cal':
-            if self._options.wf_cal is None:
-                self._options.wf_cal = int(value)
-        elif name == 'version_maj':
-            self._version_major = int(value)
-            self._set_kiwi_version()
-        elif name == 'version_min':
-            self._version_minor = int(value)
-            self._set_kiwi_version()
-        elif name == 'ext_client_init':
-            logging.info("ext_client_init(is_locked)=%s" % value)
-            if value == "1":
-                raise Exception("Only one DRM instance can be run at a time on this Kiwi")
-            self._send_message('SET ext_no_keepalive')      # let server know not to expect async keepalive from us
-            self._setup_rx_params()
-        elif name == 'freq_offset':
-            self._kiwi_foff = float(value)
+    ## tags: handlers called as handler(body), looked up by name as above
+
+    def _tag_msg(self, body):
+        self._process_msg(bytearray2str(body[1:])) ## skip 1st byte
+
+    def _tag_snd(self, body):
+        try:
+            self._process_aud(body)
+        except Exception as e:
+            logging.error(e)
+        # Ensure we don't get kicked due to timeouts
+        self._keepalive()
+
+    def _tag_wf(self, body):
+        self._process_wf(body[1:]) ## skip 1st byte
+        # Ensure we don't get kicked due to timeouts
+        self._keepalive()
+
+    def _tag_ext(self, body):
+        body = bytearray2str(body[1:])
+        for pair in body.split(' '):
+            if '=' in pair:
+                name, value = pair.split('=', 1)
+                self._process_ext(name, urllib.unquote(value))
+            else:
+                name = pair
+                self._process_ext(name, None)
+
+    _tag_handlers = {
+        b'MSG': '_tag_msg',
+        b'SND': '_tag_snd',
+        b'W/F': '_tag_wf',
+        b'EXT': '_tag_ext',
+    }
+
+    def _process_ws_message(self, message):
+        ## the tag is looked up as bytes: no str decoding per message
+        handler = self._tag_dispatch.get(bytes(message[0:3]))
+        if handler is None:
+            return super(KiwiSDRStream, self)._process_ws_message(message)
+        handler(message[3:])
 
     def _process_message(self, tag, body):
-        if tag == 'MSG':
-            self._process_msg(bytearray2str(body[1:])) ## skip 1st byte
-        elif tag == 'SND':
-            try:
-                self._process_aud(body)
-            except Exception as e:
-                logging.error(e)
-            # Ensure we don't get kicked due to timeouts
-            self._set_keepalive()
-        elif tag == 'W/F':
-            self._process_wf(body[1:]) ## skip 1st byte
-            # Ensure we don't get kicked due to timeouts
-            self._set_keepalive()
-        elif tag == 'EXT':
-            body = bytearray2str(body[1:])
-            for pair in body.split(' '):
-                if '=' in pair:
-                    name, value = pair.split('=', 1)
-                    self._process_ext(name, urllib.unquote(value))
-                else:
-                    name = pair
-                    self._process_ext(name, None)
-        else:
+        handler = self._tag_dispatch.get(tag.encode('ascii'))
+        if handler is None:
             logging.warn("unknown tag %s" % tag)
-            pass
+            return
+        handler(body)
 
     def _process_msg(self, body):
         for pair in body.split(' '):
@@ -487,8 +703,8 @@ class KiwiSDRStream(KiwiSDRStreamBase):
                 self._process_msg_param(name, None)
 
     def _process_aud(self, body):
-        flags,seq, = struct.unpack('<BI', buffer(body[0:5]))
-        smeter,    = struct.unpack('>H',  buffer(body[5:7]))
+        flags,seq, = _snd_header.unpack_from(body, 0)
+        smeter,    = _snd_smeter.unpack_from(body, 5)
         data       = body[7:]
         rssi       = 0.1*smeter - 127
         ##logging.info("SND flags %2d seq %6d RSSI %6.1f len %d" % (flags, seq, rssi, len(data)))
@@ -546,17 +762,15 @@ class KiwiSDRStream(KiwiSDRStreamBase):
                         return
 
         if self._IQ_or_DRM_or_stereo:
-            gps = dict(zip(['last_gps_solution', 'dummy', 'gpssec', 'gpsnsec'], struct.unpack('<BBII', buffer(data[0:10]))))
+            gps = GNSSHeader.unpack_from(data)
             data = data[10:]
             if self._options.raw is True:
                 self._process_iq_samples_raw(seq, data)
+            elif self._iq_as_int16:
+                samples = np.frombuffer(data, dtype='>h', count=len(data)//2).astype(np.int16)
+                self._process_iq_samples_int16(seq, samples, rssi, gps)
             else:
-                count = len(data) // 2
-                samples = np.ndarray(count, dtype='>h', buffer=data).astype(np.float32)
-                cs      = np.ndarray(count//2, dtype=np.complex64)
-                cs.real = samples[0:count:2]
-                cs.imag = samples[1:count:2]
-                self._process_iq_samples(seq, cs, rssi, gps)
+                self._process_iq_samples(seq, self._decode_iq(data), rssi, gps)
         else:
             if self._options.raw is True:
                 if self._compression:
@@ -564,6 +778,9 @@ class KiwiSDRStream(KiwiSDRStreamBase):
                 self._process_audio_samples_raw(seq, data, rssi)
             else:
                 if self._compression:
+                    if self._keep_adpcm:
+                        self._adpcm_frame = AdpcmFrame(seq, flags, smeter, self._decoder.index, self._decoder.prev,
+                                                       bytes(data))
                     sarray = self._decoder.decode(data)
                     count = len(sarray)
                     samples = np.ndarray(count, dtype='int16', buffer=sarray)
@@ -572,8 +789,20 @@ class KiwiSDRStream(KiwiSDRStreamBase):
                     samples = np.ndarray(count, dtype='>h', buffer=data).astype(np.int16)
                 self._process_audio_samples(seq, samples, rssi)
 
+    def _decode_iq(self, data):
+        """ big-endian interleaved int16 I,Q -> complex64: one byteswapping conversion into an
+            interleaved float32 buffer which is then viewed as complex64 """
+        count = len(data) // 4 * 2
+        buf = self._iq_buffer
+        if buf is None or len(buf) != count:
+            buf = np.empty(count, dtype=np.float32)
+            if self._reuse_iq_buffer:
+                self._iq_buffer = buf
+        np.copyto(buf, np.frombuffer(data, dtype='>h', count=count), casting='unsafe')
+        return buf.view(np.complex64)
+
     def _process_wf(self, body):
-        x_bin_server,flags_x_zoom_server,seq, = struct.unpack('<III', buffer(body[0:12]))
+        x_bin_server,flags_x_zoom_server,seq, = _wf_header.unpack_from(body, 0)
         data = body[12:]
         #logging.info("W/F seq %d len %d" % (seq, len(data)))
         if self._options.raw is True:
@@ -622,6 +851,11 @@ class KiwiSDRStream(KiwiSDRStreamBase):
     def _process_iq_samples_raw(self, seq, data):
         pass
 
+    def _process_iq_samples_int16(self, seq, samples, rssi, gps):
+        """ used instead of _process_iq_samples() when _iq_as_int16 is set:
+            samples are interleaved I,Q in native int16 """
+        pass
+
     def _process_waterfall_samples(self, seq, samples):
         pass
 
@@ -670,6 +904,8 @@ class KiwiSDRStream(KiwiSDRStreamBase):
             self._set_auth('kiwi', self._options.password, self._options.tlimit_password)
 
     def close(self):
+        if self._keepalive_wheel is not None:
+            self._keepalive_wheel.cancel(self)
         if self._stream == None:
             return
         try:
@@ -680,23 +916,29 @@ class KiwiSDRStream(KiwiSDRStreamBase):
         except Exception as e:
             logging.error('websocket close: "%s"' % e)
 
+    def _receive_ws_message(self):
+        try:
+            received = self._stream.receive_message()
+            if received is None:
+                self._socket.close()
+                raise KiwiServerTerminatedConnection('server closed the connection cleanly')
+        except ConnectionTerminatedException:
+                logging.debug('ConnectionTerminatedException')
+                raise KiwiServerTerminatedConnection('server closed the connection unexpectedly')
+        if self._ws_capture is not None:
+            self._ws_capture.write(received)
+        return received
+
     def run(self):
         """Run the client."""
         if self._reader:
-            try:
-                received = self._stream.receive_message()
-                if received is None:
-                    self._socket.close()
-                    raise KiwiServerTerminatedConnection('server closed the connection cleanly')
-            except ConnectionTerminatedException:
-                    logging.debug('ConnectionTerminatedException')
-                    raise KiwiServerTerminatedConnection('server closed the connection unexpectedly')
-
-            self._process_ws_message(received)
+            self._process_ws_message(self._receive_ws_message())
         else:
             msg = self._writer_message()
             self._stream.send_message(msg)
+        self._check_time_limit()
 
+    def _check_time_limit(self):
         tlimit = self._options.tlimit
         time_limit = tlimit != None and self._start_time != None and time.time() - self._start_time > tlimit
         if time_limit or self._stop:
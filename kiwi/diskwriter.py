@@ -0,0 +1,204 @@
+## -*- python -*-
+
+## background disk writes shared by all connections of one process (kiwirecorder.py --async-writes)
+##  * connection threads queue (file, buffer) records and return immediately
+##  * the writer thread takes everything queued at once, groups it by file and coalesces
+##    consecutive appends into a single write() per file
+##  * writes to the same file are done in the order they were queued
+##  * files written since the last fsync are fsync'ed every fsync_interval seconds and when closed
+##  * a write error is re-raised in the connection thread by its next call
+
+import logging
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+
+import numpy as np
+
+class DiskWriter(object):
+    def __init__(self, fsync_interval=0, max_pending_bytes=64<<20):
+        self._fsync_interval = fsync_interval
+        self._max_pending_bytes = max_pending_bytes
+        self._cond = threading.Condition()
+        self._items = deque()
+        self._pending_bytes = 0
+        self._stopping = False
+        self._error = None
+        self._fds = {}          ## path -> fd
+        self._dirty = set()     ## paths written since the last fsync
+        self._t_fsync = time.time()
+        self._thread = None
+        ## statistics
+        self._latencies = deque(maxlen=1<<16)
+        self.num_records = 0
+        self.num_bytes = 0
+        self.num_syscalls = 0
+        self.num_fsyncs = 0
+        self.max_depth = 0
+        self.max_pending_bytes = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='DiskWriter')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _put(self, item, nbytes=0):
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            while self._pending_bytes > self._max_pending_bytes and self._error is None and not self._stopping:
+                self._cond.wait()
+            self._items.append(item)
+            self._pending_bytes += nbytes
+            self.max_depth = max(self.max_depth, len(self._items))
+            self.max_pending_bytes = max(self.max_pending_bytes, self._pending_bytes)
+            self._cond.notify_all()
+
+    def create(self, path):
+        """ creates (or truncates) path """
+        self._put(('create', path, None, None, time.time()))
+
+    def write(self, path, data, offset=None):
+        """ appends data (bytes) to path, or writes it at offset without moving the end of the file.
+            path is opened on first use if it was not create()d """
+        self._put(('write', path, data, offset, time.time()), len(data))
+
+    def close(self, path):
+        self._put(('close', path, None, None, time.time()))
+
+    def stop(self):
+        """ writes everything queued, fsyncs if enabled, closes all files and logs the statistics """
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+        logging.info(self.stats_str())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._stopping:
+                    self._cond.wait(self._fsync_timeout())
+                    if self._fsync_due():
+                        break
+                batch = self._items
+                self._items = deque()
+                self._pending_bytes = 0
+                stopping = self._stopping
+                self._cond.notify_all()
+            try:
+                self._process(batch)
+                if self._fsync_due() or stopping:
+                    self._fsync_dirty()
+            except (IOError, OSError) as e:
+                logging.error('disk writer: %s' % e)
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+            if stopping and not self._items:
+                break
+        for path in list(self._fds):
+            self._close(path)
+
+    def _fsync_timeout(self):
+        if self._fsync_interval <= 0 or not self._dirty:
+            return None
+        return max(0, self._t_fsync + self._fsync_interval - time.time())
+
+    def _fsync_due(self):
+        return self._fsync_interval > 0 and self._dirty and time.time() >= self._t_fsync + self._fsync_interval
+
+    def _fsync_dirty(self):
+        if self._fsync_interval > 0:
+            for path in self._dirty:
+                os.fsync(self._fds[path])
+                self.num_fsyncs += 1
+        self._dirty.clear()
+        self._t_fsync = time.time()
+
+    def _process(self, batch):
+        by_path = OrderedDict()
+        for item in batch:
+            by_path.setdefault(item[1], []).append(item)
+        for path,items in by_path.items():
+            appends = []
+            for item in items:
+                op,_,data,offset,_ = item
+                if op == 'write' and offset is None:
+                    appends.append(item)
+                    continue
+                self._append(path, appends)
+                appends = []
+                if op == 'create':
+                    self._close(path)
+                    self._open(path, os.O_TRUNC)
+                elif op == 'write':
+                    self._pwrite(self._fd(path), data, offset)
+                    self._done(path, [item])
+                elif op == 'close':
+                    self._close(path)
+            self._append(path, appends)
+
+    def _open(self, path, flags=0):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0) | flags, 0o666)
+        os.lseek(fd, 0, os.SEEK_END)
+        self._fds[path] = fd
+        return fd
+
+    def _fd(self, path):
+        fd = self._fds.get(path)
+        return fd if fd is not None else self._open(path)
+
+    def _close(self, path):
+        fd = self._fds.pop(path, None)
+        if fd is None:
+            return
+        if path in self._dirty:
+            if self._fsync_interval > 0:
+                os.fsync(fd)
+                self.num_fsyncs += 1
+            self._dirty.discard(path)
+        os.close(fd)
+
+    def _append(self, path, items):
+        if not items:
+            return
+        data = items[0][2] if len(items) == 1 else b''.join(item[2] for item in items)
+        fd = self._fd(path)
+        view = memoryview(data)
+        while view:
+            n = os.write(fd, view)
+            self.num_syscalls += 1
+            view = view[n:]
+        self._done(path, items)
+
+    def _pwrite(self, fd, data, offset):
+        self.num_syscalls += 1
+        if hasattr(os, 'pwrite'):
+            os.pwrite(fd, data, offset)
+        else:
+            pos = os.lseek(fd, 0, os.SEEK_CUR)
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+            os.lseek(fd, pos, os.SEEK_SET)
+
+    def _done(self, path, items):
+        now = time.time()
+        self._dirty.add(path)
+        for item in items:
+            self._latencies.append(now - item[4])
+            self.num_bytes += len(item[2])
+        self.num_records += len(items)
+
+    def stats_str(self):
+        lat = np.array(self._latencies) if self._latencies else np.zeros(1)
+        p50,p90,p99 = 1e3*np.percentile(lat, [50, 90, 99])
+        return ('disk writer: %d records, %d bytes in %d writes, %d fsyncs, queue depth max %d (%d bytes), '
+                'latency p50 %.1f ms p90 %.1f ms p99 %.1f ms max %.1f ms'
+                % (self.num_records, self.num_bytes, self.num_syscalls, self.num_fsyncs,
+                   self.max_depth, self.max_pending_bytes, p50, p90, p99, 1e3*lat.max()))
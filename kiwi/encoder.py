@@ -0,0 +1,272 @@
+## -*- python -*-
+
+## lossless compression of recordings in a separate process (kiwirecorder.py --compress)
+##  * the receive thread copies every block of int16 samples into a shared-memory ring buffer and
+##    queues a small descriptor; encoding and disk writes are done by the encoder process
+##  * the receive thread never waits for the encoder: a block which does not fit into the ring buffer
+##    is dropped, counted and replaced by zeros in the output so that the sample count stays exact
+##  * codecs: flac (needs the soundfile module) and xz (a .wav file compressed with lzma, no dependencies)
+##  * with kiwi_wav (-w) the GNSS timestamp of every block is written to a <file>.gnss.csv sidecar
+##    together with the index of its first sample
+##  * python3.8+ only (multiprocessing.shared_memory), so this module is not imported by kiwi/__init__.py
+
+import io
+import logging
+import lzma
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing import shared_memory
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from .wavwriter import write_wav_header
+
+HAS_SOUNDFILE = True
+try:
+    import soundfile
+except ImportError:
+    HAS_SOUNDFILE = False
+
+CODECS = {'flac': '.flac', 'xz': '.wav.xz'}  ## codec -> file extension
+
+def available_codecs():
+    return [c for c in sorted(CODECS) if c != 'flac' or HAS_SOUNDFILE]
+
+class _FlacFile(object):
+    def __init__(self, path, samplerate, num_channels):
+        self._num_channels = num_channels
+        self._f = soundfile.SoundFile(path, 'w', samplerate, num_channels, 'PCM_16', format='FLAC')
+
+    def write(self, samples):
+        self._f.write(samples.reshape(-1, self._num_channels))
+
+    def close(self):
+        self._f.close()
+
+class _XzWavFile(object):
+    def __init__(self, path, samplerate, num_channels):
+        self._f = lzma.open(path, 'wb', preset=1)
+        ## the sizes are not known when the stream is written: they saturate at 0xFFFFFFFF
+        write_wav_header(self._f, 1<<33, samplerate, num_channels, False)
+
+    def write(self, samples):
+        self._f.write(samples.data)
+
+    def close(self):
+        self._f.close()
+
+class _OutputFile(object):
+    """ one compressed file and its GNSS sidecar in the encoder process """
+    def __init__(self, codec, path, samplerate, num_channels, gnss):
+        self._num_channels = num_channels
+        self._file = (_FlacFile if codec == 'flac' else _XzWavFile)(path, samplerate, num_channels)
+        self._gnss = None
+        if gnss:
+            self._gnss = io.open(path + '.gnss.csv', 'w')
+            self._gnss.write(u'sample,last_gps_solution,gpssec,gpsnsec\n')
+        self._num_samples = 0
+
+    def write(self, samples, gps):
+        if self._gnss is not None and gps is not None:
+            self._gnss.write(u'%d,%d,%d,%d\n' % (self._num_samples, gps[0], gps[2], gps[3]))
+        self._file.write(samples)
+        self._num_samples += len(samples) // self._num_channels
+
+    def close(self):
+        self._file.close()
+        if self._gnss is not None:
+            self._gnss.close()
+
+def _encoder_main(codec, shm_name, size, read_pos, cmd_queue, result_queue):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   ## stopped by the parent
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+    files = {}
+    stats = dict(blocks=0, bytes_in=0, bytes_out=0, dropped=0)
+    paths = set()
+    t0 = os.times()
+    try:
+        while True:
+            item = cmd_queue.get()
+            op = item[0]
+            if op == 'stop':
+                break
+            if op == 'open':
+                _,path,samplerate,num_channels,gnss = item
+                files[path] = _OutputFile(codec, path, samplerate, num_channels, gnss)
+                paths.add(path)
+            elif op == 'write':
+                _,path,pos,n,gps = item
+                start = pos % size
+                if start + n <= size:
+                    data = ring[start:start+n].copy()
+                else:
+                    data = np.concatenate((ring[start:], ring[:start+n-size]))
+                read_pos.value = pos + n
+                files[path].write(data.view(np.int16), gps)
+                stats['blocks'] += 1
+                stats['bytes_in'] += n
+            elif op == 'drop':
+                _,path,n,gps = item
+                files[path].write(np.zeros(n//2, dtype=np.int16), gps)
+                stats['dropped'] += 1
+                stats['bytes_in'] += n
+            elif op == 'close':
+                files.pop(item[1]).close()
+                result_queue.put(('closed', (item[1], os.path.getsize(item[1]))))
+    except Exception as e:
+        result_queue.put(('error', '%s: %s' % (type(e).__name__, e)))
+        ## keep the parent from blocking on a full ring buffer: everything queued is dropped
+        read_pos.value = 1<<62
+    finally:
+        for f in files.values():
+            f.close()
+        del ring
+        shm.close()
+    t1 = os.times()
+    stats['bytes_out'] = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    stats.update(cpu_user=t1[0]-t0[0], cpu_sys=t1[1]-t0[1])
+    result_queue.put(('stats', stats))
+
+class EncoderProcess(object):
+    """ Compresses the files of one connection in a separate process.
+        open(), write() and close() are called from the receive thread, stop() when the connection ends """
+    def __init__(self, codec, buffer_size=16<<20):
+        self.codec = codec
+        self._size = buffer_size
+        self._write_pos = 0
+        self._error = None
+        self._process = None
+        self._on_closed = {}    ## path -> callback(path, size)
+        self.num_dropped = 0
+        self.stats = None
+
+    def start(self):
+        ## spawn: the receiving process has many threads which a forked child would not need
+        ctx = multiprocessing.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=self._size)
+        self._ring = np.ndarray((self._size,), dtype=np.uint8, buffer=self._shm.buf)
+        self._read_pos = ctx.RawValue('Q', 0)
+        self._cmd_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._process = ctx.Process(target=_encoder_main, name='encoder',
+                                    args=(self.codec, self._shm.name, self._size, self._read_pos,
+                                          self._cmd_queue, self._result_queue))
+        self._process.daemon = True
+        self._process.start()
+        self._t_start = time.time()
+        return self
+
+    def _check(self):
+        while self._error is None:
+            try:
+                self._handle_result(*self._result_queue.get_nowait())
+            except queue.Empty:
+                break
+        if self._error is not None:
+            raise RuntimeError('encoder: %s' % self._error)
+
+    def _handle_result(self, kind, value):
+        if kind == 'error':
+            self._error = value
+        elif kind == 'closed':
+            path,size = value
+            callback = self._on_closed.pop(path, None)
+            if callback is not None:
+                callback(path, size)
+        else:
+            self.stats = value
+
+    def open(self, path, samplerate, num_channels, gnss=False):
+        self._check()
+        self._cmd_queue.put(('open', path, int(samplerate+0.5), num_channels, gnss))
+
+    def write(self, path, samples, gps=None):
+        """ queues a contiguous array of int16 samples; False if it was dropped because the encoder is behind """
+        self._check()
+        n = samples.nbytes
+        gps = None if gps is None else tuple(gps)
+        if self._write_pos + n - self._read_pos.value > self._size:
+            self.num_dropped += 1
+            if self.num_dropped & (self.num_dropped-1) == 0:
+                logging.warning('encoder is behind: %d blocks dropped' % self.num_dropped)
+            self._cmd_queue.put(('drop', path, n, gps))
+            return False
+        data = samples.view(np.uint8).reshape(-1)
+        start = self._write_pos % self._size
+        first = min(n, self._size - start)
+        self._ring[start:start+first] = data[:first]
+        if first < n:
+            self._ring[:n-first] = data[first:]
+        self._cmd_queue.put(('write', path, self._write_pos, n, gps))
+        self._write_pos += n
+        return True
+
+    def close(self, path, on_closed=None):
+        """ on_closed(path, size) is called from open(), write(), close() or stop() once the encoder
+            process has finished the file """
+        self._check()
+        if on_closed is not None:
+            self._on_closed[path] = on_closed
+        self._cmd_queue.put(('close', path))
+
+    def stop(self):
+        """ waits until everything queued is encoded, stops the encoder process and logs its statistics """
+        if self._process is None:
+            return
+        self._cmd_queue.put(('stop',))
+        wall = time.time() - self._t_start
+        while self.stats is None and (self._process.is_alive() or not self._result_queue.empty()):
+            try:
+                kind,value = self._result_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == 'error':
+                logging.error('encoder: %s' % value)
+            self._handle_result(kind, value)
+        self._process.join()
+        self._process = None
+        del self._ring
+        self._shm.close()
+        self._shm.unlink()
+        if self.stats is not None:
+            logging.info(self.stats_str(wall))
+
+    def stats_str(self, wall):
+        s = self.stats
+        cpu = s['cpu_user'] + s['cpu_sys']
+        return ('encoder (%s): %d blocks, %d dropped, %d -> %d bytes (ratio %.3f), cpu %.2f sec (%.1f%% of one core)'
+                % (self.codec, s['blocks'], s['dropped'], s['bytes_in'], s['bytes_out'],
+                   float(s['bytes_out']) / max(1, s['bytes_in']), cpu, 100*cpu/max(wall, 1e-3)))
+
+class CompressedWriter(object):
+    """ WavWriter counterpart writing through an EncoderProcess """
+    def __init__(self, filename, samplerate, num_channels, is_kiwi_wav, encoder):
+        self.filename = filename
+        self._encoder = encoder
+        self._closed = False
+        encoder.open(filename, samplerate, num_channels, is_kiwi_wav)
+
+    def write(self, samples, gps=None):
+        self._encoder.write(self.filename, samples, gps)
+
+    def update_header(self):
+        pass
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self, on_closed=None):
+        """ on_closed(path, size): see EncoderProcess.close() """
+        if self._closed:
+            return
+        self._closed = True
+        self._encoder.close(self.filename, on_closed)
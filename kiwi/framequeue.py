@@ -0,0 +1,110 @@
+## -*- python -*-
+
+## bounded queue between the reader and the processing stage of one connection (KiwiWorker two-stage mode)
+##  * only SND and W/F frames may be dropped; MSG/EXT frames drive the protocol and are always queued
+##  * errors raised by the reader are queued regardless of the depth and re-raised by get()
+
+import threading
+import time
+from collections import deque
+
+class FrameQueue(object):
+    BLOCK       = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    POLICIES    = [BLOCK, DROP_OLDEST, DROP_NEWEST]
+
+    def __init__(self, depth, policy=BLOCK):
+        if policy not in self.POLICIES:
+            raise ValueError('unknown queue overflow policy "%s"' % policy)
+        self._depth = depth
+        self._policy = policy
+        self._cond = threading.Condition()
+        self._items = deque()
+        self._closed = False
+        self._count = 0         ## number of messages put
+        self._last_dropped = -2 ## a drop directly after this one continues the same gap
+        ## statistics over the lifetime of the queue (i.e. over reconnects)
+        self.high_water = 0
+        self.num_frames = 0
+        self.num_dropped = 0
+        self.num_gaps = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+
+    def reset(self):
+        """ empties the queue for a new connection """
+        with self._cond:
+            self._items.clear()
+            self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """ wakes up a reader blocked in put(); later puts are ignored """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _drop(self, n):
+        self.num_dropped += 1
+        if n != self._last_dropped + 1:
+            self.num_gaps += 1
+        self._last_dropped = n
+
+    def put(self, message, droppable=True):
+        """ queues a received message with its arrival time """
+        with self._cond:
+            n = self._count
+            self._count += 1
+            item = (time.time(), message, droppable, n)
+            if droppable and len(self._items) >= self._depth:
+                if self._policy == self.BLOCK:
+                    while len(self._items) >= self._depth and not self._closed:
+                        self._cond.wait()
+                elif self._policy == self.DROP_NEWEST:
+                    self._drop(n)
+                    return
+                else:
+                    ## the oldest droppable frame makes room
+                    for i,(_,_,d,m) in enumerate(self._items):
+                        if d:
+                            del self._items[i]
+                            self._drop(m)
+                            break
+            if self._closed:
+                return
+            self._items.append(item)
+            self.high_water = max(self.high_water, len(self._items))
+            self._cond.notify_all()
+
+    def put_error(self, e):
+        with self._cond:
+            if self._closed:
+                return
+            self._items.append((time.time(), e, False, -1))
+            self._cond.notify_all()
+
+    def get(self, timeout):
+        """ returns (arrival time, message), or None after timeout seconds without a message """
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+                if not self._items:
+                    return None
+            t,message,_,_ = self._items.popleft()
+            self._cond.notify_all()
+        if isinstance(message, Exception):
+            raise message
+        latency = time.time() - t
+        self.num_frames += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        return t,message
+
+    def stats_str(self):
+        return 'queue high-water %d/%d, %d frames dropped in %d gaps, latency mean %.1f ms max %.1f ms' % (
+            self.high_water, self._depth, self.num_dropped, self.num_gaps,
+            1e3*self.latency_sum/max(self.num_frames, 1), 1e3*self.latency_max)
@@ -0,0 +1,81 @@
+## -*- python -*-
+
+## keepalive scheduling shared by all connections of one process
+##  * KiwiSDRStream sends at most one "SET keepalive" per interval instead of one per SND/W/F frame
+##  * the wheel only marks a connection as due; the keepalive itself is sent by the connection's own
+##    thread (or coroutine) with the next received frame, so the stream is never written from two threads
+
+import logging
+import threading
+import time
+
+class KeepaliveWheel(object):
+    """ Hashed timer wheel: one slot per `resolution` seconds, each holding the streams whose keepalive
+        becomes due when the cursor reaches it. tick() is driven either by the asyncio engine heartbeat
+        or by a timer thread (start()) for the threaded workers """
+    def __init__(self, max_interval=60, resolution=0.25):
+        self._resolution = resolution
+        self._slots = [set() for _ in range(int(max_interval/resolution) + 2)]
+        self._where = {}   ## stream -> slot index
+        self._cursor = 0
+        self._t_next = None
+        self._lock = threading.Lock()
+        self.num_expired = 0
+
+    def schedule(self, stream, delay):
+        """ stream._keepalive_due is set to True after delay seconds """
+        num_ticks = max(1, int(round(delay / self._resolution)))
+        num_ticks = min(num_ticks, len(self._slots) - 1)
+        with self._lock:
+            self._cancel(stream)
+            i = (self._cursor + num_ticks) % len(self._slots)
+            self._slots[i].add(stream)
+            self._where[stream] = i
+
+    def cancel(self, stream):
+        with self._lock:
+            self._cancel(stream)
+
+    def _cancel(self, stream):
+        i = self._where.pop(stream, None)
+        if i is not None:
+            self._slots[i].discard(stream)
+
+    def tick(self, now=None):
+        """ advances the cursor by the number of resolution steps elapsed since the last call """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._t_next is None:
+                self._t_next = now + self._resolution
+            while now >= self._t_next:
+                self._t_next += self._resolution
+                self._cursor = (self._cursor + 1) % len(self._slots)
+                slot = self._slots[self._cursor]
+                for stream in slot:
+                    del self._where[stream]
+                    stream._keepalive_due = True
+                self.num_expired += len(slot)
+                slot.clear()
+
+    def start(self, run_event):
+        """ ticks the wheel from a daemon thread until run_event is cleared """
+        def run():
+            while run_event.is_set():
+                self.tick()
+                time.sleep(self._resolution)
+        t = threading.Thread(target=run, name='KeepaliveWheel')
+        t.daemon = True
+        t.start()
+        return t
+
+def log_sent_stats(recorders, duration):
+    """ logs outbound websocket frames and bytes summed over all recorders """
+    frames = nbytes = 0
+    for r in recorders:
+        f,b = r.get_sent_stats()
+        frames += f
+        nbytes += b
+    if not recorders or duration <= 0:
+        return
+    logging.info('sent %d frames, %d bytes on %d connections (%.1f frames/sec, %.0f bytes/sec)'
+                 % (frames, nbytes, len(recorders), frames/duration, nbytes/duration))
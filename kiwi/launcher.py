@@ -0,0 +1,92 @@
+## -*- python -*-
+
+## parallel start of many connections (kiwirecorder.py)
+##  * connections to different hosts are started concurrently, one launcher thread per host
+##  * connections to the same host are spaced by launch_delay using a token bucket per host
+##  * a connection can depend on others: extension recorders are started once the SND/W/F stream
+##    of the same Kiwi has received sample_rate/wf_setup instead of after a fixed delay
+##  * the time until all streams are up is logged
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBucket(object):
+    """ One token per `interval` seconds with bursts of up to `burst` tokens.
+        take() reserves a token and returns how long to wait before using it """
+    def __init__(self, interval, burst=1):
+        self._interval = interval
+        self._burst = burst
+        self._tokens = burst
+        self._t = time.time()
+        self._lock = threading.Lock()
+
+    def take(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._interval > 0:
+                self._tokens = min(self._burst, self._tokens + (now - self._t) / self._interval)
+            else:
+                self._tokens = self._burst
+            self._t = now
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens * self._interval
+
+class StaggeredLauncher(object):
+    """ Starts KiwiWorkers (or KiwiAsyncWorkers) added with add() from daemon threads, one per host """
+    def __init__(self, run_event, launch_delay, dependency_timeout=10):
+        self._run_event = run_event
+        self._launch_delay = launch_delay
+        self._dependency_timeout = dependency_timeout
+        self._jobs = OrderedDict()  ## host -> [(worker, name, depends_on)]
+        self._t_start = None
+
+    def add(self, host, worker, name, depends_on=()):
+        """ worker is started after the workers in depends_on have their stream up (or after dependency_timeout);
+            workers for the same host are started in the order they were added """
+        self._jobs.setdefault(host, []).append((worker, name, list(depends_on)))
+
+    def _sleep(self, duration):
+        t_end = time.time() + duration
+        while self._run_event.is_set() and time.time() < t_end:
+            time.sleep(min(0.1, t_end - time.time()))
+        return self._run_event.is_set()
+
+    def _wait_for(self, workers, name):
+        t_end = time.time() + self._dependency_timeout
+        for w in workers:
+            while not w._recorder.stream_up.wait(0.1):
+                if not self._run_event.is_set():
+                    return False
+                if time.time() > t_end:
+                    logging.warn('%s: starting without waiting any longer for %s' % (name, w._recorder._type))
+                    return True
+        return True
+
+    def _run_host(self, host, jobs):
+        bucket = TokenBucket(self._launch_delay)
+        for worker,name,depends_on in jobs:
+            if not self._wait_for(depends_on, name):
+                return
+            if not self._sleep(bucket.take()):
+                return
+            worker.start()
+            logging.info('started %s' % name)
+
+    def _monitor(self):
+        recorders = [w._recorder for jobs in self._jobs.values() for w,_,_ in jobs]
+        for r in recorders:
+            while not r.stream_up.wait(0.1):
+                if not self._run_event.is_set():
+                    return
+        logging.info('all %d streams up after %.1f sec' % (len(recorders), time.time() - self._t_start))
+
+    def start(self):
+        self._t_start = time.time()
+        threads = [threading.Thread(target=self._run_host, args=(host, jobs), name='launcher %s' % host)
+                   for host,jobs in self._jobs.items()]
+        threads.append(threading.Thread(target=self._monitor, name='launcher monitor'))
+        for t in threads:
+            t.daemon = True
+            t.start()
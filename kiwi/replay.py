@@ -0,0 +1,186 @@
+## -*- python -*-
+
+## capture and replay of WebSocket sessions (kiwirecorder.py --ws-capture / --ws-replay)
+##  * WsCapture writes every message received by a stream with its monotonic timestamp
+##  * WsReplay feeds a capture into any KiwiSDRStream subclass through _process_ws_message(),
+##    as fast as possible or in real time; messages the stream sends are counted and discarded
+##  * KiwiReplayWorker runs a replay in place of a KiwiWorker
+##
+## file layout (little-endian):
+##  * header:   'KIWIWSC1', u32 length, metadata (JSON)
+##  * messages: u32 length, u64 monotonic time (ns), u8 type (0: binary, 1: text), message
+
+import json
+import logging
+import struct
+import threading
+import time
+
+MAGIC       = b'KIWIWSC1'
+_header     = struct.Struct('<8sI')
+_record     = struct.Struct('<IQB')
+TYPE_BINARY = 0
+TYPE_TEXT   = 1
+
+class KiwiCaptureError(Exception):
+    pass
+
+def _monotonic_ns():
+    if hasattr(time, 'monotonic_ns'):
+        return time.monotonic_ns()
+    return int(time.monotonic() * 1e9)
+
+def capture_filename(prefix, idx, stream_type):
+    """ name of the capture of connection idx and stream_type (SND, W/F or EXT) """
+    return '%s_%d_%s.kws' % (prefix, idx, stream_type.replace('/', ''))
+
+class WsCapture(object):
+    """ Appends the messages received by one stream to a capture file """
+    def __init__(self, filename, metadata=None, flush_interval=1, buffer_size=1<<16):
+        self.filename = filename
+        self._fp = open(filename, 'wb', buffer_size)
+        info = json.dumps(metadata or {}).encode()
+        self._fp.write(_header.pack(MAGIC, len(info)))
+        self._fp.write(info)
+        self._flush_interval = flush_interval
+        self._t_flush = time.time()
+        self._lock = threading.Lock()
+        self.num_messages = 0
+        self.num_bytes = 0
+
+    def write(self, message):
+        if isinstance(message, str):
+            message, kind = message.encode('utf-8'), TYPE_TEXT
+        else:
+            kind = TYPE_BINARY
+        with self._lock:
+            if self._fp is None:
+                return
+            self._fp.write(_record.pack(len(message), _monotonic_ns(), kind))
+            self._fp.write(message)
+            self.num_messages += 1
+            self.num_bytes += len(message)
+            if time.time() - self._t_flush >= self._flush_interval:
+                self._t_flush = time.time()
+                self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            if self._fp is None:
+                return
+            self._fp.close()
+            self._fp = None
+        logging.info('%s: captured %d messages, %d bytes' % (self.filename, self.num_messages, self.num_bytes))
+
+class WsCaptureReader(object):
+    """ Reads a capture file: metadata and (timestamp in sec, message) pairs;
+        an incomplete last message (e.g. after a crash) is ignored """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            header = fp.read(_header.size)
+            if len(header) != _header.size or _header.unpack(header)[0] != MAGIC:
+                raise KiwiCaptureError('%s: not a WebSocket capture' % filename)
+            n = _header.unpack(header)[1]
+            self.metadata = json.loads(fp.read(n).decode())
+            self._data_start = _header.size + n
+
+    def messages(self):
+        with open(self.filename, 'rb') as fp:
+            fp.seek(self._data_start)
+            while True:
+                record = fp.read(_record.size)
+                if len(record) < _record.size:
+                    return
+                n,t_ns,kind = _record.unpack(record)
+                message = fp.read(n)
+                if len(message) < n:
+                    return
+                yield 1e-9*t_ns, (message.decode('utf-8') if kind == TYPE_TEXT else message)
+
+class _ReplayStream(object):
+    """ stands in for the WebSocket stream of a replayed KiwiSDRStream: sent messages are discarded """
+    def __init__(self):
+        self.sent_frame_count = 0
+        self.sent_byte_count = 0
+
+    def send_message(self, message, *args, **kwargs):
+        self.sent_frame_count += 1
+        self.sent_byte_count += len(message)
+
+    def send_constant_message(self, message):
+        self.send_message(message)
+
+    def receive_message(self):
+        return None
+
+    def close_connection(self, *args, **kwargs):
+        pass
+
+class WsReplay(object):
+    """ Feeds a capture into a KiwiSDRStream, with realtime=True at the captured pace divided by speed """
+    def __init__(self, filename, realtime=False, speed=1.0):
+        self._reader = WsCaptureReader(filename)
+        self._realtime = realtime
+        self._speed = speed
+        self.num_messages = 0
+        self.num_bytes = 0
+        self.wall = 0
+
+    @property
+    def metadata(self):
+        return self._reader.metadata
+
+    def run(self, stream, run_event=None):
+        """ returns when all messages have been processed or run_event has been cleared """
+        stream._stream = _ReplayStream()
+        stream._stream_name = getattr(stream, '_type', 'replay')
+        t0 = time.time()
+        t_first = None
+        for t,message in self._reader.messages():
+            if run_event is not None and not run_event.is_set():
+                break
+            if self._realtime:
+                t_first = t if t_first is None else t_first
+                delay = t0 + (t - t_first) / self._speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            stream._process_ws_message(message)
+            self.num_messages += 1
+            self.num_bytes += len(message)
+        self.wall = time.time() - t0
+        return self
+
+    def stats_str(self):
+        wall = max(self.wall, 1e-6)
+        return ('%s: replayed %d messages, %d bytes in %.3f sec (%.0f messages/sec, %.2f MB/sec)'
+                % (self._reader.filename, self.num_messages, self.num_bytes, self.wall,
+                   self.num_messages / wall, 1e-6 * self.num_bytes / wall))
+
+class KiwiReplayWorker(threading.Thread):
+    """ Drop-in for KiwiWorker which replays a capture into its recorder instead of connecting.
+        run_event is cleared when the last replay is done """
+    _lock = threading.Lock()
+    _num_active = 0
+
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None,
+                 replay_file=None, realtime=False, speed=1.0):
+        super(KiwiReplayWorker, self).__init__(group=group, target=target, name=name)
+        self._recorder, self._options, self._run_event = args
+        self._replay = WsReplay(replay_file, realtime, speed)
+        self._event = threading.Event()
+        with KiwiReplayWorker._lock:
+            KiwiReplayWorker._num_active += 1
+
+    def run(self):
+        try:
+            self._replay.run(self._recorder, self._run_event)
+            logging.info(self._replay.stats_str())
+        except Exception:
+            logging.exception('%s: replay failed' % self._replay._reader.filename)
+        finally:
+            self._recorder._close_func()
+            with KiwiReplayWorker._lock:
+                KiwiReplayWorker._num_active -= 1
+                if KiwiReplayWorker._num_active == 0:
+                    self._run_event.clear()
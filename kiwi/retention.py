@@ -0,0 +1,228 @@
+## -*- python -*-
+
+## disk quota and retention for long-running recorders (kiwirecorder.py --retain-*)
+##  * only the recordings add()ed (closed by this process) are managed, tracked per directory; with
+##    adopt=True also the older recordings named like kiwirecorder.py output files (RECORDING_PATTERN),
+##    found by scanning each directory once, when it is watch()ed or when its first file is closed
+##  * a background thread enforces, oldest file first:
+##     - max_bytes: the total size of the recordings in a directory
+##     - max_age:   the age in seconds of a recording
+##     - min_free:  the free space in bytes on the file system of a directory (statvfs, where available)
+##  * action 'delete' removes files, 'compress' replaces them by .xz files first and deletes
+##    compressed files only when a quota is still exceeded
+##  * only closed files are touched; a file's .gnss.csv sidecar (--compress) goes with it
+##  * the size of a file is given to add() by its writer: with --async-writes or --compress the file
+##    on disk may still be incomplete when it is closed
+##  * the state is per process: with --processes every process manages the files it has seen
+
+import heapq
+import logging
+import lzma
+import os
+import re
+import shutil
+import threading
+import time
+
+RECORDING_EXTENSIONS = ('.wav', '.wav.xz', '.flac', '.kad')
+## kiwirecorder.py file names: YYYYMMDDTHHMMSSZ_<frequency in Hz>[_<station or index>]_<mode><extension>
+RECORDING_PATTERN = re.compile(r'^\d{8}T\d{6}Z_\d+_.+(%s)$' % '|'.join(re.escape(e) for e in RECORDING_EXTENSIONS))
+
+def _is_compressed(path):
+    return path.endswith(('.xz', '.flac'))
+
+class _Directory(object):
+    def __init__(self):
+        self.files = {}         ## path -> (time, size)
+        self.heaps = ([], [])   ## (time, path) of uncompressed and compressed files; stale entries are skipped
+        self.total = 0
+
+    def add(self, path, t, size):
+        self.remove(path)
+        self.files[path] = (t, size)
+        heapq.heappush(self.heaps[_is_compressed(path)], (t, path))
+        self.total += size
+
+    def remove(self, path):
+        """ size of the file which is no longer tracked """
+        t_size = self.files.pop(path, None)
+        if t_size is None:
+            return 0
+        self.total -= t_size[1]
+        return t_size[1]
+
+    def oldest(self, compressed=None):
+        """ (time, path) of the oldest (un)compressed file, or of any file with compressed=None """
+        if compressed is None:
+            candidates = [c for c in (self.oldest(False), self.oldest(True)) if c is not None]
+            return min(candidates) if candidates else None
+        heap = self.heaps[compressed]
+        while heap:
+            t,path = heap[0]
+            if self.files.get(path, (None,))[0] == t:
+                return t,path
+            heapq.heappop(heap)
+        return None
+
+class RetentionManager(object):
+    def __init__(self, max_bytes=None, max_age=None, min_free=None, action='delete', check_interval=5,
+                 adopt=False):
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._min_free = min_free
+        self._action = action
+        self._adopt = adopt
+        self._check_interval = check_interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._stopping = False
+        self._dirs = {}     ## directory -> _Directory
+        self._thread = None
+        self._t_start = time.time()
+        self.num_deleted = 0
+        self.num_compressed = 0
+        self.bytes_freed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='Retention')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def watch(self, directory):
+        """ enforces the limits in directory before a file in it is closed """
+        with self._cond:
+            self._pending.append((os.path.abspath(directory), None, None))
+            self._cond.notify_all()
+
+    def add(self, path, t=None, size=None):
+        """ a recording has been closed: path is now managed. size defaults to the size of the file
+            when it is tracked """
+        with self._cond:
+            self._pending.append((os.path.abspath(path), time.time() if t is None else t, size))
+            self._cond.notify_all()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+        logging.info('retention: %d files deleted, %d compressed, %d bytes freed'
+                     % (self.num_deleted, self.num_compressed, self.bytes_freed))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(self._check_interval)
+                pending,self._pending = self._pending,[]
+                stopping = self._stopping
+            try:
+                for path,t,size in pending:
+                    self._track(path, t, size)
+                for directory,d in self._dirs.items():
+                    self._enforce(directory, d)
+            except Exception as e:
+                logging.error('retention: %s' % e)
+            if stopping:
+                break
+
+    def _track(self, path, t, size):
+        directory = path if t is None else os.path.dirname(path)
+        d = self._dirs.get(directory)
+        if d is None:
+            d = self._dirs[directory] = self._scan(directory) if self._adopt else _Directory()
+        if t is None:
+            return
+        try:
+            d.add(path, t, os.path.getsize(path) if size is None else size)
+        except OSError:
+            pass
+
+    def _scan(self, directory):
+        """ the recordings already in a directory named like kiwirecorder.py output, by modification time.
+            Files written since start() are skipped: they may still be open and are added when they are closed """
+        d = _Directory()
+        for entry in os.scandir(directory):
+            if entry.is_file() and RECORDING_PATTERN.match(entry.name):
+                st = entry.stat()
+                if st.st_mtime < self._t_start:
+                    d.add(entry.path, st.st_mtime, st.st_size)
+        logging.info('retention: adopted %d recordings, %d bytes in %s' % (len(d.files), d.total, directory))
+        return d
+
+    def _free_bytes(self, directory):
+        if self._min_free is None or not hasattr(os, 'statvfs'):
+            return None
+        st = os.statvfs(directory)
+        return st.f_bavail * st.f_frsize
+
+    def _over_quota(self, directory, d):
+        if self._max_bytes is not None and d.total > self._max_bytes:
+            return True
+        free = self._free_bytes(directory)
+        return free is not None and free < self._min_free
+
+    def _enforce(self, directory, d):
+        ## size and free space: compress (with action 'compress') and then delete the oldest files
+        failed = set()
+        while self._over_quota(directory, d):
+            oldest = d.oldest(False) if self._action == 'compress' else None
+            if oldest is not None and oldest[1] not in failed:
+                if not self._compress(d, oldest[1], oldest[0]):
+                    failed.add(oldest[1])
+                continue
+            oldest = d.oldest()
+            if oldest is None:
+                break
+            self._delete(d, oldest[1])
+        ## age: compressed files are kept with action 'compress'
+        if self._max_age is None:
+            return
+        now = time.time()
+        while True:
+            oldest = d.oldest(False if self._action == 'compress' else None)
+            if oldest is None or now - oldest[0] <= self._max_age or oldest[1] in failed:
+                break
+            if self._action == 'compress':
+                if not self._compress(d, oldest[1], oldest[0]):
+                    failed.add(oldest[1])
+            else:
+                self._delete(d, oldest[1])
+
+    def _delete(self, d, path):
+        size = d.remove(path)
+        for p in (path, path + '.gnss.csv'):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        self.num_deleted += 1
+        self.bytes_freed += size
+        logging.info('retention: deleted %s' % path)
+
+    def _compress(self, d, path, t):
+        """ replaces path by path.xz; False (and path is kept) if that fails """
+        tmp = path + '.xz.tmp'
+        try:
+            with open(path, 'rb') as f_in, lzma.open(tmp, 'wb', preset=1) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1<<20)
+            os.rename(tmp, path + '.xz')
+            os.remove(path)
+        except (IOError, OSError) as e:
+            logging.error('retention: cannot compress %s: %s' % (path, e))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        size = d.remove(path)
+        new_size = os.path.getsize(path + '.xz')
+        d.add(path + '.xz', t, new_size)
+        self.num_compressed += 1
+        self.bytes_freed += size - new_size
+        logging.info('retention: compressed %s (%d -> %d bytes)' % (path, size, new_size))
+        return True
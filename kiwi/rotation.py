@@ -0,0 +1,84 @@
+## -*- python -*-
+
+## sample-accurate file rotation (kiwirecorder.py --dt-sec)
+##  * files start at multiples of dt seconds of the UTC day
+##  * the time of every block is given by its GNSS timestamp when the Kiwi has a GNSS solution (IQ mode),
+##    otherwise it is counted in samples from the first block, re-anchored to the wall clock
+##    only when the two are more than max_drift seconds apart
+##  * a block crossing a boundary is split, so without GNSS every file holds exactly dt*rate samples
+
+import logging
+import math
+import time
+
+from .client import GNSSHeader
+
+GPS_EPOCH      = 315964800  ## 1980-01-06T00:00:00Z as unix time
+GPS_UTC_OFFSET = 18         ## GPS-UTC leap seconds (since 2017)
+
+def gnss_to_unix(gps, now=None):
+    """ unix time of a GNSSHeader (GPS time of week), or None without a recent GNSS solution """
+    if not isinstance(gps, GNSSHeader) or gps.last_gps_solution in (254, 255) or gps.gpssec == 0:
+        return None
+    now = time.time() if now is None else now
+    tow = gps.gpssec + 1e-9*gps.gpsnsec
+    week = round((now + GPS_UTC_OFFSET - GPS_EPOCH - tow) / 604800.)
+    return GPS_EPOCH + 604800*week + tow - GPS_UTC_OFFSET
+
+def gnss_shift(gps, dt):
+    """ GNSSHeader dt seconds after gps """
+    nsec = gps.gpssec*1000000000 + gps.gpsnsec + int(round(1e9*dt))
+    gpssec,gpsnsec = divmod(nsec, 1000000000)
+    return gps._replace(gpssec=gpssec % 604800, gpsnsec=gpsnsec)
+
+def next_boundary(t, dt):
+    """ the first multiple of dt seconds of the UTC day after unix time t (or the start of the next day) """
+    day = math.floor(t / 86400.) * 86400
+    return min(day + (math.floor((t - day) / dt) + 1) * dt, day + 86400)
+
+class SampleRotation(object):
+    def __init__(self, dt, max_drift=1.0):
+        self._dt = dt
+        self._max_drift = max_drift
+        self.reset()
+
+    def reset(self):
+        """ the next block starts a new file """
+        self._t_next = None     ## start time of the next file
+        self._t_anchor = None   ## time of sample number 0 ...
+        self._n = 0             ## ... and the number of the next sample
+
+    def split(self, num_samples, rate, t_block=None):
+        """ splits a block of num_samples samples with its first sample at unix time t_block
+            (None: not known) into a list of (start, end, t_file) pieces. A piece is written to a
+            new file starting at unix time t_file, or to the current file if t_file is None """
+        if t_block is not None:
+            self._t_anchor, self._n = t_block, 0
+        else:
+            now = time.time()
+            if self._t_anchor is None or abs(self._t_anchor + self._n / float(rate) - now) > self._max_drift:
+                if self._t_anchor is not None:
+                    logging.info('sample clock off by %.3f sec: re-anchored to the system clock'
+                                 % (self._t_anchor + self._n / float(rate) - now))
+                self._t_anchor, self._n = now, 0
+            t_block = self._t_anchor + self._n / float(rate)
+        t_file = None
+        if self._t_next is None:
+            t_file = t_block
+            self._t_next = next_boundary(t_block, self._dt)
+        pieces = []
+        start = 0
+        while True:
+            ## counted from the anchor so that rounding does not accumulate
+            k = int(round((self._t_next - self._t_anchor) * rate)) - self._n
+            if k >= num_samples:
+                break
+            k = max(k, start)
+            if k > start:
+                pieces.append((start, k, t_file))
+            start = k
+            t_file = self._t_next
+            self._t_next = next_boundary(self._t_next, self._dt)
+        pieces.append((start, num_samples, t_file))
+        self._n += num_samples
+        return pieces
@@ -0,0 +1,141 @@
+## -*- python -*-
+
+## process-pool sharding of connections (kiwirecorder.py --processes)
+##  * the connection list is split into shards, each run by target() in its own process; the connections
+##    to one host go to the same shard where possible
+##  * log records of the shard processes are handled by the parent's logging handlers
+##  * lines printed with tdoa_print() (--kiwi-tdoa file=/status=) are printed by the parent
+##  * run_event semantics span all processes: clearing it anywhere (^C in the parent, a time limit
+##    or a fatal error in any shard) stops every connection
+##  * run_sharded() is python3 only (logging.handlers.QueueHandler/QueueListener); the module itself
+##    imports on python2, for tdoa_print()
+
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_print_queue = None
+
+def tdoa_print(line):
+    """ print() for lines the caller of kiwirecorder.py parses from stdout;
+        in a shard process these are forwarded to the parent """
+    if _print_queue is None:
+        print(line)
+    else:
+        _print_queue.put(('print', line))
+
+def partition(hosts, num_shards):
+    """ splits the connection indices range(len(hosts)) into at most num_shards lists of (almost) equal length.
+        The connections to one host are kept in one process, so that --launch-delay staggers them,
+        unless that host alone has more connections than fit in one shard: these are split into
+        contiguous chunks, and the launches are staggered only within each chunk """
+    num_shards = max(1, min(num_shards, len(hosts)))
+    max_len = -(-len(hosts) // num_shards)
+    groups = {}
+    for i,host in enumerate(hosts):
+        groups.setdefault(host, []).append(i)
+    chunks = []
+    for indices in groups.values():
+        chunks.extend(indices[k:k+max_len] for k in range(0, len(indices), max_len))
+    ## largest chunk first into the shortest shard
+    shards = [[] for _ in range(num_shards)]
+    for chunk in sorted(chunks, key=len, reverse=True):
+        min(shards, key=len).extend(chunk)
+    return [sorted(shard) for shard in shards if shard]
+
+def _bridge_run_event(run_event, shared_event):
+    """ clears run_event when shared_event is cleared, and vice versa """
+    while run_event.is_set() and shared_event.is_set():
+        time.sleep(0.1)
+    run_event.clear()
+    shared_event.clear()
+
+def _shard_main(target, indices, args, shared_event, log_queue, result_queue, log_level):
+    global _print_queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   ## ^C is handled by the parent which clears shared_event
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(log_level)
+    _print_queue = result_queue
+
+    run_event = threading.Event()
+    run_event.set()
+    bridge = threading.Thread(target=_bridge_run_event, args=(run_event, shared_event), name='run_event bridge')
+    bridge.daemon = True
+    bridge.start()
+
+    t0_wall, t0 = time.time(), os.times()
+    try:
+        result = target(indices, run_event, *args)
+    finally:
+        run_event.clear()
+    t1 = os.times()
+    result.update(pid=os.getpid(), indices=indices,
+                  cpu_user=t1[0]-t0[0], cpu_sys=t1[1]-t0[1], wall=time.time()-t0_wall)
+    result_queue.put(('result', result))
+
+def run_sharded(target, args, shards, run_event):
+    """ runs target(indices, run_event, *args) for every shard of connection indices in its own process.
+        target must return a dict, which is returned together with CPU usage for every process that finished """
+    shared_event = multiprocessing.Event()
+    shared_event.set()
+    log_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_shard_main, name='kiwirecorder-%d' % n,
+                                     args=(target, indices, args, shared_event, log_queue, result_queue,
+                                           logging.getLogger().level))
+             for n,indices in enumerate(shards)]
+    for p in procs:
+        p.start()
+    ## started after forking so that no child inherits a logging lock held by the listener thread
+    listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers)
+    listener.start()
+
+    results = []
+    def drain(timeout):
+        """ handles one message from the shard processes; False if there was none """
+        try:
+            kind,value = result_queue.get(timeout=timeout) if timeout > 0 else result_queue.get_nowait()
+        except queue.Empty:
+            return False
+        if kind == 'print':
+            print(value)
+        else:
+            results.append(value)
+        return True
+
+    try:
+        while len(results) < len(procs) and any(p.is_alive() for p in procs):
+            if not run_event.is_set():
+                shared_event.clear()
+            drain(0.1)
+    except KeyboardInterrupt:
+        logging.info('KeyboardInterrupt: stopping %d processes' % len(procs))
+    shared_event.clear()
+    run_event.clear()
+    while len(results) < len(procs) and any(p.is_alive() for p in procs):
+        drain(0.1)
+    for p in procs:
+        p.join()
+    while drain(0):
+        pass
+    listener.stop()
+    return sorted(results, key=lambda r: r['indices'][0])
+
+def log_process_stats(results):
+    for r in results:
+        wall = max(r['wall'], 1e-3)
+        cpu = r['cpu_user'] + r['cpu_sys']
+        logging.info('process %d: %d connections, cpu %.1f sec (user %.1f sec, sys %.1f sec), %.0f%% of one core'
+                     % (r['pid'], len(r['indices']), cpu, r['cpu_user'], r['cpu_sys'], 100*cpu/wall))
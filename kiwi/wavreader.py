@@ -30,11 +30,19 @@ class KiwiIQWavReader(collectionsAbc.Iterator):
 
     def _initfp(self, file):
         self._file = Chunk(file, bigendian = 0)
-        if self._file.getname() != b'RIFF':
+        if self._file.getname() not in (b'RIFF', b'RF64'):
             raise KiwiIQWavError('file does not start with RIFF id')
         if self._file.read(4) != b'WAVE':
             raise KiwiIQWavError('not a WAVE file')
 
+        if self._file.getname() == b'RF64':
+            ## the 32-bit RIFF size is not valid: chunks are read from the file itself
+            self._file = file
+            chunk = Chunk(self._file, bigendian = 0)
+            if chunk.getname() != b'ds64':
+                raise KiwiIQWavError('ds64 chunk is missing')
+            chunk.skip()
+
         chunk = Chunk(self._file, bigendian = 0)
         if chunk.getname() != b'fmt ':
             raise KiwiIQWavError('fmt chunk is missing')
@@ -0,0 +1,198 @@
+## -*- python -*-
+
+## WAV output for kiwirecorder.py
+##  * the file is kept open while it is being recorded and written through a userspace buffer
+##  * the RIFF/data sizes in the header are rewritten at most every header_interval seconds, when a
+##    file is closed (rotation, squelch, end of recording) and never for every block
+##  * with a DiskWriter (kiwi/diskwriter.py) all writes are queued to its thread instead
+##  * MmapWavWriter preallocates files of known duration and writes them through an mmap
+##  * rf64=True writes RF64 files (EBU Tech 3306) with 64-bit sizes in a ds64 chunk, otherwise the
+##    32-bit sizes saturate at 4 GiB
+
+import io
+import logging
+import mmap
+import os
+import struct
+import time
+
+def write_wav_header(fp, filesize, samplerate, num_channels, is_kiwi_wav, rf64=False, data_size=None):
+    """ RIFF/WAVE header, or with rf64=True an RF64 header (EBU Tech 3306) with a ds64 chunk holding the sizes.
+        data_size is the number of sample bytes, by default everything after the header """
+    samplerate = int(samplerate+0.5)
+    bits_per_sample = 16
+    byte_rate       = samplerate * num_channels * bits_per_sample // 8
+    block_align     = num_channels * bits_per_sample // 8
+    if rf64:
+        if data_size is None:
+            data_size = filesize - wav_header_size(is_kiwi_wav, rf64)
+        fp.write(struct.pack('<4sI4s', b'RF64', 0xFFFFFFFF, b'WAVE'))
+        fp.write(struct.pack('<4sIQQQI', b'ds64', 28, filesize - 8, data_size, data_size // block_align, 0))
+    else:
+        ## 32-bit sizes saturate at 4 GiB
+        fp.write(struct.pack('<4sI4s', b'RIFF', min(filesize - 8, 0xFFFFFFFF), b'WAVE'))
+    fp.write(struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, num_channels, samplerate, byte_rate, block_align, bits_per_sample))
+    if not is_kiwi_wav:
+        data_chunk_size = 0xFFFFFFFF if rf64 else min(filesize - 12 - 8 - 16 - 8, 0xFFFFFFFF)
+        fp.write(struct.pack('<4sI', b'data', data_chunk_size))
+
+def wav_header_size(is_kiwi_wav, rf64=False):
+    return 12 + (36 if rf64 else 0) + 24 + (0 if is_kiwi_wav else 8)
+
+class WavWriter(object):
+    """ Writes one .wav file, directly or through a DiskWriter.
+        kiwi_wav files get a 'kiwi' GNSS chunk and a 'data' chunk per block.
+        After a crash the header is at most header_interval seconds behind the data on disk;
+        with header_interval=0 it is rewritten after every block """
+    def __init__(self, filename, samplerate, num_channels, is_kiwi_wav, header_interval=1, buffer_size=1<<16,
+                 disk_writer=None, rf64=False):
+        self.filename = filename
+        self._rf64 = rf64
+        self._data_size = 0
+        self._samplerate = samplerate
+        self._num_channels = num_channels
+        self._is_kiwi_wav = is_kiwi_wav
+        self._header_interval = header_interval
+        self._disk_writer = disk_writer
+        self._closed = False
+        self._open(buffer_size)
+        # Write a static WAV header
+        self._size = 0
+        self._write(self._header(100))
+        self._size_in_header = 100
+        self._t_header = time.time()
+        self.num_header_updates = 0
+
+    def _open(self, buffer_size):
+        if self._disk_writer is None:
+            self._fp = open(self.filename, 'wb', buffer_size)
+        else:
+            self._disk_writer.create(self.filename)
+
+    def _header(self, filesize):
+        fp = io.BytesIO()
+        write_wav_header(fp, filesize, self._samplerate, self._num_channels, self._is_kiwi_wav,
+                         self._rf64, self._data_size)
+        return fp.getvalue()
+
+    def _write(self, data):
+        if self._disk_writer is None:
+            self._fp.write(data)
+        else:
+            data = bytes(data)
+            self._disk_writer.write(self.filename, data)
+        self._size += getattr(data, 'nbytes', len(data))
+
+    def write(self, samples, gps=None):
+        """ appends a block of int16 samples (numpy array), preceded by its GNSS timestamp for kiwi_wav files """
+        self._data_size += samples.nbytes
+        if self._is_kiwi_wav:
+            chunks = struct.pack('<4sIBBII4sI', b'kiwi', 10, gps.last_gps_solution, 0, gps.gpssec, gps.gpsnsec,
+                                 b'data', samples.nbytes)
+            if self._disk_writer is None:
+                self._write(chunks)
+            else:
+                ## one record per block for the disk writer
+                self._write(chunks + samples.tobytes())
+                samples = None
+        if samples is not None:
+            self._write(samples.data)
+        if time.time() - self._t_header >= self._header_interval:
+            self.update_header()
+
+    def update_header(self):
+        """ flushes the data and rewrites the header for the current file size """
+        self._t_header = time.time()
+        if self._disk_writer is not None:
+            if self._size != self._size_in_header:
+                self._disk_writer.write(self.filename, self._header(self._size), 0)
+        elif self._size == self._size_in_header:
+            self._fp.flush()
+            return
+        else:
+            self._fp.seek(0, os.SEEK_SET)
+            self._fp.write(self._header(self._size))
+            self._fp.seek(0, os.SEEK_END)
+            self._fp.flush()
+        if self._size != self._size_in_header:
+            self._size_in_header = self._size
+            self.num_header_updates += 1
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def size(self):
+        """ file size in bytes including everything queued """
+        return self._size
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.update_header()
+        finally:
+            if self._disk_writer is None:
+                self._fp.close()
+            else:
+                self._disk_writer.close(self.filename)
+        logging.debug('%s: %d bytes, %d header updates' % (self.filename, self._size, self.num_header_updates))
+
+class MmapWavWriter(WavWriter):
+    """ WavWriter for files of known duration (--dt-sec): the file is preallocated with
+        posix_fallocate (where available) and written through an mmap of its full size.
+        It grows in steps of a quarter of the initial size if the estimate was too small, and
+        is truncated to the length actually written when closed.
+        After a crash the header covers the samples written before its last update
+        and the rest of the file is zeros """
+    def __init__(self, filename, samplerate, num_channels, is_kiwi_wav, header_interval=1, expected_size=1<<20,
+                 rf64=False):
+        self._expected_size = max(expected_size, 1<<16)
+        self.num_resizes = 0
+        super(MmapWavWriter, self).__init__(filename, samplerate, num_channels, is_kiwi_wav, header_interval,
+                                            rf64=rf64)
+
+    def _open(self, buffer_size):
+        self._fp = open(self.filename, 'w+b')
+        self._allocate(self._expected_size)
+        self._mm = mmap.mmap(self._fp.fileno(), self._expected_size)
+        self._grow_by = self._expected_size // 4
+
+    def _allocate(self, size):
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self._fp.fileno(), 0, size)
+        else:
+            self._fp.truncate(size)
+
+    def _write(self, data):
+        n = getattr(data, 'nbytes', len(data))
+        if self._size + n > len(self._mm):
+            new_size = max(self._size + n, len(self._mm) + self._grow_by)
+            self._allocate(new_size)
+            self._mm.resize(new_size)
+            self.num_resizes += 1
+        self._mm[self._size:self._size+n] = data
+        self._size += n
+
+    def update_header(self):
+        self._t_header = time.time()
+        if self._size != self._size_in_header:
+            header = self._header(self._size)
+            self._mm[0:len(header)] = header
+            self._size_in_header = self._size
+            self.num_header_updates += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.update_header()
+            self._mm.close()
+            self._fp.truncate(self._size)
+        finally:
+            self._fp.close()
+        logging.debug('%s: %d bytes, %d header updates, %d resizes'
+                      % (self.filename, self._size, self.num_header_updates, self.num_resizes))
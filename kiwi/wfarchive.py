@@ -0,0 +1,227 @@
+## -*- python -*-
+
+## waterfall archive shared by kiwirecorder.py --wf-archive, kiwiwfrecorder.py and microkiwi_waterfall.py;
+## kiwi_wf_archive.py selects, exports and analyses archives
+##  * fixed-size records of a float64 timestamp (unix time or GNSS time) and the raw uint8 bins, so the
+##    file can be opened as an np.memmap and hours of waterfall sliced by time and frequency without
+##    loading it
+##  * an index of (row, timestamp) every index_interval rows is rewritten after the last row every
+##    header_interval seconds, so that the rows stay contiguous and a crash loses at most the index:
+##    the rows of a file without index are counted from its size
+##
+## file layout (little-endian):
+##  * header:  'KIWIWFA1', u16 version, u16 flags (1: GNSS timestamps), u32 number of bins,
+##             f64 center frequency (kHz), f64 span (kHz), i16 zoom, i16 cal (dB), u32 length, metadata (JSON),
+##             padded with spaces to a multiple of 8 bytes
+##  * rows:    f64 timestamp, u8 bins[number of bins]
+##  * index:   'KWIX', u32 count, count * (u64 row, f64 timestamp)
+##  * trailer: u64 offset of the index, 'KIWIEND1'
+
+import json
+import os
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+MAGIC         = b'KIWIWFA1'
+VERSION       = 1
+FLAG_GNSS     = 1
+_file_header  = struct.Struct('<8sHHIddhhI')
+_index_header = struct.Struct('<4sI')
+_index_entry  = struct.Struct('<Qd')
+_trailer      = struct.Struct('<Q8s')
+TRAILER_MAGIC = b'KIWIEND1'
+
+class KiwiWfArchiveError(Exception):
+    pass
+
+IndexEntry = namedtuple('IndexEntry', 'row t')
+
+def row_dtype(nbins):
+    return np.dtype([('t', '<f8'), ('wf', 'u1', (nbins,))])
+
+class WfArchiveWriter(object):
+    """ Appends waterfall rows to an archive; the interface follows AdpcmWriter (kiwi/adpcmfile.py).
+        With append=True an existing archive with the same parameters is continued (its metadata is kept) """
+    def __init__(self, filename, nbins, center, span, zoom=0, cal=0, gnss=False, metadata=None,
+                 header_interval=1, index_interval=256, buffer_size=1<<16, append=False):
+        self.filename = filename
+        self.nbins = nbins
+        self._header_interval = header_interval
+        self._t_header = time.time()
+        self._index_interval = index_interval
+        self._record = struct.Struct('<d%ds' % nbins)
+        self._has_trailer = False
+        self._closed = False
+        if append and os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self._open_existing((nbins, center, span, zoom, cal, gnss), buffer_size)
+            return
+        self._fp = open(filename, 'w+b', buffer_size)
+        info = json.dumps(metadata or {}).encode()
+        info += b' ' * (-(_file_header.size + len(info)) % 8)
+        self._fp.write(_file_header.pack(MAGIC, VERSION, FLAG_GNSS if gnss else 0, nbins,
+                                         center, span, zoom, cal, len(info)))
+        self._fp.write(info)
+        self._data_end = _file_header.size + len(info)
+        self._index = []
+        self.num_rows = 0
+
+    def _open_existing(self, params, buffer_size):
+        a = WfArchiveReader(self.filename)
+        if (a.nbins, a.center, a.span, a.zoom, a.cal, a.gnss) != params:
+            raise KiwiWfArchiveError('%s: cannot append, the archive has %d bins, center %g, span %g, zoom %d, cal %d, gnss %s'
+                                     % ((self.filename, a.nbins, a.center, a.span, a.zoom, a.cal, a.gnss)))
+        self.num_rows = a.num_rows
+        self._data_end = a._data_start + a.num_rows * a.dtype.itemsize
+        self._index = [IndexEntry(i, float(a.times[i])) for i in range(0, a.num_rows, self._index_interval)]
+        del a
+        self._fp = open(self.filename, 'r+b', buffer_size)
+        self._fp.seek(self._data_end)
+        self._fp.truncate()
+
+    def write_row(self, t, samples):
+        """ samples: the nbins uint8 bins of one row """
+        if self._has_trailer:
+            self._fp.seek(self._data_end)
+            self._fp.truncate()
+            self._has_trailer = False
+        if self.num_rows % self._index_interval == 0:
+            self._index.append(IndexEntry(self.num_rows, t))
+        data = samples.tobytes() if hasattr(samples, 'tobytes') else bytes(samples)
+        if len(data) != self.nbins:
+            raise KiwiWfArchiveError('%s: row has %d bins, expected %d' % (self.filename, len(data), self.nbins))
+        self._fp.write(self._record.pack(t, data))
+        self._data_end += self._record.size
+        self.num_rows += 1
+        if time.time() - self._t_header >= self._header_interval:
+            self.update_header()
+
+    def update_header(self):
+        """ writes the index after the last row and flushes the file """
+        self._t_header = time.time()
+        if not self._has_trailer:
+            self._fp.write(_index_header.pack(b'KWIX', len(self._index)))
+            for e in self._index:
+                self._fp.write(_index_entry.pack(*e))
+            self._fp.write(_trailer.pack(self._data_end, TRAILER_MAGIC))
+            self._has_trailer = True
+        self._fp.flush()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.update_header()
+        finally:
+            self._fp.close()
+
+class WfArchiveReader(object):
+    """ Reads files written by WfArchiveWriter. The rows are memory-mapped:
+        times is a 1-D and rows a 2-D (row, bin) view of the file """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            header = fp.read(_file_header.size)
+            if len(header) != _file_header.size:
+                raise KiwiWfArchiveError('%s: file too short' % filename)
+            (magic, version, flags, self.nbins, self.center, self.span,
+             self.zoom, self.cal, n) = _file_header.unpack(header)
+            if magic != MAGIC:
+                raise KiwiWfArchiveError('%s: not a Kiwi waterfall archive' % filename)
+            if version != VERSION:
+                raise KiwiWfArchiveError('%s: unsupported version %d' % (filename, version))
+            self.gnss = bool(flags & FLAG_GNSS)
+            self.metadata = json.loads(fp.read(n).decode())
+            self._data_start = _file_header.size + n
+            self.dtype = row_dtype(self.nbins)
+            self._read_index(fp)
+        if self.num_rows == 0:
+            self.data = np.zeros(0, dtype=self.dtype)
+        else:
+            self.data = np.memmap(filename, dtype=self.dtype, mode='r',
+                                  offset=self._data_start, shape=(self.num_rows,))
+        self.times = self.data['t']
+        self.rows  = self.data['wf']
+
+    def _read_index(self, fp):
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        if size >= self._data_start + _trailer.size:
+            fp.seek(size - _trailer.size)
+            offset,magic = _trailer.unpack(fp.read(_trailer.size))
+            if magic == TRAILER_MAGIC:
+                fp.seek(offset)
+                tag,count = _index_header.unpack(fp.read(_index_header.size))
+                if tag != b'KWIX':
+                    raise KiwiWfArchiveError('%s: corrupt index' % self.filename)
+                data = fp.read(count * _index_entry.size)
+                self.index = [IndexEntry(*_index_entry.unpack_from(data, i*_index_entry.size)) for i in range(count)]
+                self.num_rows = (offset - self._data_start) // self.dtype.itemsize
+                return
+        ## no index (e.g. after a crash): count the rows, ignoring an incomplete last row
+        self.num_rows = (size - self._data_start) // self.dtype.itemsize
+        self.index = None
+
+    def frequencies(self):
+        """ center frequencies of the bins in kHz """
+        return self.center - self.span/2 + (0.5 + np.arange(self.nbins)) * self.span / self.nbins
+
+    def row_range(self, t_from=None, t_to=None):
+        """ rows [start, stop) with t_from <= timestamp <= t_to; the timestamps must be increasing """
+        start,stop = 0,self.num_rows
+        if t_from is not None:
+            start = self._search(t_from, 'left')
+        if t_to is not None:
+            stop = self._search(t_to, 'right')
+        return start, max(start, stop)
+
+    def _search(self, t, side):
+        lo,hi = 0,self.num_rows
+        if self.index:
+            ## narrow down with the index so that only a few pages of timestamps are read
+            rows = [e.row for e in self.index]
+            i = np.searchsorted([e.t for e in self.index], t, side)
+            lo = rows[i-1] if i > 0 else 0
+            hi = rows[i] if i < len(rows) else self.num_rows
+        return lo + int(np.searchsorted(self.times[lo:hi], t, side))
+
+    def bin_range(self, f_min=None, f_max=None):
+        """ bins [start, stop) with centers between f_min and f_max kHz """
+        f = self.frequencies()
+        start = 0 if f_min is None else int(np.searchsorted(f, f_min, 'left'))
+        stop = self.nbins if f_max is None else int(np.searchsorted(f, f_max, 'right'))
+        return start, max(start, stop)
+
+    def select(self, t_from=None, t_to=None, f_min=None, f_max=None):
+        """ timestamps, bin frequencies (kHz) and raw rows between the given times and frequencies;
+            the rows are a view of the file """
+        r0,r1 = self.row_range(t_from, t_to)
+        b0,b1 = self.bin_range(f_min, f_max)
+        return self.times[r0:r1], self.frequencies()[b0:b1], self.rows[r0:r1, b0:b1]
+
+    def dBm(self, rows):
+        """ calibrated power of raw rows """
+        return rows.astype(np.int16) - 255 + self.cal
+
+def peaks(rows, num_peaks):
+    """ bins and uncalibrated dBm of the num_peaks strongest bins of each row, strongest first.
+        As with kiwirecorder.py --wf-peaks the first three bins and masked bins (below -190 dBm)
+        are skipped and ties go to the higher bin; rows with fewer bins left get -1 bins """
+    rows = np.atleast_2d(rows)
+    nbins = rows.shape[1]
+    dBm = rows.astype(np.int64) - 255
+    key = dBm*nbins + np.arange(nbins)
+    invalid = np.iinfo(np.int64).min
+    key[:, :3] = invalid
+    key[dBm <= -190] = invalid
+    k = min(num_peaks, nbins)
+    top = np.sort(np.partition(key, nbins-k, axis=1)[:, nbins-k:], axis=1)[:, ::-1]
+    bins = np.where(top == invalid, -1, top % nbins)
+    return bins, np.where(top == invalid, 0, top // nbins)
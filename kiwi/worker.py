@@ -1,14 +1,89 @@
 ## -*- python -*-
 
 import logging
+import socket
 import threading
 from traceback import print_exc
 
+from .framequeue import FrameQueue
+
 from .client import KiwiTooBusyError, KiwiRedirectError, KiwiTimeLimitError, KiwiServerTerminatedConnection
 from .rigctld import Rigctld
 
-class KiwiWorker(threading.Thread):
-    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
+class KiwiWorkerPolicy(object):
+    """ Reconnect/busy/redirect policy shared by the threaded and the asyncio workers.
+        The _on_*_error() methods return the number of seconds to wait before retrying,
+        or None if the worker should stop """
+
+    def _init_policy(self):
+        self.connect_count = self._options.connect_retries
+        self.busy_count = self._options.busy_retries
+
+    def _on_connect_error(self, e):
+        logging.warn("Failed to connect, sleeping and reconnecting error='%s'" %e)
+        if self._options.is_kiwi_tdoa:
+            self._options.status = 1
+            return None
+        self.connect_count -= 1
+        if self._options.connect_retries > 0 and self.connect_count == 0:
+            return None
+        return max(self._options.connect_timeout, 0)
+
+    def _on_run_error(self, e):
+        """ must be called from within the except clause handling e """
+        if isinstance(e, KiwiServerTerminatedConnection):
+            if self._options.no_api:
+                msg = ''
+            else:
+                msg = ' Reconnecting after 5 seconds'
+            logging.info("%s:%s %s.%s" % (self._options.server_host, self._options.server_port, e, msg))
+            self._recorder.close()
+            if self._options.no_api:    ## don't retry
+                return None
+            self._recorder._start_ts = None ## this makes the recorder open a new file on restart
+            return 5
+        if isinstance(e, KiwiTooBusyError):
+            if self._options.is_kiwi_tdoa:
+                self._options.status = 2
+                return None
+            self.busy_count -= 1
+            if self._options.busy_retries > 0 and self.busy_count == 0:
+                return None
+            logging.warn("%s:%d Too busy now. Reconnecting after %d seconds"
+                  % (self._options.server_host, self._options.server_port, self._options.busy_timeout))
+            return max(self._options.busy_timeout, 0)
+        if isinstance(e, KiwiRedirectError):
+            prev = self._options.server_host +':'+ str(self._options.server_port)
+            # http://host:port
+            #        ^^^^ ^^^^
+            uri = str(e).split(':')
+            self._options.server_host = uri[1][2:]
+            self._options.server_port = uri[2]
+            logging.warn("%s Too busy now. Redirecting to %s:%s" % (prev, self._options.server_host, self._options.server_port))
+            if self._options.is_kiwi_tdoa:
+                self._options.status = 2
+                return None
+            return 2
+        if isinstance(e, KiwiTimeLimitError):
+            return None
+        if self._options.is_kiwi_tdoa:
+            self._options.status = 1
+        print_exc()
+        return None
+
+    def _finish(self):
+        self._run_event.clear()   # tell all other threads to stop
+        self._recorder.close()
+        self._recorder._close_func()
+        if self._rigctld:
+            self._rigctld.close()
+
+class KiwiWorker(threading.Thread, KiwiWorkerPolicy):
+    """ With queue_depth > 0 frames are received by a separate reader thread and handed to this thread
+        through a FrameQueue, so that slow processing (decoding, resampling, disk writes) does not
+        stall the TCP connection. queue_policy decides what happens when the queue is full """
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None,
+                 queue_depth=0, queue_policy=FrameQueue.BLOCK):
         super(KiwiWorker, self).__init__(group=group, target=target, name=name)
         self._recorder, self._options, self._run_event = args
         self._recorder._reader = True
@@ -16,83 +91,81 @@ class KiwiWorker(threading.Thread):
         self._rigctld = None
         if self._options.rigctl_enabled:
             self._rigctld = Rigctld(self._recorder, self._options.rigctl_port, self._options.rigctl_address)
+        self._queue = FrameQueue(queue_depth, queue_policy) if queue_depth > 0 else None
 
     def _do_run(self):
         return self._run_event.is_set()
 
     def run(self):
-        self.connect_count = self._options.connect_retries
-        self.busy_count = self._options.busy_retries
-        
+        self._init_policy()
+
         while self._do_run():
             try:
                 self._recorder.connect(self._options.server_host, self._options.server_port)
             except Exception as e:
-                logging.warn("Failed to connect, sleeping and reconnecting error='%s'" %e)
-                if self._options.is_kiwi_tdoa:
-                    self._options.status = 1
+                timeout = self._on_connect_error(e)
+                if timeout is None:
                     break
-                self.connect_count -= 1
-                if self._options.connect_retries > 0 and self.connect_count == 0:
-                    break
-                if self._options.connect_timeout > 0:
-                    self._event.wait(timeout = self._options.connect_timeout)
+                if timeout > 0:
+                    self._event.wait(timeout = timeout)
                 continue
 
             try:
                 self._recorder.open()
+                if self._queue is not None and self._recorder._reader:
+                    self._run_two_stage()
                 while self._do_run():
                     self._recorder.run()
                     # do things like freq changes while not receiving sound
                     if self._rigctld:
                         self._rigctld.run()
-            except KiwiServerTerminatedConnection as e:
-                if self._options.no_api:
-                    msg = ''
-                else:
-                    msg = ' Reconnecting after 5 seconds'
-                logging.info("%s:%s %s.%s" % (self._options.server_host, self._options.server_port, e, msg))
-                self._recorder.close()
-                if self._options.no_api:    ## don't retry
-                    break
-                self._recorder._start_ts = None ## this makes the recorder open a new file on restart
-                self._event.wait(timeout=5)
-                continue
-            except KiwiTooBusyError:
-                if self._options.is_kiwi_tdoa:
-                    self._options.status = 2
-                    break
-                self.busy_count -= 1
-                if self._options.busy_retries > 0 and self.busy_count == 0:
-                    break
-                logging.warn("%s:%d Too busy now. Reconnecting after %d seconds"
-                      % (self._options.server_host, self._options.server_port, self._options.busy_timeout))
-                if self._options.busy_timeout > 0:
-                    self._event.wait(timeout = self._options.busy_timeout)
-                continue
-            except KiwiRedirectError as e:
-                prev = self._options.server_host +':'+ str(self._options.server_port)
-                # http://host:port
-                #        ^^^^ ^^^^
-                uri = str(e).split(':')
-                self._options.server_host = uri[1][2:]
-                self._options.server_port = uri[2]
-                logging.warn("%s Too busy now. Redirecting to %s:%s" % (prev, self._options.server_host, self._options.server_port))
-                if self._options.is_kiwi_tdoa:
-                    self._options.status = 2
+            except Exception as e:
+                timeout = self._on_run_error(e)
+                if timeout is None:
                     break
-                self._event.wait(timeout=2)
+                if timeout > 0:
+                    self._event.wait(timeout = timeout)
                 continue
-            except KiwiTimeLimitError:
-                break
-            except Exception as e:
-                if self._options.is_kiwi_tdoa:
-                    self._options.status = 1
-                print_exc()
-                break
 
-        self._run_event.clear()   # tell all other threads to stop
-        self._recorder.close()
-        self._recorder._close_func()
-        if self._rigctld:
-            self._rigctld.close()
+        self._finish()
+        if self._queue is not None:
+            logging.info('%s:%s %s: %s' % (self._options.server_host, self._options.server_port,
+                                          self._recorder._type, self._queue.stats_str()))
+
+    def _run_two_stage(self):
+        """ processing stage; returns only when run_event has been cleared """
+        q = self._queue
+        q.reset()
+        reader = threading.Thread(target=self._read_frames, args=(q,), name='%s-reader' % self.name)
+        reader.daemon = True
+        reader.start()
+        try:
+            while self._do_run():
+                item = q.get(timeout=0.5)
+                if item is not None:
+                    self._recorder._process_ws_message(item[1])
+                self._recorder._check_time_limit()
+                # do things like freq changes while not receiving sound
+                if self._rigctld:
+                    self._rigctld.run()
+        finally:
+            q.close()
+            reader.join(0.1)
+            if reader.is_alive():
+                ## unblock the reader's recv; writing (e.g. the websocket close frame) remains possible
+                try:
+                    self._recorder._socket.shutdown(socket.SHUT_RD)
+                except socket.error:
+                    pass
+                reader.join()
+
+    def _read_frames(self, q):
+        """ reader stage: receives and timestamps frames """
+        try:
+            while not q.closed:
+                message = self._recorder._receive_ws_message()
+                if isinstance(message, memoryview):
+                    message = message.tobytes() ## BufferedStream reuses its receive buffer
+                q.put(message, droppable=message[0:3] in (b'SND', b'W/F'))
+        except Exception as e:
+            q.put_error(e)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## decodes recordings made with kiwirecorder.py --adpcm (.kad files) to .wav files
+##  * every file is split at its index entries into ranges decoded by a pool of processes;
+##    each frame is decoded with the decoder state stored in front of it, so the result is
+##    identical to what kiwirecorder.py would have written without --adpcm
+##  * every range is written directly to its place in the .wav file
+##  * lost frames (where the stored decoder state does not continue the previous frame) are counted
+
+import logging, os, time
+import multiprocessing
+from optparse import OptionParser
+
+from kiwi.adpcmfile import AdpcmReader
+from kiwi.wavwriter import write_wav_header, wav_header_size
+
+def decode_range(args):
+    filename, out_filename, start, end, out_offset = args
+    samples,first,last,num_discontinuities = AdpcmReader(filename).decode(start, end)
+    fd = os.open(out_filename, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        os.lseek(fd, out_offset, os.SEEK_SET)
+        view = memoryview(samples.tobytes())
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return first, last, num_discontinuities
+
+def split_ranges(reader, num_ranges):
+    """ contiguous ranges of index entries: (start offset, end offset, first sample) """
+    index = reader.index
+    bounds = [index[len(index)*k // num_ranges] for k in range(num_ranges)]
+    bounds = sorted(set(bounds))
+    return [(e.offset, bounds[i+1].offset if i+1 < len(bounds) else reader.data_end, e.sample)
+            for i,e in enumerate(bounds)]
+
+def convert(filename, pool, num_ranges):
+    t0 = time.time()
+    reader = AdpcmReader(filename)
+    out_filename = os.path.splitext(filename)[0] + '.wav'
+    rf64 = 2*reader.num_samples + wav_header_size(False) > 0xFFFFFFFF
+    header_size = wav_header_size(False, rf64)
+    with open(out_filename, 'wb') as fp:
+        write_wav_header(fp, header_size + 2*reader.num_samples, reader.samplerate, 1, False, rf64)
+        fp.truncate(header_size + 2*reader.num_samples)
+    ranges = split_ranges(reader, num_ranges) if reader.index else []
+    results = pool.map(decode_range, [(filename, out_filename, start, end, header_size + 2*sample)
+                                      for start,end,sample in ranges])
+    ## frames lost at the boundaries between ranges
+    num_lost = sum(r[2] for r in results)
+    num_lost += sum(1 for a,b in zip(results[:-1], results[1:]) if a[1] is not None and a[1] != b[0])
+    logging.info('%s -> %s: %d samples at %g Hz, %d ranges, %d lost frames, %.2f sec'
+                 % (filename, out_filename, reader.num_samples, reader.samplerate, len(ranges), num_lost,
+                    time.time() - t0))
+
+def main():
+    parser = OptionParser(usage='%prog [options] file.kad ...')
+    parser.add_option('-j', '--processes',
+                      dest='processes',
+                      type='int', default=multiprocessing.cpu_count(),
+                      help='Number of decoding processes (default: %default)')
+    parser.add_option('--log', '--log-level', '--log_level',
+                      dest='log_level',
+                      type='choice', default='info',
+                      choices=['debug', 'info', 'warn', 'error', 'critical'],
+                      help='Log level: debug|info|warn(ing)|error|critical')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no input files')
+    logging.basicConfig(level=logging.getLevelName(options.log_level.upper()), format='%(message)s')
+    pool = multiprocessing.Pool(options.processes)
+    try:
+        for filename in args:
+            convert(filename, pool, 4*options.processes)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## queries the catalog written by kiwirecorder.py --catalog
+##  e.g. all GNSS-timed IQ recordings between 7000 and 7300 kHz on a given day:
+##    kiwi_catalog.py --db rec.db -m iq -f 7000-7300 --from 2024-05-01 --to 2024-05-02 --gnss
+
+import csv, os, sys, time
+from optparse import OptionParser
+
+from kiwi.catalog import COLUMNS, connect_readonly, query, parse_time, format_time
+
+def main():
+    parser = OptionParser(usage='%prog --db FILE [options]')
+    parser.add_option('--db', dest='db', type='string', default=None,
+                      help='Catalog database written by kiwirecorder.py --catalog')
+    parser.add_option('--from', dest='t_from', type='string', default=None,
+                      help='Recordings ending after this UTC time (YYYY-MM-DD[THH:MM[:SS]] or unix time)')
+    parser.add_option('--to', dest='t_to', type='string', default=None,
+                      help='Recordings starting before this UTC time')
+    parser.add_option('-f', '--freq', dest='freq', type='string', default=None,
+                      help='Frequency in kHz, or a range FMIN-FMAX')
+    parser.add_option('-m', '--mode', dest='mode', type='string', default=None,
+                      help='Modulation, e.g. iq')
+    parser.add_option('--station', dest='station', type='string', default=None,
+                      help='Station name (--station of kiwirecorder.py)')
+    parser.add_option('-s', '--server-host', dest='host', type='string', default=None,
+                      help='Kiwi host name')
+    parser.add_option('--gnss', dest='gnss', action='store_true', default=False,
+                      help='Only recordings with a GNSS solution (IQ recorded with --kiwi-wav)')
+    parser.add_option('--limit', dest='limit', type='int', default=None,
+                      help='At most this many recordings')
+    parser.add_option('--format', dest='format', type='choice', choices=['paths', 'table', 'csv'], default='table',
+                      help='Output: paths|table|csv (default: %default)')
+    (options, args) = parser.parse_args()
+    if options.db is None:
+        parser.error('--db is required')
+    if not os.path.exists(options.db):
+        parser.error('%s: no such catalog' % options.db)
+
+    f_min = f_max = None
+    if options.freq is not None:
+        f = options.freq.split('-', 1) if '-' in options.freq[1:] else [options.freq]*2
+        f_min,f_max = float(f[0]), float(f[1])
+    t0 = time.time()
+    db = connect_readonly(options.db)
+    rows = query(db, None if options.t_from is None else parse_time(options.t_from),
+                 None if options.t_to is None else parse_time(options.t_to),
+                 f_min, f_max, options.mode, options.station, options.host, options.gnss, options.limit)
+    dt = time.time() - t0
+
+    if options.format == 'paths':
+        for r in rows:
+            print(r['path'])
+    elif options.format == 'csv':
+        w = csv.DictWriter(sys.stdout, COLUMNS)
+        w.writeheader()
+        w.writerows(rows)
+    else:
+        for r in rows:
+            print('%s %8.0fs %10.3f kHz %-4s %-20s %8g Hz %4s %12s %s'
+                  % (format_time(r['start']), r['end'] - r['start'], r['frequency'] or 0, r['mode'],
+                     '%s:%s' % (r['host'], r['port']), r['sample_rate'] or 0,
+                     '' if r['gnss'] is None else r['gnss'], r['bytes'], r['path']))
+        sys.stderr.write('%d recordings (%.1f ms)\n' % (len(rows), 1e3*dt))
+
+if __name__ == '__main__':
+    main()
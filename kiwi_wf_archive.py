@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## inspects, slices and exports waterfall archives (kiwi/wfarchive.py) written by
+## kiwirecorder.py --wf-archive, kiwiwfrecorder.py and microkiwi_waterfall.py -f
+##  e.g. one hour between 7000 and 7300 kHz as calibrated dBm:
+##    kiwi_wf_archive.py -f 7000-7300 --from 2024-05-01T10:00 --to 2024-05-01T11:00 --npz out.npz FILE.kwf
+
+import sys, time
+from optparse import OptionParser
+
+import numpy as np
+
+from kiwi.catalog import parse_time, format_time
+from kiwi.wfarchive import WfArchiveReader, peaks
+
+def main():
+    parser = OptionParser(usage='%prog [options] FILE.kwf')
+    parser.add_option('--from', dest='t_from', type='string', default=None,
+                      help='First row: UTC time (YYYY-MM-DD[THH:MM[:SS]]) or timestamp (GNSS archives: seconds)')
+    parser.add_option('--to', dest='t_to', type='string', default=None,
+                      help='Last row: UTC time or timestamp')
+    parser.add_option('-f', '--freq', dest='freq', type='string', default=None,
+                      help='Frequency range FMIN-FMAX in kHz')
+    parser.add_option('--npz', dest='npz', type='string', default=None,
+                      help='Save the selection to an .npz file: t (timestamps), f (kHz), dBm (rows x bins)')
+    parser.add_option('--peaks', dest='peaks', type='int', default=0,
+                      help='Print the strongest bins of each selected row, as kiwirecorder.py --wf-peaks does')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('one archive file is required')
+
+    a = WfArchiveReader(args[0])
+    f_min = f_max = None
+    if options.freq is not None:
+        f_min,f_max = [float(f) for f in options.freq.split('-', 1)]
+    t_from = None if options.t_from is None else parse_time(options.t_from)
+    t_to   = None if options.t_to   is None else parse_time(options.t_to)
+    t0 = time.time()
+    times,freqs,rows = a.select(t_from, t_to, f_min, f_max)
+    dt = time.time() - t0
+
+    if options.peaks > 0 and len(rows):
+        ## as kiwirecorder.py --wf-peaks: all bins, frequencies of a span divided into nbins-1 steps
+        r0,r1 = a.row_range(t_from, t_to)
+        start = a.center - a.span/2
+        bins,dBm = peaks(a.rows[r0:r1], options.peaks)
+        for b_row,d_row in zip(bins, dBm):
+            sys.stdout.write(''.join('%d %.2f %d  ' % (b, start + a.span*float(b)/(a.nbins-1), d + a.cal)
+                                     for b,d in zip(b_row, d_row) if b >= 0) + '\n')
+    if options.npz is not None:
+        np.savez(options.npz, t=np.array(times), f=freqs, dBm=a.dBm(rows))
+
+    if options.peaks == 0:
+        fmt = (lambda t: '%.3f' % t) if a.gnss else format_time
+        print('%s: %d bins, %.3f kHz center, %.3f kHz span, zoom %d, cal %d dB, %s timestamps'
+              % (a.filename, a.nbins, a.center, a.span, a.zoom, a.cal, 'GNSS' if a.gnss else 'host'))
+        if a.num_rows:
+            print('%d rows from %s to %s, %s' % (a.num_rows, fmt(a.times[0]), fmt(a.times[-1]),
+                                                  'no index' if a.index is None else '%d index entries' % len(a.index)))
+        if len(rows):
+            print('selected %d rows from %s to %s, %d bins from %.3f to %.3f kHz (%.1f ms)'
+                  % (len(rows), fmt(times[0]), fmt(times[-1]), len(freqs), freqs[0], freqs[-1], 1e3*dt))
+        if a.metadata:
+            print('metadata: %s' % a.metadata)
+
+if __name__ == '__main__':
+    main()
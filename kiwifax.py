@@ -304,6 +304,8 @@ RADIOFAX_IOC288_START_TONE = 675
 RADIOFAX_STOP_TONE = 450
 
 class KiwiFax(KiwiSDRStream):
+    _reuse_iq_buffer = True ## _process_iq_samples() copies the samples
+
     def __init__(self, options):
         super(KiwiFax, self).__init__()
         self._options = options
@@ -605,7 +607,8 @@ class KiwiFax(KiwiSDRStream):
         while True:
             with open(self._output_name + '.png', 'wb') as fp:
                 try:
-                    png.Writer(len(self._rows[0]), len(self._rows), greyscale=True).write(fp, self._rows)
+                    png.Writer(len(self._rows[0]), len(self._rows), greyscale=True,
+                               compression=self._options.png_compression).write(fp, self._rows)
                     break
                 except KeyboardInterrupt:
                     pass
@@ -703,6 +706,10 @@ def main():
                       dest='max_height',
                       type='int', default=2300,
                       help='Maximum page height; default: 2300.')
+    parser.add_option('--png-compression',
+                      dest='png_compression',
+                      type='int', default=None,
+                      help='zlib compression level 0-9 of the PNG file; default: 6.')
     parser.add_option('--dump-spectra', '--dump-spectra',
                       dest='dump_spectra',
                       action='store_true', default=False,
@@ -730,6 +737,8 @@ def main():
                       help='Print "ADC OV" message when Kiwi ADC is overloaded')
 
     (options, unused_args) = parser.parse_args()
+    if options.png_compression is not None and not 0 <= options.png_compression <= 9:
+        parser.error('--png-compression must be between 0 and 9')
     options.ws_timestamp = int(time.time() + os.getpid()) & 0xffffffff
     options.raw = False
     options.nolocal = False
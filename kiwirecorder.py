@@ -8,13 +8,25 @@
 ##
 
 import array, logging, os, struct, sys, time, copy, threading, os
-import gc
+import functools, gc
 import math
 import numpy as np
 from copy import copy
 from traceback import print_exc
 import png
-from kiwi import KiwiSDRStream, KiwiWorker
+from kiwi import KiwiSDRStream, KiwiWorker, GNSSHeader
+from kiwi.keepalive import KeepaliveWheel, log_sent_stats
+from kiwi.launcher import StaggeredLauncher
+from kiwi.framequeue import FrameQueue
+from kiwi.wavwriter import WavWriter, MmapWavWriter, write_wav_header
+from kiwi.diskwriter import DiskWriter
+from kiwi.rotation import SampleRotation, gnss_to_unix, gnss_shift, next_boundary
+from kiwi.supervisor import tdoa_print, run_sharded, partition, log_process_stats
+from kiwi.adpcmfile import AdpcmWriter
+from kiwi.replay import WsCapture, KiwiReplayWorker, capture_filename
+from kiwi.catalog import Catalog
+from kiwi.retention import RetentionManager
+from kiwi.wfarchive import WfArchiveWriter
 import optparse as optparse
 from optparse import OptionParser
 from optparse import OptionGroup
@@ -54,16 +66,6 @@ def clamp(x, xmin, xmax):
 def by_dBm(e):
     return e['dBm']
 
-def _write_wav_header(fp, filesize, samplerate, num_channels, is_kiwi_wav):
-    samplerate = int(samplerate+0.5)
-    fp.write(struct.pack('<4sI4s', b'RIFF', filesize - 8, b'WAVE'))
-    bits_per_sample = 16
-    byte_rate       = samplerate * num_channels * bits_per_sample // 8
-    block_align     = num_channels * bits_per_sample // 8
-    fp.write(struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, num_channels, samplerate, byte_rate, block_align, bits_per_sample))
-    if not is_kiwi_wav:
-        fp.write(struct.pack('<4sI', b'data', filesize - 12 - 8 - 16 - 8))
-
 class RingBuffer(object):
     def __init__(self, len):
         self._array = np.zeros(len, dtype='float64')
@@ -95,10 +97,10 @@ class GNSSPerformance(object):
         self._buffer_num_frames   = RingBuffer(10)
 
     def analyze(self, filename, gps):
-        ## gps = {'last_gps_solution': 1, 'dummy': 0, 'gpsnsec': 886417795, 'gpssec': 466823}
+        ## gps = GNSSHeader(last_gps_solution=1, dummy=0, gpssec=466823, gpsnsec=886417795)
         self._num_frames += 1
-        if gps['last_gps_solution'] == 0 and self._last_solution != 0:
-            ts = gps['gpssec'] + 1e-9 * gps['gpsnsec']
+        if gps.last_gps_solution == 0 and self._last_solution != 0:
+            ts = gps.gpssec + 1e-9 * gps.gpsnsec
             msg_gnss_drift = ''
             dt = 0
             if self._last_ts != -1:
@@ -118,7 +120,7 @@ class GNSSPerformance(object):
             self._num_frames = 0
             self._last_ts    = ts
 
-        self._last_solution = gps['last_gps_solution']
+        self._last_solution = gps.last_gps_solution
 
 
 class Squelch(object):
@@ -166,6 +168,12 @@ class Squelch(object):
 ## -------------------------------------------------------------------------------------------------
 
 class KiwiSoundRecorder(KiwiSDRStream):
+    _buffered_ws = True ## message bodies are consumed before the next one is received
+    _iq_as_int16 = True
+    _disk_writer = None ## shared DiskWriter with --async-writes
+    _catalog = None     ## shared Catalog with --catalog
+    _retention = None   ## shared RetentionManager with --retain-*
+
     def __init__(self, options):
         super(KiwiSoundRecorder, self).__init__()
         self._options = options
@@ -179,7 +187,11 @@ class KiwiSoundRecorder(KiwiSDRStream):
         self._squelch = Squelch(self._options) if options.sq_thresh is not None else None
         if options.scan_yaml is not None:
             self._squelch = [Squelch(options).set_threshold(options.scan_yaml['threshold']) for _ in range(len(options.scan_yaml['frequencies']))]
-        self._last_gps = dict(zip(['last_gps_solution', 'dummy', 'gpssec', 'gpsnsec'], [0,0,0,0]))
+        self._last_gps = GNSSHeader(0, 0, 0, 0)
+        self._writer = None
+        self._encoder = None    ## EncoderProcess with --compress
+        self._keep_adpcm = options.adpcm
+        self._rotation = SampleRotation(options.dt) if options.dt != 0 else None
         self._resampler = None
         self._kiwi_samplerate = False
         self._gnss_performance = GNSSPerformance()
@@ -297,11 +309,13 @@ class KiwiSoundRecorder(KiwiSDRStream):
                         self._options.scan_state = 'WAIT'
                         self._start_ts = None
                         self._start_time = None
+                        self._close_writer()
             else: ## single channel mode
                 is_open = self._squelch.process(seq, rssi)
                 if not is_open:
                     self._start_ts = None
                     self._start_time = None
+                    self._close_writer()
         return is_open
 
 
@@ -327,16 +341,15 @@ class KiwiSoundRecorder(KiwiSDRStream):
 
         self._write_samples(samples, {})
 
-    def _process_iq_samples(self, seq, samples, rssi, gps):
+    def _process_iq_samples_int16(self, seq, samples, rssi, gps):
         if not self._squelch_status(seq, samples, rssi):
             return
 
-        ##print gps['gpsnsec']-self._last_gps['gpsnsec']
+        ##print gps.gpsnsec-self._last_gps.gpsnsec
         self._last_gps = gps
-        ## convert list of complex numbers into an array
-        s = np.zeros(2*len(samples), dtype=np.int16)
-        s[0::2] = np.real(samples).astype(np.int16)
-        s[1::2] = np.imag(samples).astype(np.int16)
+        ## interleaved I,Q int16 samples: written as they are
+        s = samples
+        n = len(samples) // 2
 
         if self._options.resample > 0:
             if HAS_RESAMPLER:
@@ -344,61 +357,138 @@ class KiwiSoundRecorder(KiwiSDRStream):
                 if self._resampler is None:
                     self._resampler = Resampler(channels=2, converter_type='sinc_best')
                     self._setup_resampler()
-                s = self._resampler.process(s.reshape(len(samples),2), ratio=self._ratio)
+                s = self._resampler.process(s.reshape(n,2), ratio=self._ratio)
                 s = np.round(s.flatten()).astype(np.int16)
             else:
                 ## resampling by linear interpolation
-                n  = len(samples)
                 m  = int(round(n*self._ratio))
                 xa = np.arange(m)/self._ratio
                 xp = np.arange(n)
                 s  = np.zeros(2*m, dtype=np.int16)
-                s[0::2] = np.round(np.interp(xa,xp,np.real(samples))).astype(np.int16)
-                s[1::2] = np.round(np.interp(xa,xp,np.imag(samples))).astype(np.int16)
+                s[0::2] = np.round(np.interp(xa,xp,samples[0::2])).astype(np.int16)
+                s[1::2] = np.round(np.interp(xa,xp,samples[1::2])).astype(np.int16)
 
         self._write_samples(s, gps)
 
         # no GPS or no recent GPS solution
-        last = gps['last_gps_solution']
+        last = gps.last_gps_solution
         if last == 255 or last == 254:
             self._options.status = 3
 
-    def _update_wav_header(self):
-        with open(self._get_output_filename(), 'r+b') as fp:
-            fp.seek(0, os.SEEK_END)
-            filesize = fp.tell()
-            fp.seek(0, os.SEEK_SET)
-
-            # fp.tell() sometimes returns zero. _write_wav_header writes filesize - 8
-            if filesize >= 8:
-                _write_wav_header(fp, filesize, self._output_sample_rate, self._num_channels, self._options.is_kiwi_wav)
-
     def _write_samples(self, samples, *args):
         """Output to a file on the disk."""
-        now = time.gmtime()
-        sec_of_day = lambda x: 3600*x.tm_hour + 60*x.tm_min + x.tm_sec
-        dt_reached = self._options.dt != 0 and self._start_ts is not None and sec_of_day(now)//self._options.dt != sec_of_day(self._start_ts)//self._options.dt
-        if self._start_ts is None or (self._options.filename == '' and dt_reached):
-            self._start_ts = now
-            self._start_time = time.time()
-            # Write a static WAV header
-            with open(self._get_output_filename(), 'wb') as fp:
-                _write_wav_header(fp, 100, self._output_sample_rate, self._num_channels, self._options.is_kiwi_wav)
-            if self._options.is_kiwi_tdoa:
-                # NB for TDoA support: MUST be a print (i.e. not a logging.info)
-                print("file=%d %s" % (self._options.idx, self._get_output_filename()))
+        if self._options.dt == 0 or self._options.filename != '':
+            if self._start_ts is None:
+                self._start_file(time.time())
+            self._write_block(samples, *args)
+            return
+        ## --dt-sec: the block is split at file boundaries
+        if self._start_ts is None:
+            ## first block, or after a reconnect (see KiwiWorkerPolicy): a new file at the current time
+            self._close_writer()
+            self._rotation.reset()
+        elif self._writer is None:
+            self._rotation.reset()
+        gps = args[0]
+        nc = self._num_channels
+        pieces = self._rotation.split(len(samples)//nc, self._output_sample_rate, gnss_to_unix(gps))
+        if self._options.adpcm:
+            ## compressed frames cannot be split: the file is rotated at the frame containing the boundary
+            t_files = [t_file for _,_,t_file in pieces if t_file is not None]
+            if t_files:
+                self._start_file(t_files[-1])
+            self._write_block(samples)
+            return
+        for start,end,t_file in pieces:
+            if t_file is not None:
+                self._start_file(t_file)
+            if start == 0:
+                self._write_block(samples[:end*nc], gps)
+            else:
+                dt = start / self._output_sample_rate
+                self._write_block(samples[start*nc:end*nc], gnss_shift(gps, dt) if self._options.is_kiwi_wav else gps)
+
+    def _start_file(self, t):
+        self._close_writer()
+        self._start_ts = time.gmtime(t)
+        self._start_time = time.time()
+        self._file_start = t
+        self._file_samples = 0
+        filename = self._get_output_filename()
+        if self._options.adpcm:
+            metadata = dict(frequency=self._freq, modulation=self._options.modulation, station=self._options.station,
+                            start=time.strftime('%Y-%m-%dT%H:%M:%SZ', self._start_ts))
+            self._writer = AdpcmWriter(filename if filename == os.devnull else self._get_output_filename('.kad'),
+                                       self._sample_rate, metadata, header_interval=self._options.wav_header_interval)
+        elif self._options.compress is not None and filename != os.devnull:
+            ## python3.8+ only, so imported here
+            from kiwi.encoder import EncoderProcess, CompressedWriter, CODECS
+            if self._encoder is None:
+                self._encoder = EncoderProcess(self._options.compress, self._options.compress_buffer << 20).start()
+            self._writer = CompressedWriter(self._get_output_filename(CODECS[self._options.compress]),
+                                            self._output_sample_rate, self._num_channels,
+                                            self._options.is_kiwi_wav, self._encoder)
+        elif self._options.preallocate and filename != os.devnull:
+            ## size of the samples until the next rotation, with margin for the kiwi_wav chunk headers
+            duration = next_boundary(t, self._options.dt) - t
+            expected_size = int(1.05 * duration * self._output_sample_rate * self._num_channels * 2) + 1024
+            self._writer = MmapWavWriter(filename, self._output_sample_rate, self._num_channels,
+                                         self._options.is_kiwi_wav, self._options.wav_header_interval,
+                                         expected_size=expected_size, rf64=self._options.rf64)
+        else:
+            self._writer = WavWriter(filename, self._output_sample_rate, self._num_channels,
+                                     self._options.is_kiwi_wav, self._options.wav_header_interval,
+                                     disk_writer=self._disk_writer, rf64=self._options.rf64)
+        if self._options.is_kiwi_tdoa:
+            # NB for TDoA support: MUST be a print (i.e. not a logging.info)
+            tdoa_print("file=%d %s" % (self._options.idx, self._writer.filename))
+        else:
+            logging.info("Started a new file: %s" % self._writer.filename)
+
+    def _write_block(self, samples, *args):
+        self._file_samples += len(samples) // self._num_channels
+        if self._options.adpcm:
+            self._writer.write_frame(self._adpcm_frame)
+        elif self._options.is_kiwi_wav:
+            gps = args[0]
+            self._gnss_performance.analyze(self._writer.filename, gps)
+            self._writer.write(samples, gps)
+        else:
+            self._writer.write(samples)
+
+    def _close_writer(self):
+        if self._writer is not None:
+            if (self._catalog is None and self._retention is None) or self._writer.filename == os.devnull:
+                self._writer.close()
+            elif self._options.compress is not None:
+                ## the encoder process is still writing the file: recorded with its size once it has finished
+                self._writer.close(functools.partial(self._file_closed, self._catalog_row()))
             else:
-                logging.info("Started a new file: %s" % self._get_output_filename())
-        with open(self._get_output_filename(), 'ab') as fp:
-            if self._options.is_kiwi_wav:
-                gps = args[0]
-                self._gnss_performance.analyze(self._get_output_filename(), gps)
-                fp.write(struct.pack('<4sIBBII', b'kiwi', 10, gps['last_gps_solution'], 0, gps['gpssec'], gps['gpsnsec']))
-                sample_size = samples.itemsize * len(samples)
-                fp.write(struct.pack('<4sI', b'data', sample_size))
-            # TODO: something better than that
-            samples.tofile(fp)
-        self._update_wav_header()
+                ## with --async-writes the file may not be complete yet: the size is the writer's
+                self._writer.close()
+                self._file_closed(self._catalog_row(), self._writer.filename, getattr(self._writer, 'size', None))
+            self._writer = None
+
+    def _catalog_row(self):
+        opt = self._options
+        return dict(path=os.path.abspath(self._writer.filename), start=self._file_start,
+                    end=self._file_start + self._file_samples / self._output_sample_rate,
+                    frequency=self._freq, mode=opt.modulation, host=opt.server_host, port=opt.server_port,
+                    station=opt.station, sample_rate=self._output_sample_rate, channels=self._num_channels,
+                    gnss=self._last_gps.last_gps_solution if opt.is_kiwi_wav else None)
+
+    def _file_closed(self, row, path, size):
+        """ adds a closed recording to the catalog and to the retention manager """
+        if self._catalog is not None:
+            self._catalog.add(bytes=size, **row)
+        if self._retention is not None:
+            self._retention.add(path, size=size)
+
+    def _close_func(self):
+        self._close_writer()
+        if self._encoder is not None:
+            self._encoder.stop()
+            self._encoder = None
 
     def _on_gnss_position(self, pos):
         pos_record = False
@@ -423,6 +513,10 @@ class KiwiSoundRecorder(KiwiSDRStream):
 ## -------------------------------------------------------------------------------------------------
 
 class KiwiWaterfallRecorder(KiwiSDRStream):
+    _disk_writer = None
+    _buffered_ws = True
+    _numpy_wf = True    ## False: per-bin Python row processing (reference for test/bench_waterfall.py)
+
     def __init__(self, options):
         super(KiwiWaterfallRecorder, self).__init__()
         self._options = options
@@ -433,12 +527,18 @@ class KiwiWaterfallRecorder(KiwiSDRStream):
         self._freq_offset = options.freq_offset
         self._start_ts = time.gmtime()
         self._start_time = None
-        self._last_gps = dict(zip(['last_gps_solution', 'dummy', 'gpssec', 'gpsnsec'], [0,0,0,0]))
+        self._last_gps = GNSSHeader(0, 0, 0, 0)
         self.wf_pass = 0
-        self._rows = []
+        self._png = None            ## png.StreamWriter of the current --wf-png file
+        self._png_fp = None
+        self._png_filename = None
+        self._peaks_filename = None
+        self._archive = None        ## WfArchiveWriter with --wf-archive
         self._cmap_r = array.array('B')
         self._cmap_g = array.array('B')
         self._cmap_b = array.array('B')
+        self._lut = None
+        self._lut_key = None
 
         # Kiwi color map
         for i in range(256):
@@ -507,33 +607,98 @@ class KiwiWaterfallRecorder(KiwiSDRStream):
         value_percent = relative_value / fullscale
         return clamp(int(round(value_percent * 255)), 0, 255)
     
-    def _process_waterfall_samples(self, seq, samples):
-        baseband_freq = self._remove_freq_offset(self._freq)
-        nbins = len(samples)
-        bins = nbins-1
+    def _color_lut(self):
+        """ RGB pixels of all 256 waterfall bytes for the current mindb/maxdb/wf_cal """
+        key = (self._options.mindb, self._options.maxdb, self._options.wf_cal)
+        if self._lut_key != key:
+            ci = [self._waterfall_color_index_max_min(v) for v in range(256)]
+            self._lut = np.array([(self._cmap_r[c], self._cmap_g[c], self._cmap_b[c]) for c in ci], dtype=np.uint8)
+            self._lut_key = key
+        return self._lut
+
+    def _waterfall_row_python(self, samples, do_wf, num_peaks, do_auto):
+        """ per-bin reference implementation of _waterfall_row_numpy() """
         i = 0
         pwr = []
         pixels = array.array('B')
-        do_wf = self._options.wf_png and (not self._options.wf_auto or (self._options.wf_auto and self.wf_pass != 0))
-
         for s in samples:
+            s = int(s)
             dBm = s - 255
             if i > 2 and dBm > -190:    # skip DC offset notch in first two bins and also masked areas
                 pwr.append({ 'dBm':dBm, 'i':i })
             i = i+1
-            
+
             if do_wf:
                 ci = self._waterfall_color_index_max_min(s)
                 pixels.append(self._cmap_r[ci])
                 pixels.append(self._cmap_g[ci])
                 pixels.append(self._cmap_b[ci])
-        
+
         pwr.sort(key = by_dBm)
         length = len(pwr)
-        pmin = pwr[0]['dBm'] + self._options.wf_cal
-        bmin = pwr[0]['i']
-        pmax = pwr[length-1]['dBm'] + self._options.wf_cal
-        bmax = pwr[length-1]['i']
+        peaks = [(pwr[j]['i'], pwr[j]['dBm']) for j in range(length-1, length-1-num_peaks, -1)]
+        levels = (pwr[int(0.50 * length)]['dBm'], pwr[int(0.95 * length)]['dBm']) if do_auto else None
+        return (pixels if do_wf else None,
+                (pwr[0]['dBm'], pwr[0]['i']), (pwr[length-1]['dBm'], pwr[length-1]['i']), peaks, levels)
+
+    def _waterfall_row_numpy(self, samples, do_wf, num_peaks, do_auto):
+        """ pixels, (min dBm, bin), (max dBm, bin), [(bin, dBm)] of the num_peaks strongest bins and,
+            with do_auto, the median and 95th percentile dBm of a waterfall row.
+            Ties are resolved like the stable sort of _waterfall_row_python() """
+        samples = np.asarray(samples)
+        nbins = len(samples)
+        dBm = samples.astype(np.int64) - 255
+        ## skip DC offset notch in first two bins and also masked areas
+        mask = dBm <= -190
+        mask[:3] = True
+        ## (dBm, bin) in one sortable key
+        key = np.ma.masked_array(dBm*nbins + np.arange(nbins), mask=mask)
+        kmin,kmax = int(key.min()), int(key.max())
+        peaks = []
+        if num_peaks > 0:
+            key = key.compressed()
+            length = len(key)
+            if num_peaks < length:
+                top = key[np.argpartition(key, length-num_peaks)[length-num_peaks:]]
+                top.sort()
+            else:
+                ## the reference wraps around to the weakest bins here
+                top = np.sort(key)
+            n = len(top)
+            peaks = [(int(k % nbins), int(k // nbins)) for k in (top[n-1-i] for i in range(num_peaks))]
+        levels = None
+        if do_auto:
+            pwr = dBm[~mask]
+            length = len(pwr)
+            k = (int(0.50 * length), int(0.95 * length))
+            pwr = np.partition(pwr, k)
+            levels = (int(pwr[k[0]]), int(pwr[k[1]]))
+        pixels = None
+        if do_wf:
+            if samples.dtype == np.uint8:
+                rgb = self._color_lut()[samples]
+            else:
+                ## decompressed rows can overshoot 0..255
+                rgb = self._color_lut()[np.clip(samples, 0, 255)]
+                for i in np.flatnonzero((samples < 0) | (samples > 255)):
+                    ci = self._waterfall_color_index_max_min(int(samples[i]))
+                    rgb[i] = (self._cmap_r[ci], self._cmap_g[ci], self._cmap_b[ci])
+            pixels = array.array('B', rgb.tobytes())
+        return pixels, (kmin // nbins, kmin % nbins), (kmax // nbins, kmax % nbins), peaks, levels
+
+    def _process_waterfall_samples(self, seq, samples):
+        if self._start_ts is None:  ## reconnected: continue in new files
+            self._close_files()
+            self._start_ts = time.gmtime()
+        baseband_freq = self._remove_freq_offset(self._freq)
+        nbins = len(samples)
+        bins = nbins-1
+        do_wf = self._options.wf_png and (not self._options.wf_auto or (self._options.wf_auto and self.wf_pass != 0))
+        do_auto = self._options.wf_png and self._options.wf_auto and self.wf_pass == 0
+        row = self._waterfall_row_numpy if self._numpy_wf else self._waterfall_row_python
+        pixels,(pmin,bmin),(pmax,bmax),peaks,levels = row(samples, do_wf, self._options.wf_peaks, do_auto)
+        pmin += self._options.wf_cal
+        pmax += self._options.wf_cal
         span = self.zoom_to_span(self._options.zoom)
         start = baseband_freq - span/2
         
@@ -542,17 +707,20 @@ class KiwiWaterfallRecorder(KiwiSDRStream):
                   % (nbins, pmin, start + span*bmin/bins, pmax, start + span*bmax/bins))
 
         if self._options.wf_peaks > 0:
-            with open(self._get_output_filename("_peaks.txt"), 'a') as fp:
-                for i in range(self._options.wf_peaks):
-                    j = length-1-i
-                    bin_i = pwr[j]['i']
-                    bin_f = float(bin_i)/bins
-                    fp.write("%d %.2f %d  " % (bin_i, start + span*bin_f, pwr[j]['dBm'] + self._options.wf_cal))
-                fp.write("\n")
-
-        if self._options.wf_png and self._options.wf_auto and self.wf_pass == 0:
-            noise = pwr[int(0.50 * length)]['dBm']
-            signal = pwr[int(0.95 * length)]['dBm']
+            line = ''
+            for bin_i,dBm in peaks:
+                bin_f = float(bin_i)/bins
+                line += "%d %.2f %d  " % (bin_i, start + span*bin_f, dBm + self._options.wf_cal)
+            line += "\n"
+            self._peaks_filename = self._get_output_filename("_peaks.txt")
+            if self._disk_writer is not None:
+                self._disk_writer.write(self._peaks_filename, line.encode())
+            else:
+                with open(self._peaks_filename, 'a') as fp:
+                    fp.write(line)
+
+        if do_auto:
+            noise,signal = levels
             # empirical adjustments
             signal = signal + 30
             if signal < -80:
@@ -563,30 +731,66 @@ class KiwiWaterfallRecorder(KiwiSDRStream):
             logging.info("--wf_auto: mindb %d, maxdb %d, cal %d dB" % (self._options.mindb, self._options.maxdb, self._options.wf_cal))
         self.wf_pass = self.wf_pass+1
         if do_wf is True:
-            self._rows.append(pixels)
+            self._write_row(pixels)
+        if self._options.wf_archive:
+            self._write_archive_row(samples, baseband_freq, span)
+
+    def _write_archive_row(self, samples, center, span):
+        samples = np.asarray(samples)
+        if samples.dtype != np.uint8:
+            samples = np.clip(samples, 0, 255).astype(np.uint8)
+        if self._archive is None:
+            self._archive = WfArchiveWriter(self._get_output_filename('.kwf'), len(samples), center, span,
+                                            zoom=self._options.zoom, cal=self._options.wf_cal,
+                                            metadata={'host': self._options.server_host,
+                                                      'port': self._options.server_port,
+                                                      'station': self._options.station,
+                                                      'freq_offset': self._freq_offset})
+        self._archive.write_row(time.time(), samples)
+
+    def _write_row(self, pixels):
+        """ rows are streamed into FILE.png.tmp, which is renamed to FILE.png when it is complete """
+        if self._png is not None and 0 < self._options.wf_png_rows <= self._png.height:
+            self._close_png()
+        if self._png is None:
+            if self._options.wf_png_rows > 0:
+                self._png_filename = self._get_output_filename(time.strftime('_%Y%m%dT%H%M%SZ.png', time.gmtime()))
+            else:
+                self._png_filename = self._get_output_filename(".png")
+            self._png_fp = open(self._png_filename + '.tmp', 'wb')
+            self._png = png.StreamWriter(self._png_fp, len(pixels) // 3, compression=self._options.wf_png_compression)
+        self._png.write_row(pixels)
 
-    def _close_func(self):
-        if self._options.wf_png is True:
-            self._flush_rows()
-        if self._options.wf_peaks > 0:
-            logging.info("--wf-peaks: writing to file %s" % self._get_output_filename("_peaks.txt"))
+    def _close_png(self):
+        try:
+            self._png.close()
+        finally:
+            self._png_fp.close()
+        os.rename(self._png_filename + '.tmp', self._png_filename)
+        logging.info("--wf_png: wrote file %s (%d rows)" % (self._png_filename, self._png.height))
+        self._png = self._png_fp = None
+
+    def _close_files(self):
+        if self._png is not None:
+            self._close_png()
+        if self._archive is not None:
+            self._archive.close()
+            logging.info("--wf-archive: wrote file %s (%d rows)" % (self._archive.filename, self._archive.num_rows))
+            self._archive = None
+        if self._peaks_filename is not None:
+            if self._disk_writer is not None:
+                self._disk_writer.close(self._peaks_filename)
+            logging.info("--wf-peaks: writing to file %s" % self._peaks_filename)
+            self._peaks_filename = None
 
-    def _flush_rows(self):
-        if not self._rows:
-            return
-        filename = self._get_output_filename(".png")
-        logging.info("--wf_png: writing file %s" % filename)
-        while True:
-            with open(filename, 'wb') as fp:
-                try:
-                    png.Writer(len(self._rows[0]) // 3, len(self._rows)).write(fp, self._rows)
-                    break
-                except KeyboardInterrupt:
-                    pass
+    def _close_func(self):
+        self._close_files()
 
 ## -------------------------------------------------------------------------------------------------
 
 class KiwiExtensionRecorder(KiwiSDRStream):
+    _buffered_ws = True
+
     def __init__(self, options):
         super(KiwiExtensionRecorder, self).__init__()
         self._options = options
@@ -634,6 +838,8 @@ class KiwiExtensionRecorder(KiwiSDRStream):
 ## -------------------------------------------------------------------------------------------------
 
 class KiwiNetcat(KiwiSDRStream):
+    _buffered_ws = True
+
     def __init__(self, options, reader):
         super(KiwiNetcat, self).__init__()
         self._options = options
@@ -648,7 +854,7 @@ class KiwiNetcat(KiwiSDRStream):
         self._start_time = time.time()
         self._options.stats = None
         self._squelch = Squelch(self._options) if options.sq_thresh is not None else None
-        self._last_gps = dict(zip(['last_gps_solution', 'dummy', 'gpssec', 'gpsnsec'], [0,0,0,0]))
+        self._last_gps = GNSSHeader(0, 0, 0, 0)
         self._fp_stdout = os.fdopen(sys.stdout.fileno(), 'wb')
         self._first = True;
 
@@ -739,7 +945,7 @@ class KiwiNetcat(KiwiSDRStream):
         if self._options.progress is True:
             return
         if self._options.nc_wav and self._first == True:
-            _write_wav_header(self._fp_stdout, 0x7ffffff0, self._sample_rate, 2, False)
+            write_wav_header(self._fp_stdout, 0x7ffffff0, self._sample_rate, 2, False)
             self._first = False
         self._fp_stdout.write(samples)
         self._fp_stdout.flush()
@@ -779,11 +985,142 @@ def get_comma_separated_args(option, opt, value, parser, fn):
     setattr(parser.values, option.dest, values)
 ##    setattr(parser.values, option.dest, map(fn, value.split(',')))
 
-def join_threads(snd, wf, ext):
-    [r._event.set() for r in snd]
-    [r._event.set() for r in wf]
-    [r._event.set() for r in ext]
-    [t.join() for t in threading.enumerate() if t is not threading.current_thread()]
+def join_threads(*recorders):
+    [r._event.set() for rs in recorders for r in rs]
+    ## daemon threads (e.g. multiprocessing queue feeders with --processes) never finish on their own
+    [t.join() for t in threading.enumerate() if t is not threading.current_thread() and not t.daemon]
+
+def run_recorders(indices, run_event, gopt, options, multiple_connections):
+    """ runs the connections options[i] for i in indices until run_event is cleared.
+        Called from main(), or with --processes once per shard process """
+    keepalive_wheel = KeepaliveWheel() if gopt.keepalive_interval > 0 else None
+
+    new_worker = functools.partial(KiwiWorker, queue_depth=gopt.queue_depth, queue_policy=gopt.queue_policy)
+    if gopt.asyncio and not gopt.netcat:
+        ## python3 only, so imported here
+        from kiwi.aioworker import KiwiAsyncEngine, KiwiAsyncWorker
+        engine = KiwiAsyncEngine(run_event, keepalive_wheel=keepalive_wheel)
+        new_worker = functools.partial(KiwiAsyncWorker, engine=engine)
+    elif keepalive_wheel is not None:
+        keepalive_wheel.start(run_event)
+    if gopt.ws_replay is not None:
+        ## the recorders are fed from the captures of a previous session instead of connecting
+        def new_worker(args):
+            recorder,opt,_ = args
+            return KiwiReplayWorker(args=args, replay_file=capture_filename(gopt.ws_replay, opt.idx, recorder._type),
+                                    realtime=gopt.replay_speed > 0, speed=gopt.replay_speed)
+
+    conns = [(i, options[i]) for i in indices]
+    snd_recorders = []
+    if not gopt.netcat and (not gopt.waterfall or (gopt.waterfall and gopt.sound)):
+        for i,opt in conns:
+            opt.multiple_connections = multiple_connections
+            opt.idx = i
+            snd_recorders.append(new_worker(args=(KiwiSoundRecorder(opt),opt,run_event)))
+
+    wf_recorders = []
+    if not gopt.netcat and gopt.waterfall:
+        for i,opt in conns:
+            opt.multiple_connections = multiple_connections
+            opt.idx = i
+            wf_recorders.append(new_worker(args=(KiwiWaterfallRecorder(opt),opt,run_event)))
+
+    ext_recorders = []
+    if not gopt.netcat and (gopt.extension is not None):
+        for i,opt in conns:
+            opt.multiple_connections = multiple_connections
+            opt.idx = i
+            ext_recorders.append(new_worker(args=(KiwiExtensionRecorder(opt),opt,run_event)))
+
+    nc_recorders = []
+    if gopt.netcat:
+        for i,opt in conns:
+            opt.multiple_connections = multiple_connections
+            opt.idx = 0
+            nc_recorders.append(new_worker(args=(KiwiNetcat(opt, True),opt,run_event)))
+            if gopt.fdx:
+                opt.writer_init = False
+                opt.idx = 1
+                nc_recorders.append(KiwiWorker(args=(KiwiNetcat(opt, False),opt,run_event)))
+
+    disk_writer = DiskWriter(gopt.fsync_interval).start() if gopt.async_writes else None
+    catalog = Catalog(gopt.catalog).start() if gopt.catalog is not None else None
+    retention = None
+    if gopt.retain_max_size > 0 or gopt.retain_max_age > 0 or gopt.retain_min_free > 0:
+        retention = RetentionManager(max_bytes=gopt.retain_max_size*1e9 if gopt.retain_max_size > 0 else None,
+                                     max_age=gopt.retain_max_age*3600 if gopt.retain_max_age > 0 else None,
+                                     min_free=gopt.retain_min_free*1e9 if gopt.retain_min_free > 0 else None,
+                                     action=gopt.retain_action,
+                                     adopt=gopt.retain_adopt).start()
+        for d in set(options[i].dir or '.' for i in indices):
+            retention.watch(d)
+    recorders = [w._recorder for w in snd_recorders + wf_recorders + ext_recorders + nc_recorders]
+    for r in recorders:
+        r._keepalive_interval = gopt.keepalive_interval
+        r._keepalive_wheel = keepalive_wheel
+        r._disk_writer = disk_writer
+        r._catalog = catalog
+        r._retention = retention
+        if gopt.ws_capture is not None:
+            opt = r._options
+            r._ws_capture = WsCapture(capture_filename(gopt.ws_capture, opt.idx, r._type),
+                                      dict(host=opt.server_host, port=opt.server_port, type=r._type, idx=opt.idx,
+                                           frequency=opt.frequency, modulation=opt.modulation,
+                                           start=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())))
+    t_start = time.time()
+
+    launcher = StaggeredLauncher(run_event, gopt.launch_delay)
+    for k,r in enumerate(snd_recorders):
+        launcher.add(options[indices[k]].server_host, r, 'sound recorder %d' % indices[k])
+    for k,r in enumerate(wf_recorders):
+        launcher.add(options[indices[k]].server_host, r, 'waterfall recorder %d' % indices[k])
+    for k,r in enumerate(ext_recorders):
+        ## let snd/wf get established first
+        depends_on = [rs[k] for rs in (snd_recorders, wf_recorders) if rs]
+        launcher.add(options[indices[k]].server_host, r, 'extension recorder %d' % indices[k], depends_on)
+
+    try:
+        launcher.start()
+
+        for i,r in enumerate(nc_recorders):
+            if gopt.launch_delay != 0 and i != 0 and options[i-1].server_host == options[i].server_host:
+                time.sleep(gopt.launch_delay)
+            r.start()
+            #logging.info("started netcat recorder %d, timestamp=%d" % (i, options[i].ws_timestamp))
+            logging.info("started netcat recorder %d" % i)
+
+        while run_event.is_set():
+            time.sleep(.1)
+
+    except KeyboardInterrupt:
+        run_event.clear()
+        join_threads(snd_recorders, wf_recorders, ext_recorders, nc_recorders)
+        print("KeyboardInterrupt: threads successfully closed")
+    except Exception as e:
+        print_exc()
+        run_event.clear()
+        join_threads(snd_recorders, wf_recorders, ext_recorders, nc_recorders)
+        print("Exception: threads successfully closed")
+    else:
+        ## wait for the recorders to finish so that their status is final
+        join_threads(snd_recorders, wf_recorders, ext_recorders, nc_recorders)
+
+    if disk_writer is not None:
+        disk_writer.stop()
+    if catalog is not None:
+        catalog.stop()
+    if retention is not None:
+        retention.stop()
+    for r in recorders:
+        if r._ws_capture is not None:
+            r._ws_capture.close()
+
+    log_sent_stats(recorders, time.time() - t_start)
+    sent = [r.get_sent_stats() for r in recorders]
+    return {'status':      dict((i, options[i].status) for i in indices),
+            'sent':        (sum(f for f,_ in sent), sum(b for _,b in sent)),
+            'connections': len(indices)}
+
 
 def main():
     # extend the OptionParser so that we can print multiple paragraphs in
@@ -890,11 +1227,102 @@ def main():
     parser.add_option('--dt-sec',
                       dest='dt',
                       type='int', default=0,
-                      help='Start a new file when mod(sec_of_day,dt) == 0')
+                      help='Start a new file when mod(sec_of_day,dt) == 0. Files are split at the exact sample, '
+                      'using the GNSS timestamps of IQ data when available')
+    parser.add_option('--rf64',
+                      dest='rf64',
+                      action='store_true', default=False,
+                      help='Write RF64 files (EBU Tech 3306) which can grow beyond 4 GiB, e.g. for long IQ or wideband recordings. '
+                      'The kiwi GNSS chunks of --kiwi-wav are written as usual')
+    parser.add_option('--catalog',
+                      dest='catalog',
+                      type='string', default=None,
+                      help='Add every recorded SND/IQ file with its start and end time, frequency, mode, host, sample rate, '
+                      'GNSS status and size to this SQLite database; query it with kiwi_catalog.py')
+    parser.add_option('--retain-max-size',
+                      dest='retain_max_size',
+                      type='float', default=0,
+                      help='Keep the recordings in each output directory below this many GB, oldest files first. '
+                      'Only the files recorded by this run are managed, see --retain-adopt')
+    parser.add_option('--retain-max-age',
+                      dest='retain_max_age',
+                      type='float', default=0,
+                      help='Delete (or compress, see --retain-action) recordings older than this many hours')
+    parser.add_option('--retain-min-free',
+                      dest='retain_min_free',
+                      type='float', default=0,
+                      help='Keep at least this many GB free on the file system of each output directory, '
+                      'removing the oldest recordings')
+    parser.add_option('--retain-adopt',
+                      dest='retain_adopt',
+                      default=False,
+                      action='store_true',
+                      help='Also manage the recordings already in the output directories which are named the way '
+                      'kiwirecorder.py names them (YYYYMMDDTHHMMSSZ_FREQ_..., not --filename); '
+                      'they may be deleted or compressed by the --retain-* limits')
+    parser.add_option('--retain-action',
+                      dest='retain_action',
+                      type='choice', choices=['delete', 'compress'], default='delete',
+                      help='What the --retain-* limits do to the oldest recordings: delete, or compress to .xz '
+                      'and delete compressed files only when a size or free space limit is still exceeded (default: %default)')
+    parser.add_option('--ws-capture',
+                      dest='ws_capture',
+                      type='string', default=None,
+                      help='Write every WebSocket message received to PREFIX_<connection>_<SND|WF|EXT>.kws '
+                      'together with its arrival time, for replaying the session with --ws-replay')
+    parser.add_option('--ws-replay',
+                      dest='ws_replay',
+                      type='string', default=None,
+                      help='Instead of connecting, feed the captures PREFIX_<connection>_<SND|WF|EXT>.kws '
+                      'written with --ws-capture into the recorders (with the same connection options) '
+                      'and log the throughput')
+    parser.add_option('--replay-speed',
+                      dest='replay_speed',
+                      type='float', default=0,
+                      help='With --ws-replay, replay at this multiple of the captured pace; 0 is as fast as possible (default: %default)')
+    parser.add_option('--adpcm',
+                      dest='adpcm',
+                      action='store_true', default=False,
+                      help='Record the compressed SND frames as received (.kad files, a quarter of the size of .wav files) '
+                      'together with their sequence number, flags and S-meter value. '
+                      'Convert them to .wav with kiwi_adpcm_to_wav.py. Not for IQ modes, --ncomp or --resample')
+    parser.add_option('--compress',
+                      dest='compress',
+                      type='choice', choices=['flac', 'xz'], default=None,
+                      help='Compress SND/IQ recordings losslessly in a separate process per connection: '
+                      'flac (needs the soundfile module) or xz (.wav.xz). '
+                      'With --kiwi-wav the GNSS timestamps are written to a .gnss.csv file next to each recording')
+    parser.add_option('--compress-buffer',
+                      dest='compress_buffer',
+                      type='int', default=16,
+                      help='Size in MB of the shared memory buffer between a connection and its --compress process. '
+                      'Blocks which do not fit are replaced by zeros (default: %default)')
+    parser.add_option('--preallocate',
+                      dest='preallocate',
+                      action='store_true', default=False,
+                      help='With --dt-sec, preallocate each .wav file for the time until the next rotation '
+                      'and write it through a memory map; the file is truncated to its actual length when closed')
+    parser.add_option('--wav-header-interval', '--wav_header_interval',
+                      dest='wav_header_interval',
+                      type='float', default=1,
+                      help='Update the sizes in the header of the .wav file being recorded at most every this many seconds '
+                      '(and when it is closed). This bounds how out of date the header is after a crash; '
+                      'with 0 it is updated after every block (default: %default)')
+    parser.add_option('--async-writes', '--async_writes',
+                      dest='async_writes',
+                      action='store_true', default=False,
+                      help='Write .wav and --wf-peaks files from a background thread shared by all connections, '
+                      'so that a slow disk does not stall receiving. Queue depth and write latency are logged at exit')
+    parser.add_option('--fsync-interval', '--fsync_interval',
+                      dest='fsync_interval',
+                      type='float', default=0,
+                      help='With --async-writes, fsync the files being written every this many seconds '
+                      'and when they are closed (default: never)')
     parser.add_option('--launch-delay', '--launch_delay',
                       dest='launch_delay',
-                      type='int', default=0,
-                      help='Delay (secs) in launching multiple connections')
+                      type='float', default=0,
+                      help='Delay (secs) in launching multiple connections to the same host; '
+                      'connections to different hosts are launched in parallel')
     parser.add_option('--connect-timeout', '--connect_timeout',
                       dest='connect_timeout',
                       type='int', default=15,
@@ -915,6 +1343,33 @@ def main():
                       dest='socket_timeout',
                       type='int', default=10,
                       help='Socket timeout(sec) during data transfers')
+    parser.add_option('--keepalive-interval', '--keepalive_interval',
+                      dest='keepalive_interval',
+                      type='float', default=1,
+                      help='Send at most one keepalive per this many seconds on each connection (default: %default). '
+                      'With 0 a keepalive is sent after every received audio or waterfall frame')
+    parser.add_option('--queue-depth', '--queue_depth',
+                      dest='queue_depth',
+                      type='int', default=0,
+                      help='Receive frames in a separate thread and queue up to this many for processing, '
+                      'so that slow disks or resampling do not stall the connection (default: off)')
+    parser.add_option('--queue-policy', '--queue_policy',
+                      dest='queue_policy',
+                      type='choice', choices=FrameQueue.POLICIES, default=FrameQueue.BLOCK,
+                      help='What to do with a frame arriving when the --queue-depth queue is full: '
+                      '"block" the reader, "drop-oldest" or "drop-newest" audio/waterfall frame (default: %default). '
+                      'High-water mark, drops and latency are logged at exit')
+    parser.add_option('--processes',
+                      dest='processes',
+                      type='int', default=1,
+                      help='Split the connections (-s host list) across this many worker processes. '
+                      'Logs and --kiwi-tdoa output are handled by the parent process, which also reports '
+                      'the CPU time and connection count of each process at exit (default: %default)')
+    parser.add_option('--asyncio',
+                      dest='asyncio',
+                      action='store_true', default=False,
+                      help='Run all connections from a single asyncio event loop thread instead of one thread per connection '
+                        '(not used for netcat connections)')
     parser.add_option('--OV',
                       dest='ADC_OV',
                       action='store_true', default=False,
@@ -1067,10 +1522,22 @@ def main():
                       dest='wf_png',
                       action='store_true', default=False,
                       help='Create waterfall .png file. --station and --filename options apply')
+    group.add_option('--wf-png-rows',
+                      dest='wf_png_rows',
+                      type='int', default=0,
+                      help='With --wf-png start a new .png file, named with its start time, every N rows (default: one file)')
+    group.add_option('--wf-png-compression',
+                      dest='wf_png_compression',
+                      type='int', default=None,
+                      help='zlib compression level 0-9 of --wf-png files (default: 6). 1 is several times faster, the files are about 25% larger')
     group.add_option('--wf-peaks',
                       dest='wf_peaks',
                       type='int', default=0,
                       help='Save specified number of waterfall peaks to file. --station and --filename options apply')
+    group.add_option('--wf-archive',
+                      dest='wf_archive',
+                      action='store_true', default=False,
+                      help='Save the waterfall rows with timestamps to a .kwf archive (see kiwi_wf_archive.py). --station and --filename options apply')
     group.add_option('--maxdb',
                       dest='maxdb',
                       type='int', default=-30,
@@ -1143,6 +1610,36 @@ def main():
     options = optparse.Values(parser.get_default_values().__dict__)
     options._update_careful(opts_no_defaults.__dict__)
 
+    if options.asyncio and options.queue_depth > 0:
+        parser.error('--queue-depth is not supported with --asyncio')
+    if options.processes > 1 and options.netcat:
+        parser.error('--processes is not supported with --nc')
+    if options.preallocate and options.dt == 0:
+        parser.error('--preallocate needs --dt-sec')
+    if options.preallocate and options.async_writes:
+        parser.error('--preallocate is not supported with --async-writes')
+    if options.wf_png_compression is not None and not 0 <= options.wf_png_compression <= 9:
+        parser.error('--wf-png-compression must be between 0 and 9')
+    if options.compress is not None:
+        ## python3.8+ only, so imported here
+        try:
+            from kiwi.encoder import available_codecs
+        except ImportError as e:
+            parser.error('--compress needs python3.8 or later (%s)' % e)
+        if options.compress not in available_codecs():
+            parser.error('--compress=%s is not available (install the soundfile module)' % options.compress)
+    if options.netcat and (options.ws_capture is not None or options.ws_replay is not None):
+        parser.error('--ws-capture and --ws-replay are not supported with --nc')
+    if options.ws_capture is not None and options.ws_replay is not None:
+        parser.error('--ws-capture cannot be combined with --ws-replay')
+    if options.adpcm and (not options.compression or options.resample > 0 or options.is_kiwi_wav
+                          or any(m in ['iq', 'drm', 'sas', 'qam'] for m in options.modulation.split(','))):
+        parser.error('--adpcm needs compressed audio: it cannot be used with IQ modes, --ncomp, --resample or --kiwi-wav')
+    if options.adpcm and (options.compress is not None or options.preallocate or options.rf64):
+        parser.error('--adpcm cannot be combined with --compress, --preallocate or --rf64')
+    if options.compress is not None and (options.preallocate or options.rf64):
+        parser.error('--compress cannot be combined with --preallocate or --rf64')
+
     ## clean up OptionParser which has cyclic references
     parser.destroy()
 
@@ -1236,77 +1733,18 @@ def main():
     gopt = options
     multiple_connections,options = options_cross_product(options)
 
-    snd_recorders = []
-    if not gopt.netcat and (not gopt.waterfall or (gopt.waterfall and gopt.sound)):
-        for i,opt in enumerate(options):
-            opt.multiple_connections = multiple_connections
-            opt.idx = i
-            snd_recorders.append(KiwiWorker(args=(KiwiSoundRecorder(opt),opt,run_event)))
-
-    wf_recorders = []
-    if not gopt.netcat and gopt.waterfall:
-        for i,opt in enumerate(options):
-            opt.multiple_connections = multiple_connections
-            opt.idx = i
-            wf_recorders.append(KiwiWorker(args=(KiwiWaterfallRecorder(opt),opt,run_event)))
-
-    ext_recorders = []
-    if not gopt.netcat and (gopt.extension is not None):
-        for i,opt in enumerate(options):
-            opt.multiple_connections = multiple_connections
-            opt.idx = i
-            ext_recorders.append(KiwiWorker(args=(KiwiExtensionRecorder(opt),opt,run_event)))
-
-    nc_recorders = []
-    if gopt.netcat:
-        for i,opt in enumerate(options):
-            opt.multiple_connections = multiple_connections
-            opt.idx = 0
-            nc_recorders.append(KiwiWorker(args=(KiwiNetcat(opt, True),opt,run_event)))
-            if gopt.fdx:
-                opt.writer_init = False
-                opt.idx = 1
-                nc_recorders.append(KiwiWorker(args=(KiwiNetcat(opt, False),opt,run_event)))
-    try:
-        for i,r in enumerate(snd_recorders):
-            if opt.launch_delay != 0 and i != 0 and options[i-1].server_host == options[i].server_host:
-                time.sleep(opt.launch_delay)
-            r.start()
-            #logging.info("started sound recorder %d, timestamp=%d" % (i, options[i].ws_timestamp))
-            logging.info("started sound recorder %d" % i)
-
-        for i,r in enumerate(wf_recorders):
-            if i != 0 and options[i-1].server_host == options[i].server_host:
-                time.sleep(opt.launch_delay)
-            r.start()
-            logging.info("started waterfall recorder %d" % i)
-
-        for i,r in enumerate(ext_recorders):
-            if i != 0 and options[i-1].server_host == options[i].server_host:
-                time.sleep(opt.launch_delay)
-            time.sleep(3)   # let snd/wf get established first
-            r.start()
-            logging.info("started extension recorder %d" % i)
-
-        for i,r in enumerate(nc_recorders):
-            if opt.launch_delay != 0 and i != 0 and options[i-1].server_host == options[i].server_host:
-                time.sleep(opt.launch_delay)
-            r.start()
-            #logging.info("started netcat recorder %d, timestamp=%d" % (i, options[i].ws_timestamp))
-            logging.info("started netcat recorder %d" % i)
-
-        while run_event.is_set():
-            time.sleep(.1)
-
-    except KeyboardInterrupt:
-        run_event.clear()
-        join_threads(snd_recorders, wf_recorders, ext_recorders, nc_recorders)
-        print("KeyboardInterrupt: threads successfully closed")
-    except Exception as e:
-        print_exc()
-        run_event.clear()
-        join_threads(snd_recorders, wf_recorders, ext_recorders, nc_recorders)
-        print("Exception: threads successfully closed")
+    if gopt.processes > 1 and len(options) > 1:
+        results = run_sharded(run_recorders, (gopt, options, multiple_connections),
+                              partition([opt.server_host for opt in options], gopt.processes), run_event)
+        for r in results:
+            for i,status in r['status'].items():
+                options[i].status = status
+        log_process_stats(results)
+        logging.info('%d processes: sent %d frames, %d bytes on %d connections'
+                     % (len(results), sum(r['sent'][0] for r in results),
+                        sum(r['sent'][1] for r in results), sum(r['connections'] for r in results)))
+    else:
+        run_recorders(list(range(len(options))), run_event, gopt, options, multiple_connections)
 
     if gopt.is_kiwi_tdoa:
       for i,opt in enumerate(options):
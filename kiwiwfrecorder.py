@@ -4,9 +4,12 @@
 ## to be merged into kiwirecorder.py
 
 import gc, logging, os, time, threading, os
+from bisect import bisect_left
+from collections import deque
 import numpy as np
 from traceback import print_exc
 from kiwi import KiwiSDRStream, KiwiWorker
+from kiwi.wfarchive import WfArchiveWriter
 from optparse import OptionParser
 try:
     from Queue import Queue,Empty  ## python2
@@ -15,6 +18,8 @@ except ImportError:
 
 
 class KiwiSoundRecorder(KiwiSDRStream):
+    _reuse_iq_buffer = True ## only the GNSS timestamps are used
+
     def __init__(self, options, q):
         super(KiwiSoundRecorder, self).__init__()
         self._options = options
@@ -40,7 +45,7 @@ class KiwiSoundRecorder(KiwiSDRStream):
             else:
                 self._num_skip = 0
         gps_time = gps['gpssec'] + 1e-9*gps['gpsnsec']
-        self._queue.put([seq, gps_time])
+        self._queue.put(('SND', seq, gps_time, time.time()))
 
 class KiwiWaterfallRecorder(KiwiSDRStream):
     def __init__(self, options, q):
@@ -50,14 +55,14 @@ class KiwiWaterfallRecorder(KiwiSDRStream):
         self._type = 'W/F'
         self._freq = options.frequency
         self._zoom = options.zoom
-        self._freq_bins = None
+        self._span = None
         self._num_channels = 2
         self._num_skip = 2 ## skip data at the start of the WS stream with seq < 2
 
     def _setup_rx_params(self):
         self._set_zoom_cf(self._zoom, self._freq)
         self._set_maxdb_mindb(-10, -110)    # needed, but values don't matter
-        self._freq_bins = self._freq + (0.5+np.arange(self.WF_BINS))/self.WF_BINS * self.zoom_to_span(self._options.zoom)
+        self._span = self.zoom_to_span(self._options.zoom)
         #self._set_wf_comp(True)
         self._set_wf_comp(False)
         self._set_wf_speed(1)   # 1 Hz update
@@ -71,84 +76,156 @@ class KiwiWaterfallRecorder(KiwiSDRStream):
             else:
                 self._num_skip = 0
         logging.info('process_wf_samples: seq= %5d %s' % (seq, samples))
-        self._queue.put({'seq':        seq,
-                         'freq_bins':  self._freq_bins,
-                         'wf_samples': samples})
+        self._queue.put(('W/F', seq, {'center':     self._freq,
+                                      'span':       self._span,
+                                      'zoom':       self._zoom,
+                                      'wf_samples': samples}, time.time()))
+
+class SeqTimestamps(object):
+    """ Bounded buffer of the (seq, GNSS time) pairs of the SND stream, in seq order """
+    def __init__(self, maxlen=4096):
+        self._maxlen = maxlen
+        self._seqs = []
+        self._ts   = []
+
+    def add(self, seq, ts):
+        if self._seqs and seq <= self._seqs[-1]:    ## the SND stream has restarted
+            self.clear()
+        self._seqs.append(seq)
+        self._ts.append(ts)
+        if len(self._seqs) > 2*self._maxlen:        ## trimmed in batches
+            del self._seqs[:-self._maxlen]
+            del self._ts[:-self._maxlen]
+
+    def clear(self):
+        self._seqs, self._ts = [], []
+
+    def newest(self):
+        return self._seqs[-1] if self._seqs else None
+
+    def lookup(self, seq):
+        """ (GNSS time, exact): exact for a seq in the buffer, else interpolated between its neighbours.
+            None if seq is older than the buffer or not yet covered by it """
+        i = bisect_left(self._seqs, seq)
+        if i < len(self._seqs) and self._seqs[i] == seq:
+            return self._ts[i], True
+        if i == 0 or i == len(self._seqs):
+            return None
+        s0,s1 = self._seqs[i-1], self._seqs[i]
+        t0,t1 = self._ts[i-1], self._ts[i]
+        return t0 + (t1-t0) * (seq-s0) / float(s1-s0), False
 
 class Consumer(threading.Thread):
-    """ Combines WF data with precise GNSS timestamps from the SND stream """
-    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
+    """ Combines WF data with precise GNSS timestamps from the SND stream.
+        Both streams feed one queue; every event resolves as many pending W/F rows, in seq order,
+        as the SND timestamps received so far allow. A W/F row whose seq is missing from the SND
+        stream gets a GNSS time interpolated between its neighbours; rows which cannot be timed
+        within max_wait seconds are dropped and counted as unmatched """
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None,
+                 max_wait=5, max_pending=64, stats_interval=60):
         super(Consumer, self).__init__(group=group, target=target, name=name)
-        self._options, self._snd_queue, self._wf_queue, self._run_event = args
+        self._options, self._queue, self._run_event = args
         self._event     = threading.Event()
-        self._store    = dict()
-        self._wf_data  = None
-        self._start_ts = None
+        self._snd       = SeqTimestamps()
+        self._pending   = deque()   ## (seq, wf_data, arrival time) of W/F rows not yet written
+        self._max_wait  = max_wait
+        self._max_pending = max_pending
+        self._stats_interval = stats_interval
+        self._t_stats   = time.time()
+        self._archive   = None
+        self._start_ts  = None
+        self.num_exact = self.num_interpolated = self.num_unmatched = 0
+        self._latency_sum = self._latency_max = 0
 
     def run(self):
-        while self._run_event.is_set():
-            try:
-                self.proc()
-            except Exception:
-                print_exc()
-                break
+        try:
+            while self._run_event.is_set():
+                try:
+                    event = self._queue.get(timeout=0.5)
+                except Empty:
+                    event = None
+                self.proc(event)
+        except Exception:
+            print_exc()
         self._run_event.clear()   # tell all other threads to stop
-
-    def proc(self):
-        if self._wf_data is None:
-            try:
-                self._wf_data = self._wf_queue.get(timeout=1)
-            except Empty:
-                return
-
-        self.update_store()
-        if self._wf_data['seq'] in self._store:
-            now = time.gmtime()
-            if self._start_ts is None:
-                self._start_ts = now
-                with open(self._get_output_filename(), 'wb') as f:
-                    np.save(f, self._wf_data['freq_bins'])
-
-            ## GNSS timestamp for seq obtained from the SND WS stream
-            ts = self._store.pop(self._wf_data['seq'])
-            logging.info('found seq %d %f %d (%d|%d,%d)'
-                         % (self._wf_data['seq'], ts, len(self._wf_data['wf_samples']),
-                            len(self._store), self._wf_queue.qsize(), self._snd_queue.qsize()))
-            with open(self._get_output_filename(), 'ab') as f:
-                np.save(f, np.array((ts, self._wf_data['wf_samples']),
-                                    dtype=[('ts', np.float64), ('wf', ('B', 1024))]))
-
-            self.prune_store(ts)
-            self._wf_data = None
-        else:
-            time.sleep(0.1)
-
-    def _get_output_filename(self):
+        if self._archive is not None:
+            self._archive.close()
+            logging.info('wrote %s (%d rows)' % (self._archive.filename, self._archive.num_rows))
+        self.log_stats()
+
+    def proc(self, event):
+        if event is not None:
+            kind,seq,data,t_arrival = event
+            if kind == 'SND':
+                self._snd.add(seq, data)
+            else:
+                if self._pending and seq <= self._pending[-1][0]:   ## the W/F stream has restarted
+                    self.drop_pending(len(self._pending))
+                self._pending.append((seq, data, t_arrival))
+        self.resolve()
+        if time.time() - self._t_stats >= self._stats_interval:
+            self.log_stats()
+
+    def resolve(self):
+        now = time.time()
+        while self._pending:
+            seq,wf_data,t_arrival = self._pending[0]
+            r = self._snd.lookup(seq)
+            if r is None:
+                newest = self._snd.newest()
+                if newest is not None and seq < newest:
+                    self.drop_pending(1)    ## older than the SND buffer
+                    continue
+                if now - t_arrival > self._max_wait or len(self._pending) > self._max_pending:
+                    self.drop_pending(1)    ## the SND stream is late or has stopped
+                    continue
+                break
+            ts,exact = r
+            self._pending.popleft()
+            self.write(seq, ts, wf_data)
+            if exact:
+                self.num_exact += 1
+            else:
+                self.num_interpolated += 1
+            latency = now - t_arrival
+            self._latency_sum += latency
+            self._latency_max = max(self._latency_max, latency)
+
+    def drop_pending(self, n):
+        for _ in range(n):
+            seq = self._pending.popleft()[0]
+            logging.info('W/F seq %d: no GNSS timestamp' % seq)
+            self.num_unmatched += 1
+
+    def write(self, seq, ts, wf_data):
+        if self._archive is None:
+            self._start_ts = time.gmtime()
+            filename = self._options.archive or self._get_output_filename(wf_data)
+            self._archive = WfArchiveWriter(filename, len(wf_data['wf_samples']),
+                                            wf_data['center'], wf_data['span'],
+                                            zoom=wf_data['zoom'], gnss=True, append=True,
+                                            metadata={'host':    self._options.server_host,
+                                                      'port':    self._options.server_port,
+                                                      'station': self._options.station})
+        logging.debug('W/F seq %d: GNSS time %f' % (seq, ts))
+        self._archive.write_row(ts, wf_data['wf_samples'])
+
+    def log_stats(self):
+        self._t_stats = time.time()
+        n = self.num_exact + self.num_interpolated
+        logging.info('W/F rows: %d with exact and %d with interpolated GNSS time, %d unmatched; '
+                     'join latency mean %.3f max %.3f sec'
+                     % (self.num_exact, self.num_interpolated, self.num_unmatched,
+                        self._latency_sum / n if n else 0, self._latency_max))
+
+    def _get_output_filename(self, wf_data):
         station = '' if self._options.station is None else '_'+ self._options.station
-        return '%s_%d-%d%s.npy' % (time.strftime('%Y%m%dT%H%M%SZ', self._start_ts),
-                                   round(self._wf_data['freq_bins'][ 0] * 1000),
-                                   round(self._wf_data['freq_bins'][-1] * 1000),
+        center,span = wf_data['center'], wf_data['span']
+        return '%s_%d-%d%s.kwf' % (time.strftime('%Y%m%dT%H%M%SZ', self._start_ts),
+                                   round((center - span/2) * 1000),
+                                   round((center + span/2) * 1000),
                                    station)
 
-    def update_store(self):
-        """ put all available timestamps from the SND stream into the store """
-        while True:
-            try:
-                seq,ts = self._snd_queue.get(timeout=0.01)
-                self._store[seq] = ts
-            except Empty:
-                break
-            except Exception:
-                print_exc()
-                break
-
-    def prune_store(self, ts):
-        """ remove all timestamps before 'ts' """
-        for x in list(self._store.items()):
-            k,v = x
-            if v < ts:
-                self._store.pop(k)
-
 def join_threads(threads):
     [t._event.set() for t in threads]
     [t.join()       for t in threading.enumerate() if t is not threading.current_thread()]
@@ -200,6 +277,10 @@ def main():
                       dest='station',
                       type='string', default=None,
                       help='Station ID to be appended to filename',)
+    parser.add_option('--archive',
+                      dest='archive',
+                      type='string', default=None,
+                      help='Append to this waterfall archive (created if needed) instead of a new timestamped file')
     parser.add_option('--log', '--log-level', '--log_level', type='choice',
                       dest='log_level', default='warn',
                       choices=['debug', 'info', 'warn', 'error', 'critical'],
@@ -229,10 +310,10 @@ def main():
     run_event = threading.Event()
     run_event.set()
 
-    snd_queue,wf_queue = [Queue(),Queue()]
-    snd_recorder = KiwiWorker(args=(KiwiSoundRecorder    (opt, snd_queue), opt, run_event))
-    wf_recorder  = KiwiWorker(args=(KiwiWaterfallRecorder(opt, wf_queue),  opt, run_event))
-    consumer     = Consumer(args=(opt,snd_queue,wf_queue,run_event))
+    queue = Queue()
+    snd_recorder = KiwiWorker(args=(KiwiSoundRecorder    (opt, queue), opt, run_event))
+    wf_recorder  = KiwiWorker(args=(KiwiWaterfallRecorder(opt, queue), opt, run_event))
+    consumer     = Consumer(args=(opt,queue,run_event))
 
     threads = [snd_recorder, wf_recorder, consumer]
 
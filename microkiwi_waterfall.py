@@ -9,6 +9,7 @@ import time
 from datetime import datetime
 
 from kiwi import wsclient
+from kiwi.wfarchive import WfArchiveWriter
 
 import mod_pywebsocket.common
 from mod_pywebsocket.stream import Stream
@@ -27,7 +28,7 @@ from optparse import OptionParser
 
 parser = OptionParser()
 parser.add_option("-f", "--file", dest="filename", type=str,
-                  help="write waterfall data to binary FILE", metavar="FILE")
+                  help="write waterfall data to FILE, a waterfall archive (see kiwi_wf_archive.py)", metavar="FILE")
 parser.add_option("-s", "--server", type=str,
                   help="server name", dest="server", default='192.168.1.82')
 parser.add_option("-p", "--port", type=int,
@@ -38,6 +39,8 @@ parser.add_option("-z", "--zoom", type=int,
                   help="zoom factor", dest="zoom", default=0)
 parser.add_option("-o", "--offset", type=int,
                   help="start frequency in kHz", dest="offset_khz", default=0)
+parser.add_option("-c", "--cal", type=int,
+                  help="waterfall calibration in dB, added to the levels and stored in the archive", dest="cal", default=-13)
 parser.add_option("-v", "--verbose", type=int,
                   help="whether to print progress and debug info", dest="verbosity", default=0)
                   
@@ -76,7 +79,6 @@ if start < 0 or stop > full_span:
     raise Exception(s)
 
 now = str(datetime.now())
-header_bin = struct.pack("II26s", int(center_freq), int(span), bytes(now, 'utf-8'))
 
 print ("Trying to contact server...")
 try:
@@ -114,6 +116,7 @@ length = options['length']
 # create a numpy array to contain the waterfall data
 wf_data = np.zeros((length, bins))
 binary_wf_list = []
+timestamps = []
 time = 0
 while time<length:
     # receive one msg from server
@@ -126,10 +129,11 @@ while time<length:
         spectrum = np.ndarray(len(tmp), dtype='B', buffer=tmp) # convert from binary data to uint8
         if filename:
             binary_wf_list.append(tmp) # append binary data to be saved to file
+            timestamps.append(datetime.now().timestamp())
         #wf_data[time, :] = spectrum-255 # mirror dBs
         wf_data[time, :] = spectrum
         wf_data[time, :] = -(255 - wf_data[time, :])  # dBm
-        wf_data[time, :] = wf_data[time, :] - 13  # typical Kiwi wf cal
+        wf_data[time, :] = wf_data[time, :] + options['cal']  # -13 dB: typical Kiwi wf cal
         time += 1
     else: # this is chatter between client and server
         #print (tmp)
@@ -153,8 +157,9 @@ print ("Waterfall with %d bins: median= %f dB, p95= %f dB - SNR= %f rbw= %f kHz"
 
 if filename:
     print ("Saving binary data to file...")
-    with open(filename, "wb") as fd:
-        fd.write(header_bin) # write the header info at the top
-        for line in binary_wf_list:
-            fd.write(line)
+    archive = WfArchiveWriter(filename, bins, center_freq, span, zoom=zoom, cal=options['cal'],
+                              metadata={'host': host, 'port': port, 'start': now})
+    for t,line in zip(timestamps, binary_wf_list):
+        archive.write_row(t, line)
+    archive.close()
 print ("All done!")
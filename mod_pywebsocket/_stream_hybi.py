@@ -39,6 +39,7 @@ http://tools.ietf.org/html/rfc6455
 from collections import deque
 import logging
 import os
+import socket
 import struct
 import time
 
@@ -344,6 +345,47 @@ class FragmentedFrameBuilder(object):
                 payload_data, opcode, fin, self._mask, self._frame_filters)
 
 
+class PremaskedFrameCache(object):
+    """Pre-built frames for constant messages such as keepalives.
+
+    For every message a pool of frames is built once, each masked with its
+    own random masking key, and the frames are handed out round-robin, so
+    sending the message needs neither header building nor masking.
+    """
+
+    def __init__(self, mask, encode_utf8=True, pool_size=16):
+        """Constructs an instance.
+
+        Args:
+            mask: whether frames are masked.
+            encode_utf8: whether text messages are encoded to UTF-8.
+            pool_size: number of differently masked frames per message.
+        """
+
+        self._mask = mask
+        self._encode_utf8 = encode_utf8
+        self._pool_size = pool_size if mask else 1
+        # (message, binary) -> [frames, index of the next frame]
+        self._pools = {}
+
+    def get(self, message, binary=False):
+        """Returns a frame carrying message as a single final frame."""
+
+        pool = self._pools.get((message, binary))
+        if pool is None:
+            if binary or not self._encode_utf8:
+                build, opcode = create_binary_frame, common.OPCODE_BINARY
+            else:
+                build, opcode = create_text_frame, common.OPCODE_TEXT
+            frames = [bytes(build(message, opcode, 1, self._mask))
+                      for _ in range(self._pool_size)]
+            pool = self._pools[(message, binary)] = [frames, 0]
+
+        frames, index = pool
+        pool[1] = (index + 1) % len(frames)
+        return frames[index]
+
+
 def _create_control_frame(opcode, body, mask, frame_filters):
     frame = Frame(opcode=opcode, payload=body)
 
@@ -437,9 +479,21 @@ class Stream(StreamBase):
         self._writer = FragmentedFrameBuilder(
             self._options.mask_send, self._options.outgoing_frame_filters,
             self._options.encode_text_message_to_utf8)
+        self._constant_frames = PremaskedFrameCache(
+            self._options.mask_send,
+            self._options.encode_text_message_to_utf8)
 
         self._ping_queue = deque()
 
+        # Outbound frames and bytes, including control frames.
+        self.sent_frame_count = 0
+        self.sent_byte_count = 0
+
+    def _write(self, bytes_to_write):
+        StreamBase._write(self, bytes_to_write)
+        self.sent_frame_count += 1
+        self.sent_byte_count += len(bytes_to_write)
+
     def _receive_frame(self):
         """Receives a frame and return data in the frame as a tuple containing
         each header field and payload separately.
@@ -547,6 +601,29 @@ class Stream(StreamBase):
         except ValueError as e:
             raise BadOperationException(e)
 
+    def send_constant_message(self, message, binary=False):
+        """Send a message that is sent over and over again, such as a
+        keepalive, as a pre-built frame taken from a PremaskedFrameCache.
+
+        Falls back to send_message() when outgoing filters are configured,
+        as their output may depend on state.
+        """
+
+        if (self._options.outgoing_message_filters or
+            self._options.outgoing_frame_filters):
+            self.send_message(message, binary=binary)
+            return
+
+        if self._request.server_terminated:
+            raise BadOperationException(
+                'Requested send_message after sending out a closing handshake')
+
+        if binary and isinstance(message, unicode):
+            raise BadOperationException(
+                'Message for binary frame must be instance of str')
+
+        self._write(self._constant_frames.get(message, binary))
+
     def _get_message_from_frame(self, frame):
         """Gets a message from frame. If the message is composed of fragmented
         frames and the frame is not the last fragmented frame, this method
@@ -897,4 +974,158 @@ class Stream(StreamBase):
         return self._original_opcode
 
 
+
+class BufferedStream(Stream):
+    """A Stream that reads ahead into a reusable receive buffer.
+
+    Each socket read is a single recv_into() on a preallocated bytearray and
+    all complete frames found in the buffer are parsed at once, so there is
+    roughly one recv syscall per socket read instead of several per frame.
+
+    Payloads of binary frames are returned as memoryview slices of the
+    receive buffer (no copy). They are only valid until the next call of
+    receive_message() or fill(); copy them if they have to be kept.
+    """
+
+    # Compact the buffer when less than this is left for the next read.
+    _MIN_READ_SIZE = 4096
+
+    def __init__(self, request, options, socket, buffer_size=1 << 18):
+        """Constructs an instance.
+
+        Args:
+            request: mod_python request.
+            options: StreamOptions.
+            socket: the socket the request reads from.
+            buffer_size: initial size of the receive buffer. It grows when
+                a frame does not fit.
+        """
+
+        Stream.__init__(self, request, options)
+
+        self._socket = socket
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._frames = deque()
+
+        self.recv_count = 0
+        self.frame_count = 0
+
+    def _make_room(self):
+        if not self._frames and self._start > 0 and (
+                len(self._buf) - self._end < self._MIN_READ_SIZE):
+            # No parsed frame refers to the buffer anymore: move the partial
+            # frame to the front.
+            length = self._end - self._start
+            self._buf[0:length] = self._buf[self._start:self._end]
+            self._start = 0
+            self._end = length
+        if self._end == len(self._buf):
+            # Queued frames still refer to the current buffer, or a single
+            # frame is larger than the buffer: continue in a new one.
+            length = self._end - self._start
+            buf = bytearray(max(len(self._buf), 2 * length))
+            buf[0:length] = self._buf[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+            self._start = 0
+            self._end = length
+
+    def fill(self):
+        """Reads once from the socket and parses all complete frames.
+
+        Returns:
+            number of bytes read.
+        Raises:
+            ConnectionTerminatedException: when the peer closed the
+                connection or the read failed.
+        """
+
+        self._make_room()
+        try:
+            n = self._socket.recv_into(self._view[self._end:])
+        except socket.error as e:
+            raise ConnectionTerminatedException(
+                'Receiving failed. socket.error (%s) occurred' % e)
+        if n == 0:
+            raise ConnectionTerminatedException(
+                'Receiving failed. Peer closed connection')
+        self.recv_count += 1
+        self._end += n
+        self._parse_frames()
+        return n
+
+    def _parse_frames(self):
+        buf = self._buf
+        pos = self._start
+        end = self._end
+        unmask_receive = self._options.unmask_receive
+        while end - pos >= 2:
+            first_byte = buf[pos]
+            second_byte = buf[pos + 1]
+            payload_length = second_byte & 0x7f
+            header_length = 2
+            if payload_length == 126:
+                if end - pos < 4:
+                    break
+                payload_length = struct.unpack_from('!H', buf, pos + 2)[0]
+                header_length = 4
+            elif payload_length == 127:
+                if end - pos < 10:
+                    break
+                payload_length = struct.unpack_from('!Q', buf, pos + 2)[0]
+                if payload_length > 0x7FFFFFFFFFFFFFFF:
+                    raise InvalidFrameException(
+                        'Extended payload length >= 2^63')
+                header_length = 10
+            mask = (second_byte >> 7) & 1
+            if (mask == 1) != unmask_receive:
+                raise InvalidFrameException(
+                    'Mask bit on the received frame did\'nt match masking '
+                    'configuration for received frames')
+            if mask == 1:
+                header_length += 4
+            frame_end = pos + header_length + payload_length
+            if frame_end > end:
+                break
+
+            opcode = first_byte & 0xf
+            payload = self._view[pos + header_length:frame_end]
+            if mask == 1:
+                masker = util.RepeatedXorMasker(
+                    bytes(buf[pos + header_length - 4:pos + header_length]))
+                payload = masker.mask(payload)
+            elif opcode != common.OPCODE_BINARY:
+                # text and control frames are small and consumed as str
+                payload = bytes(payload)
+            self._frames.append(Frame(fin=(first_byte >> 7) & 1,
+                                      rsv1=(first_byte >> 6) & 1,
+                                      rsv2=(first_byte >> 5) & 1,
+                                      rsv3=(first_byte >> 4) & 1,
+                                      opcode=opcode, payload=payload))
+            self.frame_count += 1
+            pos = frame_end
+        self._start = pos
+
+    def has_message(self):
+        """Returns True if receive_message() can return without reading from
+        the socket, i.e. the parsed frames include a final data frame or a
+        close frame.
+        """
+
+        for frame in self._frames:
+            if frame.opcode == common.OPCODE_CLOSE:
+                return True
+            if frame.fin and not common.is_control_opcode(frame.opcode):
+                return True
+        return False
+
+    def _receive_frame_as_frame_object(self):
+        while not self._frames:
+            self.fill()
+        return self._frames.popleft()
+
+
 # vi:sts=4 sw=4 et
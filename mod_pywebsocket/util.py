@@ -65,6 +65,11 @@ try:
 except ImportError:
     pass
 
+try:
+    import numpy
+except ImportError:
+    pass
+
 
 def get_stack_trace():
     """Get the current stack trace as string.
@@ -225,8 +230,36 @@ class RepeatedXorMasker(object):
         else:
             return result.tostring()
 
+    # Below this length the NumPy call overhead outweighs the loop above.
+    _NUMPY_MIN_LENGTH = 16
+
+    def _mask_using_numpy(self, s):
+        """Perform the mask via NumPy.
+
+        The data is copied into a buffer padded to a multiple of 4 bytes and
+        XORed in place as uint32 words with the masking key rotated to start
+        at the current masking key index.
+        """
+        length = len(s)
+        if length < self._NUMPY_MIN_LENGTH or len(self._masking_key) != 4:
+            return self._mask_using_array(s)
+
+        masking_key_index = self._masking_key_index
+        masking_key = (self._masking_key[masking_key_index:] +
+                       self._masking_key[:masking_key_index])
+
+        result = bytearray((length + 3) & ~3)
+        result[:length] = s
+        words = numpy.frombuffer(result, dtype=numpy.uint32)
+        words ^= numpy.frombuffer(masking_key, dtype=numpy.uint32)[0]
+
+        self._masking_key_index = (masking_key_index + length) % 4
+        return bytes(result[:length])
+
     if 'fast_masking' in globals():
         mask = _mask_using_swig
+    elif 'numpy' in globals():
+        mask = _mask_using_numpy
     else:
         mask = _mask_using_array
 
@@ -61,6 +61,11 @@ import struct
 import math
 from array import array
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 _adam7 = ((0, 0, 8, 8),
           (4, 0, 8, 8),
@@ -114,7 +119,9 @@ class Writer:
                  bytes_per_sample=1,
                  compression=None,
                  interlaced=False,
-                 chunk_limit=2**20):
+                 chunk_limit=2**20,
+                 filter_type=0,
+                 use_numpy=None):
         """
         Create a PNG encoder object.
 
@@ -128,6 +135,12 @@ class Writer:
         bytes_per_sample - 8-bit or 16-bit input data
         compression - zlib compression level (1-9)
         chunk_limit - write multiple IDAT chunks to save memory
+        filter_type - scanline filter: 0 (None), 1 (Sub) or 2 (Up)
+        use_numpy - filter and pack the scanlines with numpy (if it
+                    is installed) in blocks of about chunk_limit bytes;
+                    not for interlaced or 16-bit images. None (the
+                    default) uses numpy only where it is faster: for
+                    numpy input and for filter types other than None
 
         If specified, the transparent and background parameters must
         be a tuple with three integer values for red, green, blue, or
@@ -146,6 +159,9 @@ class Writer:
         if bytes_per_sample < 1 or bytes_per_sample > 2:
             raise ValueError("bytes per sample must be 1 or 2")
 
+        if filter_type not in (0, 1, 2):
+            raise ValueError("filter type must be 0, 1 or 2")
+
         if transparent is not None:
             if greyscale:
                 if type(transparent) is not int:
@@ -183,6 +199,10 @@ class Writer:
         self.compression = compression
         self.chunk_limit = chunk_limit
         self.interlaced = interlaced
+        self.filter_type = filter_type
+        self.use_numpy = (use_numpy is not False and numpy is not None and
+                          not interlaced and bytes_per_sample == 1)
+        self.numpy_always = bool(use_numpy) or filter_type != 0
 
         if self.greyscale:
             self.color_depth = 1
@@ -217,19 +237,136 @@ class Writer:
     def write(self, outfile, scanlines):
         """
         Write a PNG image to the output file.
+
+        scanlines is an iterable of scanlines (sequences of integers,
+        bytes or numpy arrays) or, with use_numpy, a 2-D or 3-D numpy
+        array of height rows.
+        """
+        self.write_header(outfile)
+
+        # http://www.w3.org/TR/PNG/#11IDAT
+        compressor = self.compressor()
+
+        data = b''
+        prev = None
+        for rows in self.blocks(scanlines):
+            if len(data):
+                self.write_idat(outfile, compressor, data)
+            data, prev = self.filter_rows(rows, prev)
+        self.write_end(outfile, compressor, data)
+
+    def blocks(self, scanlines):
+        """
+        Group scanlines into blocks of just over chunk_limit bytes
+        of filtered data.
+        """
+        rows_per_block = self.chunk_limit // (self.width * self.psize + 1) + 1
+        if self.use_numpy and isinstance(scanlines, numpy.ndarray):
+            scanlines = scanlines.reshape(len(scanlines), -1)
+            for i in range(0, len(scanlines), rows_per_block):
+                yield scanlines[i:i+rows_per_block]
+            return
+        rows = []
+        for scanline in scanlines:
+            rows.append(scanline)
+            if len(rows) == rows_per_block:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def filter_rows(self, rows, prev):
+        """
+        Return the filtered data of a block of scanlines, with the
+        filter type byte in front of each, and the last scanline.
+        prev is the scanline before the block (None for the first).
+        """
+        if self.use_numpy and (self.numpy_always or
+                               isinstance(rows, numpy.ndarray) or
+                               isinstance(rows[0], numpy.ndarray)):
+            return self.filter_rows_numpy(rows, prev)
+        data = array('B')
+        for scanline in rows:
+            data.append(self.filter_type)
+            data.extend(self.filter_scanline(scanline, prev))
+            prev = scanline
+        return data, prev
+
+    def filter_scanline(self, scanline, prev):
+        """
+        Filter one scanline in pure Python.
+        """
+        if self.filter_type == 0:
+            return scanline
+        line = array('B', scanline)
+        if self.filter_type == 1:
+            # from the end, so that line[i - psize] is not yet filtered
+            for i in range(len(line) - 1, self.psize - 1, -1):
+                line[i] = (line[i] - line[i - self.psize]) & 0xff
+        elif prev is not None:
+            for i in range(len(line)):
+                line[i] = (line[i] - prev[i]) & 0xff
+        return line
+
+    def filter_rows_numpy(self, rows, prev):
+        """
+        Filter a block of scanlines with numpy.
+        """
+        if isinstance(rows, numpy.ndarray):
+            block = rows
+        else:
+            block = numpy.vstack([numpy.frombuffer(r, numpy.uint8)
+                                  if isinstance(r, (bytes, bytearray, array))
+                                  else numpy.asarray(r).reshape(-1)
+                                  for r in rows])
+        if block.dtype != numpy.uint8:
+            block = block.astype(numpy.uint8)
+        stride = self.width * self.psize
+        if block.shape[1] != stride:
+            raise Error("scanline length %d, expected %d"
+                        % (block.shape[1], stride))
+        out = numpy.empty((len(block), stride + 1), numpy.uint8)
+        out[:, 0] = self.filter_type
+        if self.filter_type == 0:
+            out[:, 1:] = block
+        elif self.filter_type == 1:
+            out[:, 1:self.psize+1] = block[:, :self.psize]
+            numpy.subtract(block[:, self.psize:], block[:, :-self.psize],
+                           out=out[:, self.psize+1:])
+        else:
+            if prev is None:
+                out[0, 1:] = block[0]
+            else:
+                numpy.subtract(block[0], prev, out=out[0, 1:])
+            numpy.subtract(block[1:], block[:-1], out=out[1:, 1:])
+        return out, block[-1]
+
+    def write_idat(self, outfile, compressor, data):
+        """
+        Compress a block of filtered data and write what the
+        compressor returns as an IDAT chunk.
+        """
+        compressed = compressor.compress(data)
+        if len(compressed):
+            self.write_chunk(outfile, 'IDAT', compressed)
+
+    def compressor(self):
+        """
+        Return a zlib compressor for the IDAT chunks.
+        """
+        if self.compression is not None:
+            return zlib.compressobj(self.compression)
+        return zlib.compressobj()
+
+    def write_header(self, outfile):
+        """
+        Write the signature and the chunks before the image data.
         """
         # http://www.w3.org/TR/PNG/#5PNG-file-signature
         outfile.write(struct.pack("8B", 137, 80, 78, 71, 13, 10, 26, 10))
 
         # http://www.w3.org/TR/PNG/#11IHDR
-        if self.interlaced:
-            interlaced = 1
-        else:
-            interlaced = 0
-        self.write_chunk(outfile, 'IHDR',
-                         struct.pack("!2I5B", self.width, self.height,
-                                     self.bytes_per_sample * 8,
-                                     self.color_type, 0, 0, interlaced))
+        self.write_ihdr(outfile)
 
         # http://www.w3.org/TR/PNG/#11tRNS
         if self.transparent is not None:
@@ -254,26 +391,28 @@ class Writer:
             self.write_chunk(outfile, 'gAMA',
                              struct.pack("!L", int(self.gamma * 100000)))
 
-        # http://www.w3.org/TR/PNG/#11IDAT
-        if self.compression is not None:
-            compressor = zlib.compressobj(self.compression)
+    def write_ihdr(self, outfile):
+        """
+        Write the IHDR chunk.
+        """
+        if self.interlaced:
+            interlaced = 1
         else:
-            compressor = zlib.compressobj()
+            interlaced = 0
+        self.write_chunk(outfile, 'IHDR',
+                         struct.pack("!2I5B", self.width, self.height,
+                                     self.bytes_per_sample * 8,
+                                     self.color_type, 0, 0, interlaced))
 
-        data = array('B')
-        for scanline in scanlines:
-            data.append(0)
-            data.extend(scanline)
-            if len(data) > self.chunk_limit:
-                compressed = compressor.compress(data.tobytes())
-                if len(compressed):
-                    # print >> sys.stderr, len(data), len(compressed)
-                    self.write_chunk(outfile, 'IDAT', compressed)
-                data = array('B')
+    def write_end(self, outfile, compressor, data):
+        """
+        Compress the remaining scanline data, write the last IDAT
+        chunk and the IEND chunk.
+        """
         if len(data):
-            compressed = compressor.compress(data.tobytes())
+            compressed = compressor.compress(data)
         else:
-            compressed = ''
+            compressed = b''
         flushed = compressor.flush()
         if len(compressed) or len(flushed):
             # print >> sys.stderr, len(data), len(compressed), len(flushed)
@@ -282,6 +421,7 @@ class Writer:
         # http://www.w3.org/TR/PNG/#11IEND
         self.write_chunk(outfile, 'IEND', bytes('', 'utf-8'))
 
+
     def write_array(self, outfile, pixels):
         """
         Encode a pixel array to PNG and write output file.
@@ -397,6 +537,66 @@ class Writer:
                     yield row
 
 
+class StreamWriter(Writer):
+    """
+    PNG encoder for images whose height is not known in advance.
+
+    Scanlines are added one at a time with write_row() and compressed
+    into IDAT chunks of about chunk_limit bytes as they arrive, so the
+    memory used does not depend on the height. close() writes the
+    remaining data and fixes up the height in the IHDR chunk, which
+    needs a seekable output file. The output is identical to that of
+    Writer.write() for the same scanlines.
+    """
+
+    def __init__(self, outfile, width, **kw):
+        Writer.__init__(self, width, 1, **kw)
+        if self.interlaced:
+            raise ValueError("interlacing needs the whole image")
+        self.outfile = outfile
+        self.height = 0
+        self._start = outfile.tell()
+        self.write_header(outfile)
+        self._compressor = self.compressor()
+        self._rows_per_block = self.chunk_limit // (width * self.psize + 1) + 1
+        self._rows = []
+        self._data = b''
+        self._prev = None
+        self.closed = False
+
+    def write_row(self, scanline):
+        """
+        Append one scanline.
+        """
+        self._rows.append(scanline)
+        self.height += 1
+        if len(self._rows) == self._rows_per_block:
+            if len(self._data):
+                self.write_idat(self.outfile, self._compressor, self._data)
+            self._data, self._prev = self.filter_rows(self._rows, self._prev)
+            self._rows = []
+
+    def close(self):
+        """
+        Finish the image. The output file is not closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.height == 0:
+            raise Error("no scanlines written")
+        if self._rows:
+            if len(self._data):
+                self.write_idat(self.outfile, self._compressor, self._data)
+            self._data, self._prev = self.filter_rows(self._rows, self._prev)
+        self.write_end(self.outfile, self._compressor, self._data)
+        self._rows = self._data = self._prev = None
+        end = self.outfile.tell()
+        # the IHDR chunk follows the 8-byte signature
+        self.outfile.seek(self._start + 8)
+        self.write_ihdr(self.outfile)
+        self.outfile.seek(end)
+
 class _readable:
     """
     A simple file-like interface for strings and arrays.
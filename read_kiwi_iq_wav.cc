@@ -121,7 +121,7 @@ DEFUN_DLD (read_kiwi_iq_wav, args, nargout, "[d,sample_rate]=read_kiwi_wav(\"<wa
       // end of file
       break;
     }
-    if (c.id() == "RIFF") {
+    if (c.id() == "RIFF" || c.id() == "RF64") {
       chunk_riff cr;
       file.seekg(pos);
       file.read((char*)(&cr), sizeof(cr));
@@ -129,11 +129,15 @@ DEFUN_DLD (read_kiwi_iq_wav, args, nargout, "[d,sample_rate]=read_kiwi_wav(\"<wa
         error("'WAVE' chunk expected");
         break;
       }
-      const int n = (int(cr.size())-sizeof(chunk_riff)-4)/2074;
-      cell_z.resize(n);
-      cell_last.resize(n);
-      cell_gpssec.resize(n);
-      cell_gpsnsec.resize(n);
+      if (c.id() == "RIFF") { // RF64: the size is in the ds64 chunk, the cells grow as needed
+        const int n = (int(cr.size())-sizeof(chunk_riff)-4)/2074;
+        cell_z.resize(n);
+        cell_last.resize(n);
+        cell_gpssec.resize(n);
+        cell_gpsnsec.resize(n);
+      }
+    } else if (c.id() == "ds64") {
+      file.seekg(file.tellg() + c.size());
     } else if (c.id() == "fmt ") {
       file.seekg(pos);
       file.read((char*)(&fmt), sizeof(fmt));
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## IMA-ADPCM decoder microbenchmark
+##  * checks that the NumPy decoder is bit-exact with the pure-Python one
+##    using the SND (state carried across frames) and W/F (reset per row) semantics
+##  * reports decoded samples per second for both decoders
+
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kiwi.client import ImaAdpcmDecoder, ImaAdpcmDecoderNumpy
+
+def make_frames(num_frames, frame_len, seed=1):
+    """ a mix of realistic (encoder-like) and pathological (random, full-scale) frames """
+    rng = np.random.RandomState(seed)
+    frames = []
+    for i in range(num_frames):
+        if i % 4 == 3:
+            data = rng.randint(0, 256, frame_len)               # random: saturates index and samples
+        else:
+            lo = rng.choice([0,1,2,3,8,9,10,11], frame_len)     # small steps: index hovers near zero
+            hi = rng.choice([0,1,2,3,4,8,9,10,11,12], frame_len)
+            data = lo | (hi << 4)
+        frames.append(bytearray(data.astype(np.uint8).tobytes()))
+    return frames
+
+def decode_all(decoder, frames, reset):
+    out = []
+    for f in frames:
+        if reset:
+            decoder.__init__()
+        out.append(np.asarray(decoder.decode(f), dtype=np.int16))
+    return out
+
+def check(frames, reset):
+    ref = decode_all(ImaAdpcmDecoder(),      frames, reset)
+    new = decode_all(ImaAdpcmDecoderNumpy(), frames, reset)
+    for i,(r,n) in enumerate(zip(ref, new)):
+        if not np.array_equal(r, n):
+            raise AssertionError('frame %d differs at sample %d' % (i, np.flatnonzero(r != n)[0]))
+
+def bench(decoder, frames, reset, min_time=1.0):
+    n = 0
+    t0 = time.time()
+    while True:
+        decode_all(decoder, frames, reset)
+        n += 1
+        dt = time.time() - t0
+        if dt >= min_time:
+            break
+    return n * sum(2*len(f) for f in frames) / dt
+
+if __name__ == '__main__':
+    ## SND: 512 samples per frame, decoder state persists across frames
+    ## W/F: 1024 bins + 10 tail samples per row, decoder reset for each row
+    for name,frame_len,reset in [('SND', 256, False), ('W/F', 517, True)]:
+        frames = make_frames(64, frame_len)
+        check(frames, reset)
+        py = bench(ImaAdpcmDecoder(),      frames, reset)
+        nm = bench(ImaAdpcmDecoderNumpy(), frames, reset)
+        print('%s: bit-exact; python %10.0f samples/sec, numpy %10.0f samples/sec (x%.1f)' % (name, py, nm, nm/py))
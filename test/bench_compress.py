@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## compression ratio and CPU cost of kiwirecorder.py --compress
+##  * synthetic 60 sec recordings: 12 kHz mono audio and 12 kHz IQ (noise plus a few carriers at a
+##    realistic level), fed in 512-sample blocks like the receive thread does
+##  * for every available codec: the compression ratio, the CPU time of the encoder process per
+##    channel (as % of one core in real time) and the time the receive thread spends per block
+##  * the number of seconds can be given on the command line
+
+import os, sys, tempfile, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kiwi import GNSSHeader
+from kiwi.encoder import EncoderProcess, CompressedWriter, CODECS, available_codecs
+
+def make_signal(duration, rate, num_channels, seed=1):
+    rng = np.random.default_rng(seed)
+    n = int(duration*rate)
+    t = np.arange(n) / float(rate)
+    x = 200*rng.standard_normal((n, num_channels))
+    for f,a in [(440, 3000), (1234, 800), (-2500, 1500)]:
+        x[:,0] += a*np.cos(2*np.pi*f*t)
+        if num_channels == 2:
+            x[:,1] += a*np.sin(2*np.pi*f*t)
+    return np.clip(x, -32768, 32767).astype(np.int16).reshape(-1)
+
+def bench(codec, samples, rate, num_channels, directory):
+    encoder = EncoderProcess(codec).start()
+    path = os.path.join(directory, 'bench' + CODECS[codec])
+    writer = CompressedWriter(path, rate, num_channels, True, encoder)
+    block = 512*num_channels
+    t_write = 0
+    num_blocks = 0
+    for k,i in enumerate(range(0, len(samples), block)):
+        t0 = time.time()
+        writer.write(samples[i:i+block], GNSSHeader(0, 0, k, 0))
+        t_write += time.time() - t0
+        num_blocks += 1
+    writer.close()
+    encoder.stop()
+    s = encoder.stats
+    return (float(s['bytes_out']) / s['bytes_in'], s['cpu_user'] + s['cpu_sys'], 1e6*t_write/num_blocks)
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    rate = 12000
+    directory = tempfile.mkdtemp()
+    for name,num_channels in [('audio', 1), ('IQ', 2)]:
+        samples = make_signal(duration, rate, num_channels)
+        for codec in available_codecs():
+            ratio,cpu,us = bench(codec, samples, rate, num_channels, directory)
+            print('%-5s %-4s: ratio %.3f, encoder cpu %.2f sec = %.2f%% of one core per channel, %.1f us per block'
+                  % (name, codec, ratio, cpu, 100*cpu/duration, us))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## IQ frame decoding microbenchmark
+##  * old: astype(float32) + new complex64 array + two strided copies
+##  * complex: KiwiSDRStream._decode_iq(), with a fresh or a reused float32 buffer viewed as complex64
+##  * int16: the byteswap-only path used when _iq_as_int16 is set (kiwirecorder)
+##  * frame sizes: the standard 512 IQ pairs per frame and, for --wb connections, 4x that by default;
+##    other sizes (IQ pairs per frame) can be given on the command line
+
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kiwi import KiwiSDRStream
+
+def decode_old(data):
+    count = len(data) // 2
+    samples = np.ndarray(count, dtype='>h', buffer=data).astype(np.float32)
+    cs      = np.ndarray(count//2, dtype=np.complex64)
+    cs.real = samples[0:count:2]
+    cs.imag = samples[1:count:2]
+    return cs
+
+def decode_int16(data):
+    return np.frombuffer(data, dtype='>h', count=len(data)//2).astype(np.int16)
+
+class Stream(KiwiSDRStream):
+    def __init__(self, reuse):
+        super(Stream, self).__init__()
+        self._reuse_iq_buffer = reuse
+
+def bench(func, data, min_time=0.5):
+    n = 0
+    t0 = time.time()
+    while True:
+        for _ in range(100):
+            func(data)
+        n += 100
+        dt = time.time() - t0
+        if dt >= min_time:
+            return dt / n
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [512, 2048]
+    for num_pairs in sizes:
+        data = memoryview(bytearray(os.urandom(4*num_pairs)))
+        fresh, reused = Stream(False), Stream(True)
+        ref = decode_old(data)
+        for s in [fresh, reused]:
+            if not np.array_equal(ref, s._decode_iq(data)):
+                raise AssertionError('complex IQ mismatch')
+        if not np.array_equal(decode_int16(data)[0::2], ref.real):
+            raise AssertionError('int16 IQ mismatch')
+        old = bench(decode_old, data)
+        print('%5d IQ pairs: old %6.2f us, complex %6.2f us, complex reused %6.2f us, int16 %6.2f us' % (
+            num_pairs, 1e6*old, 1e6*bench(fresh._decode_iq, data), 1e6*bench(reused._decode_iq, data), 1e6*bench(decode_int16, data)))
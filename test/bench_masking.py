@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## WebSocket masking microbenchmark
+##  * checks that the NumPy masker matches the pure-Python one, including the masking key index carried across calls
+##  * reports mask() time for typical client messages (keepalive, set_freq, --fdx stdin lines) and larger buffers
+##  * compares sending "SET keepalive" through Stream.send_message() and Stream.send_constant_message()
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mod_pywebsocket import common
+from mod_pywebsocket.stream import Stream, StreamOptions
+from mod_pywebsocket.util import RepeatedXorMasker
+
+MESSAGES = [('keepalive', b'SET keepalive'),
+            ('set_freq',  b'SET mod=usb low_cut=300 high_cut=2700 freq=14074.000'),
+            ('fdx line',  b'SET mod=iq low_cut=-5000 high_cut=5000 freq=10000.000 # from stdin, --fdx mode'),
+            ('1 kB',      os.urandom(1024)),
+            ('64 kB',     os.urandom(65536))]
+
+def check():
+    for size in [0, 1, 3, 15, 16, 17, 33, 1000, 4099]:
+        data = os.urandom(size)
+        key = os.urandom(4)
+        py, nm = RepeatedXorMasker(key), RepeatedXorMasker(key)
+        for part in [data, data[:7], data]:
+            if py._mask_using_array(part) != nm._mask_using_numpy(part):
+                raise AssertionError('mismatch for %d bytes' % len(part))
+        if py._masking_key_index != nm._masking_key_index:
+            raise AssertionError('masking key index mismatch for %d bytes' % size)
+
+def timeit(func, min_time=0.5):
+    n = 0
+    t0 = time.time()
+    while True:
+        for _ in range(100):
+            func()
+        n += 100
+        dt = time.time() - t0
+        if dt >= min_time:
+            return dt / n
+
+class NullConnection(object):
+    remote_addr = ('bench', 0)
+    def write(self, data):
+        pass
+
+class NullRequest(object):
+    def __init__(self):
+        self.connection = NullConnection()
+        self.ws_version = common.VERSION_HYBI13
+
+def new_stream():
+    options = StreamOptions()
+    options.mask_send = True
+    options.unmask_receive = False
+    return Stream(NullRequest(), options)
+
+if __name__ == '__main__':
+    check()
+    print('numpy masker matches the pure-Python one')
+    key = os.urandom(4)
+    for name,data in MESSAGES:
+        py = timeit(lambda: RepeatedXorMasker(key)._mask_using_array(data))
+        nm = timeit(lambda: RepeatedXorMasker(key)._mask_using_numpy(data))
+        print('%-10s %6d bytes: python %9.2f us, numpy %7.2f us (x%.1f)' % (name, len(data), 1e6*py, 1e6*nm, py/nm))
+
+    stream = new_stream()
+    full = timeit(lambda: stream.send_message('SET keepalive'))
+    cached = timeit(lambda: stream.send_constant_message('SET keepalive'))
+    print('keepalive: send_message %.2f us, send_constant_message %.2f us (x%.1f)' % (1e6*full, 1e6*cached, full/cached))
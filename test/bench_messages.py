@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## KiwiSDRStream message dispatch microbenchmark
+##  * replays synthetic MSG, SND (ADPCM and 16-bit audio, IQ with GNSS header), W/F and EXT frames
+##    through _process_ws_message(), with the sample processing callbacks left empty
+##  * reports microseconds per message for each message type
+
+import os, struct, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kiwi import KiwiSDRStream
+from mod_pywebsocket import common
+from mod_pywebsocket.stream import Stream, StreamOptions
+
+class Options(object):
+    """ the subset of kiwirecorder options used when processing messages """
+    def __init__(self):
+        self.raw = False
+        self.ADC_OV = False
+        self.S_meter = -1
+        self.sdt = 0
+        self.sound = True
+        self.tstamp = False
+        self.stats = False
+        self.idx = 0
+        self.wf_cal = None
+        self.server_host = 'bench'
+
+class NullConnection(object):
+    remote_addr = ('bench', 0)
+    def write(self, data):
+        pass
+
+class NullRequest(object):
+    def __init__(self):
+        self.connection = NullConnection()
+        self.ws_version = common.VERSION_HYBI13
+
+class BenchStream(KiwiSDRStream):
+    def __init__(self, iq, compression):
+        super(BenchStream, self).__init__()
+        self._options = Options()
+        self._type = 'SND'
+        self._stream_name = 'SND'
+        self._IQ_or_DRM_or_stereo = iq
+        self._compression = compression
+        self._keepalive_interval = 1e9   ## keep the (unrelated) keepalive path out of the numbers
+        options = StreamOptions()
+        options.mask_send = True
+        options.unmask_receive = False
+        self._stream = Stream(NullRequest(), options)
+
+def snd_frame(seq, payload):
+    return b'SND' + struct.pack('<BI', 0, seq) + struct.pack('>H', 1000) + payload
+
+MESSAGES = [
+    ('MSG', False, False, b'MSG ' + b'wf_cal=-13 freq_offset=0.000 bandwidth=30000000 version_maj=1 version_min=700'),
+    ('SND', False, True, snd_frame(1, os.urandom(256))),
+    ('SND pcm', False, False, snd_frame(1, os.urandom(1024))),
+    ('SND iq', True, False, snd_frame(1, struct.pack('<BBII', 0, 0, 466823, 886417795) + os.urandom(2048))),
+    ('W/F', False, True, b'W/F' + b'\x00' + struct.pack('<III', 0, 0, 1) + os.urandom(517)),
+    ('EXT', False, False, b'EXT' + b'\x00' + b'drm_bar_pct=50 annotate=x'),
+]
+
+def bench(stream, message, min_time=0.5):
+    n = 0
+    t0 = time.time()
+    while True:
+        for _ in range(200):
+            stream._process_ws_message(message)
+        n += 200
+        dt = time.time() - t0
+        if dt >= min_time:
+            return dt / n
+
+if __name__ == '__main__':
+    for name,iq,compression,message in MESSAGES:
+        stream = BenchStream(iq, compression)
+        for fmt in ['bytes', 'memoryview']:
+            m = message if fmt == 'bytes' else memoryview(bytearray(message))
+            print('%-7s %-10s %5d bytes: %7.2f us/msg' % (name, fmt, len(message), 1e6*bench(stream, m)))
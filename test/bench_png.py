@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## PNG encoder benchmark (png.py)
+##  * checks that the numpy path writes the same file as the pure-Python one for every filter type
+##  * 1024-wide RGB waterfalls (kiwirecorder.py --wf-png) and 1809-wide greyscale faxes (kiwifax.py):
+##    encode time and file size for the pure-Python and numpy paths, filter types None/Sub/Up
+##    and a few compression levels; filtering in pure Python and with numpy on 100 rows
+##  * kiwifax.py rewrites its PNG every 16 rows: total time for a fax of the given height
+##  * the number of waterfall rows can be given on the command line
+
+import io, os, sys, time
+from array import array
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import png
+from kiwirecorder import KiwiWaterfallRecorder
+
+FILTERS = ['None', 'Sub', 'Up']
+
+class Options(object):
+    frequency   = 15000
+    freq_offset = 0
+    wf_cal      = -13
+    mindb       = -155
+    maxdb       = -30
+
+def make_waterfall(num_rows, nbins=1024, seed=1):
+    """ noise with a few drifting carriers, colored like kiwirecorder.py --wf-png """
+    rng = np.random.RandomState(seed)
+    rows = rng.normal(115, 5, (num_rows, nbins))
+    for f0,df,a in [(100, 0.01, 60), (400, -0.05, 40), (700, 0.0, 80)]:
+        f = (f0 + df*np.arange(num_rows)).astype(int) % nbins
+        rows[np.arange(num_rows), f] += a
+    rows = np.clip(rows, 0, 255).astype(np.uint8)
+    return KiwiWaterfallRecorder(Options())._color_lut()[rows].reshape(num_rows, -1)
+
+def make_fax(num_rows, width=1809, seed=1):
+    """ black text-like blocks on white with some noise """
+    rng = np.random.RandomState(seed)
+    img = np.full((num_rows, width), 255, dtype=np.uint8)
+    for _ in range(num_rows // 4):
+        y,x = rng.randint(0, num_rows), rng.randint(0, width)
+        img[y:y+rng.randint(2, 12), x:x+rng.randint(2, 60)] = 0
+    noise = rng.randint(0, 100, img.shape) == 0
+    img[noise] = rng.randint(0, 256, np.count_nonzero(noise))
+    return img
+
+def encode(img, greyscale, scanlines, **kw):
+    fp = io.BytesIO()
+    png.Writer(img.shape[1] // (1 if greyscale else 3), len(img), greyscale=greyscale, **kw).write(fp, scanlines)
+    return fp.getvalue()
+
+def check(img, greyscale):
+    rows = [array('B', r.tobytes()) for r in img[:50]]
+    for filter_type in range(3):
+        ref = encode(img[:50], greyscale, rows, filter_type=filter_type, use_numpy=False)
+        for scanlines in [rows, img[:50]]:
+            if encode(img[:50], greyscale, scanlines, filter_type=filter_type, use_numpy=True) != ref:
+                raise AssertionError('numpy output differs, filter %s' % FILTERS[filter_type])
+
+def timeit(func, min_time=0.5):
+    n = 0
+    t0 = time.time()
+    while True:
+        result = func()
+        n += 1
+        dt = time.time() - t0
+        if dt >= min_time:
+            return dt / n, result
+
+def bench(name, img, greyscale):
+    rows = [array('B', r.tobytes()) for r in img]
+    print('%s: %d x %d' % (name, img.shape[1] // (1 if greyscale else 3), len(img)))
+    t_py,data = timeit(lambda: encode(img, greyscale, rows, use_numpy=False))
+    print('  python  filter None level 6: %8.1f ms %9d bytes' % (1e3*t_py, len(data)))
+    for filter_type in range(3):
+        for level in [1, 3, 6]:
+            t,data = timeit(lambda: encode(img, greyscale, img, filter_type=filter_type, compression=level))
+            t_rows,_ = timeit(lambda: encode(img, greyscale, rows, filter_type=filter_type, compression=level, use_numpy=True))
+            print('  numpy   filter %-4s level %d: %8.1f ms %9d bytes (%.1f ms from rows, x%.1f)'
+                  % (FILTERS[filter_type], level, 1e3*t, len(data), 1e3*t_rows, t_py/t))
+    ## filtering in pure Python is slow: only on a few rows
+    for filter_type in [1, 2]:
+        t_py,_ = timeit(lambda: encode(img[:100], greyscale, rows[:100], filter_type=filter_type, compression=1, use_numpy=False))
+        t,_ = timeit(lambda: encode(img[:100], greyscale, rows[:100], filter_type=filter_type, compression=1))
+        print('  100 rows filter %-4s level 1: python %8.1f ms, numpy %6.1f ms (x%.0f)'
+              % (FILTERS[filter_type], 1e3*t_py, 1e3*t, t_py/t))
+
+def bench_fax_rewrites(img):
+    """ kiwifax.py writes all rows so far after every 16th row """
+    rows = [array('B', r.tobytes()) for r in img]
+    for use_numpy in [False, True]:
+        t0 = time.time()
+        for n in range(16, len(rows)+1, 16):
+            png.Writer(img.shape[1], n, greyscale=True, use_numpy=use_numpy).write(io.BytesIO(), rows[:n])
+        print('  fax rewrites every 16 rows, %s: %.2f sec' % ('numpy ' if use_numpy else 'python', time.time()-t0))
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    waterfall = make_waterfall(num_rows)
+    fax = make_fax(1200)
+    check(waterfall, False)
+    check(fax, True)
+    print('numpy output matches the pure-Python one')
+    bench('RGB waterfall', waterfall, False)
+    bench('greyscale fax', fax, True)
+    bench_fax_rewrites(fax[:800])
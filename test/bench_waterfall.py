@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+## waterfall row processing microbenchmark (kiwirecorder.py --wf)
+##  * checks that KiwiWaterfallRecorder._waterfall_row_numpy() matches the per-bin Python reference:
+##    pixels, min/max, --wf-peaks (including ties and more peaks than unmasked bins) and --wf-auto levels,
+##    for raw uint8 rows and for decompressed int16 rows overshooting 0..255
+##  * reports the time per 1024-bin row and the share of one core used by many connections at
+##    --speed 4 (about 23 rows/sec each) with --wf-png --wf-peaks 10
+##  * the number of connections can be given on the command line
+
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kiwirecorder import KiwiWaterfallRecorder
+
+ROWS_PER_SEC = 23   ## --speed 4
+
+class Options(object):
+    frequency   = 15000
+    freq_offset = 0
+    zoom        = 0
+    wf_cal      = -13
+    mindb       = -155
+    maxdb       = -30
+
+def make_rows(num_rows, nbins=1024, seed=1):
+    """ noise with carriers, masked (zero) ranges and rows with many ties """
+    rng = np.random.RandomState(seed)
+    rows = []
+    for i in range(num_rows):
+        row = rng.randint(90, 130, nbins)
+        row[rng.randint(0, nbins, 20)] = rng.randint(150, 230, 20)
+        if i % 3 == 1:
+            a = rng.randint(0, nbins-100)
+            row[a:a+100] = 0
+        if i % 5 == 2:
+            row = rng.randint(100, 103, nbins)
+        rows.append(row.astype(np.uint8))
+    return rows
+
+def check(rec, rows):
+    for mindb,maxdb in [(-155, -30), (-120, -60), (-80, -80), (-60, -120)]:
+        rec._options.mindb, rec._options.maxdb = mindb, maxdb
+        for row in rows:
+            for samples in [row, row.astype(np.int16) + np.random.randint(-8, 9, len(row)).astype(np.int16)*(row > 200)]:
+                if samples.dtype == np.int16:
+                    samples[5] = -3
+                    samples[6] = 300
+                for num_peaks in [0, 10, 1100]:
+                    ref = rec._waterfall_row_python(samples, True, num_peaks, True)
+                    new = rec._waterfall_row_numpy(samples, True, num_peaks, True)
+                    if ref != new:
+                        raise AssertionError('mismatch: mindb %d maxdb %d peaks %d %s'
+                                             % (mindb, maxdb, num_peaks, samples.dtype))
+
+def bench(rec, rows, func, min_time=1.0):
+    n = 0
+    t0 = time.time()
+    while True:
+        for row in rows:
+            func(row, True, 10, False)
+        n += len(rows)
+        dt = time.time() - t0
+        if dt >= min_time:
+            return dt / n
+
+if __name__ == '__main__':
+    num_connections = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rec = KiwiWaterfallRecorder(Options())
+    rows = make_rows(60)
+    check(rec, rows)
+    print('numpy waterfall rows match the per-bin Python reference')
+    rec._options.mindb, rec._options.maxdb = Options.mindb, Options.maxdb
+    py = bench(rec, rows, rec._waterfall_row_python)
+    nm = bench(rec, rows, rec._waterfall_row_numpy)
+    for name,t in [('python', py), ('numpy', nm)]:
+        print('%-6s %8.1f us per row, %d connections at --speed 4: %6.1f%% of one core'
+              % (name, 1e6*t, num_connections, 100*t*ROWS_PER_SEC*num_connections))
+    print('speedup x%.1f' % (py/nm))